@@ -1,12 +1,15 @@
 """ print and visualize the logs produced by exapmle.py """
 import matplotlib.pyplot as plt  # type: ignore
 
-from resource_monitor.report import parse_event_log, parse_resource_log
+import numpy as np
+
+from resource_monitor.report import attribute_events, parse_event_log, parse_resource_log, sample_weights
 
 
 if __name__ == "__main__":
     # parse the event log
-    event_times = parse_event_log("my_func_event.log")
+    # parsed logs are cached next to them, parsing again only reads what is appended since
+    event_times = parse_event_log("my_func_event.log", cache=True)
     for k, times in event_times.items():
         # `times` is a np.ndarray shape=(N,2) dtype=np.float64,
         # meaning the start/end time points of the event
@@ -15,20 +18,36 @@ if __name__ == "__main__":
         print(f"event: {k}, mean elapse: {mean_elapse:.4e} s")
 
     # parse the resource log
-    global_info, resource_usage = parse_resource_log("my_func_resource.log")
+    global_info, resource_usage = parse_resource_log("my_func_resource.log", cache=True)
     print("machine resource information:")
     for k, v in global_info.items():
         print(k, ": ", v)
 
-    # extract the time column
+    # attribute the resource usage to each occurrence of the events
+    attribution = attribute_events(event_times, resource_usage)
+    for k, attributed in attribution.items():
+        print(f"event: {k}")
+        for metric in ("cpu_seconds", "rss_mb_peak", "rss_mb_delta", "read_mb_delta", "write_mb_delta"):
+            # mean among occurrences
+            print(f"    mean {metric}: {np.nanmean(attributed[metric]):.4e}")
+
+    # extract the time column, and weight the samples by their sampling interval
     times = resource_usage["time"]
+    weights = sample_weights(resource_usage)
     del resource_usage["time"]
+    resource_usage.pop("sampling_interval", None)
+
+    # the logger's own scheduling, if recorded
+    if "missed_ticks" in resource_usage:
+        print("sampling latency mean: ", resource_usage.pop("sampling_latency").mean(),
+              " deadline slip max: ", resource_usage.pop("deadline_slip").max(),
+              " missed ticks: ", resource_usage.pop("missed_ticks")[-1])
 
     # plot each of the resource and save
     fig = plt.figure(figsize=(5 * len(resource_usage), 5), facecolor="w")
     axes = fig.subplots(ncols=len(resource_usage), nrows=1)
     for i, (resource_name, usage) in enumerate(resource_usage.items()):
-        print(resource_name, " peak: ", usage.max(), " average: ", usage.mean(), )
+        print(resource_name, " peak: ", usage.max(), " average: ", np.average(usage, weights=weights), )
         ax = axes[i]
         ax.set_title(resource_name + " usage")
         ax.set_xlabel("time(s)")
@@ -2,17 +2,28 @@
     Functionalities to monitor the elapse and CPU/GPU/Mem/Disk usage
     of Python code or non-Python process.
 """
-from .event_logger import EventLogger
+from .event_logger import EventLogger, BinaryEventLogger, AggregateEventLogger
 from .resource_logger import ResourceLogger
-from .utils import setup_root_resource_logger, setup_root_event_logger,\
-    get_root_event_logger, monitor_function, monitor_region
+from .shared_event_logger import SharedEventLogger, SharedEventDrainer
+from .stack_profiler import StackProfiler
+from .tracer import FunctionTracer
+from .utils import setup_root_resource_logger, setup_root_event_logger, setup_root_stack_profiler,\
+    setup_root_tracer, get_root_event_logger, monitor_function, monitor_region
 
 
 __all__ = [
     EventLogger.__name__,
+    BinaryEventLogger.__name__,
+    AggregateEventLogger.__name__,
+    SharedEventLogger.__name__,
+    SharedEventDrainer.__name__,
     ResourceLogger.__name__,
+    StackProfiler.__name__,
+    FunctionTracer.__name__,
     setup_root_event_logger.__name__,
     setup_root_resource_logger.__name__,
+    setup_root_stack_profiler.__name__,
+    setup_root_tracer.__name__,
     get_root_event_logger.__name__,
     monitor_function.__name__,
     monitor_region.__name__,
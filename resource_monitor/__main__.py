@@ -9,9 +9,14 @@ if __name__ == "__main__":
     parser.add_argument(
         "--pid", type=str, required=False, default=None,
         help="Process PID separated by comma, like \"1,2,3\". If not given, monitor current process.")
+    parser.add_argument(
+        "--cgroup", type=str, required=False, default=None,
+        help="A cgroup v2 to monitor as a whole: a directory, a path under /sys/fs/cgroup, or \"self\" for the "
+             "cgroup of the process. Without --pid, only the cgroup is monitored, until it is removed."
+    )
     parser.add_argument(
         "--output", type=str, required=False, default="",
-        help="Output file. If not provided, output to stdout."
+        help="Output file, or the collector address with --format agent. If not provided, output to stdout."
     )
     parser.add_argument(
         "--gpu_ids", type=str, required=False, default="",
@@ -21,10 +26,97 @@ if __name__ == "__main__":
         "--interval", type=float, required=False, default=1.0,
         help="Time interval (second) between recording. Defaults to 1.0"
     )
+    parser.add_argument(
+        "--backend", type=str, required=False, default="auto", choices=["auto", "proc", "psutil"],
+        help="Sampling backend. \"proc\" reads /proc directly (Linux only). Defaults to \"auto\"."
+    )
+    parser.add_argument(
+        "--format", type=str, required=False, default="csv", choices=["csv", "binary", "rollup", "agent"],
+        help="Output format. \"binary\" is compact and memory-mappable, \"rollup\" keeps recent raw samples and "
+             "downsampled tiers in a file of fixed size, both require --output. \"agent\" sends the samples to "
+             "the collector (python -m resource_monitor.remote) at --output, \"host:port\" or \"unix:/path\". "
+             "Defaults to \"csv\"."
+    )
+    parser.add_argument(
+        "--rollup_raw_seconds", type=float, required=False, default=600.,
+        help="With --format rollup, time span (second) of the raw samples kept. Defaults to 600."
+    )
+    parser.add_argument(
+        "--rollup_tiers", type=str, required=False, default="10:86400,300:2592000",
+        help="With --format rollup, resolution:retention (second) of the downsampled tiers, separated by comma. "
+             "Defaults to \"10:86400,300:2592000\"."
+    )
+    parser.add_argument(
+        "--flush_every", type=int, required=False, default=1,
+        help="Flush the output every N rows. Defaults to 1."
+    )
+    parser.add_argument(
+        "--track_children", action="store_true",
+        help="Also monitor the descendants of the processes."
+    )
+    parser.add_argument(
+        "--per_pid_output", type=str, required=False, default=None,
+        help="If provided, also write the usage of every process to this file."
+    )
+    parser.add_argument(
+        "--gpu_process_utilization", action="store_true",
+        help="Also record the SM utilization percent of the processes on each GPU."
+    )
+    parser.add_argument(
+        "--metrics", type=str, required=False, default=None,
+        help="Collectors and their intervals (second), like \"cpu:0.01,memory,io,disk,smaps:1\". "
+             "Choices: cpu, memory, io, disk, gpu, smaps, cgroup, diskdev, netdev. Defaults to cpu,memory,io,disk "
+             "(and gpu with --gpu_ids, cgroup with --cgroup, diskdev with --disk_devices, "
+             "netdev with --net_interfaces)."
+    )
+    parser.add_argument(
+        "--serve_port", type=int, required=False, default=None,
+        help="If provided, serve the latest sample in OpenMetrics format over HTTP at this port."
+    )
+    parser.add_argument(
+        "--serve_unix", type=str, required=False, default=None,
+        help="If provided, serve the latest sample in OpenMetrics format over HTTP at this Unix socket."
+    )
+    parser.add_argument(
+        "--serve_host", type=str, required=False, default="127.0.0.1",
+        help="The address to serve at with --serve_port. Defaults to \"127.0.0.1\"."
+    )
+    parser.add_argument(
+        "--serve_windows", type=str, required=False, default="60,300",
+        help="Rolling windows (second) of the served min/max/mean, separated by comma. Defaults to \"60,300\"."
+    )
+    parser.add_argument(
+        "--skip_calibration", action="store_true",
+        help="Start without measuring the latency of sampling, nor checking the interval against it."
+    )
+    parser.add_argument(
+        "--calibration_cache", type=str, required=False, default=None,
+        help="If provided, reuse the latency of sampling measured by an earlier run, cached in this JSON file."
+    )
+    parser.add_argument(
+        "--disk_devices", type=str, required=False, default=None,
+        help="Patterns of the disks of the diskdev collector, separated by comma, like \"nvme*n1,sda\". "
+             "Defaults to all the whole disks but loop and RAM disks."
+    )
+    parser.add_argument(
+        "--net_interfaces", type=str, required=False, default=None,
+        help="Patterns of the network interfaces of the netdev collector, separated by comma, like \"eth*\". "
+             "Defaults to the physical interfaces."
+    )
     args = parser.parse_args()
     pids = [int(pid) for pid in args.pid.split(",")] if args.pid is not None else None
     output = args.output if len(args.output) > 0 else None
     interval = args.interval
     assert interval > 0
     gpu_ids = [int(i) for i in args.gpu_ids.split(",")] if len(args.gpu_ids) > 0 else []
-    ResourceLogger(pid=pids, output=output, interval=args.interval, gpu_ids=gpu_ids).run()
+    rollup_tiers = [tuple(float(v) for v in t.split(":")) for t in args.rollup_tiers.split(",") if len(t) > 0]
+    disk_devices = args.disk_devices.split(",") if args.disk_devices is not None else None
+    net_interfaces = args.net_interfaces.split(",") if args.net_interfaces is not None else None
+    ResourceLogger(pid=pids, output=output, interval=args.interval, gpu_ids=gpu_ids, backend=args.backend,
+                   output_format=args.format, flush_every=args.flush_every, track_children=args.track_children,
+                   per_pid_output=args.per_pid_output, gpu_process_utilization=args.gpu_process_utilization,
+                   metrics=args.metrics, serve_port=args.serve_port, serve_unix=args.serve_unix,
+                   serve_host=args.serve_host, serve_windows=[float(w) for w in args.serve_windows.split(",")],
+                   rollup_raw_seconds=args.rollup_raw_seconds, rollup_tiers=rollup_tiers, cgroup=args.cgroup,
+                   calibrate=not args.skip_calibration, calibration_cache=args.calibration_cache,
+                   disk_devices=disk_devices, net_interfaces=net_interfaces).run()
@@ -0,0 +1,261 @@
+"""
+    Summarize many runs at once, e.g. the logs of all processes of a day.
+
+    A run is a pair of `resource_monitor_PID<pid>.log` and `event_monitor_PID<pid>.log` in the same directory
+        (the default names of `setup_root_resource_logger` and `setup_root_event_logger`), either may be missing.
+    Every run is parsed and reduced to small statistics in a process pool, and the statistics are merged
+        by group of runs into one table:
+        * per event: the count, mean/p50/p99/p999/max of the durations in seconds,
+            merged through log-bucketed histograms (see `event_logger.AggregateEventLogger`);
+        * per resource column: the max and the mean of the per-run peaks, and the mean of the per-run means.
+
+    Usage:
+        python -m resource_monitor.report logs/ "other_logs/**/*.log" --group_by date,info:cpu_count
+"""
+import argparse
+import csv
+import os
+import re
+import sys
+from glob import glob
+from multiprocessing import Pool
+from time import localtime, strftime
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+from numpy.typing import NDArray
+
+from .event_logger import HISTOGRAM_SUB_BUCKETS
+from .log_format import FRESHNESS_COLUMN_PREFIX, SCHEDULING_COLUMNS
+from .report import (
+    _load_event_stats_snapshot, _merge_event_stats, _summarize_event_stats, parse_event_log, parse_resource_log,
+    sample_weights
+)
+
+
+LOG_NAME_PATTERN = re.compile(r"^(resource|event)_monitor_PID(\d+)\.log$")
+# the metadata of runs to group by, besides "info:<key>" of the global resource information
+GROUP_KEYS = ("all", "dir", "pid", "date")
+
+
+def find_runs(paths: Sequence[str]) -> List[Dict[str, Any]]:
+    """find the runs in directories (searched recursively) or glob patterns
+
+    Args:
+        paths (Sequence[str]): directories or glob patterns of the log files
+
+    Returns:
+        List[Dict[str, Any]]: runs sorted by directory and PID, with keys "dir", "pid", "resource_log", "event_log"
+    """
+    filenames = []
+    for path in paths:
+        if os.path.isdir(path):
+            filenames.extend(glob(os.path.join(path, "**", "*_monitor_PID*.log"), recursive=True))
+        else:
+            filenames.extend(glob(path, recursive=True))
+
+    runs: Dict[Tuple[str, int], Dict[str, Any]] = {}
+    for filename in filenames:
+        match = LOG_NAME_PATTERN.match(os.path.basename(filename))
+        if match is None:
+            continue
+        directory, pid = os.path.dirname(os.path.abspath(filename)), int(match.group(2))
+        run = runs.setdefault(
+            (directory, pid), {"dir": directory, "pid": pid, "resource_log": None, "event_log": None}
+        )
+        run[f"{match.group(1)}_log"] = filename
+    return [runs[k] for k in sorted(runs)]
+
+
+def _histogram_buckets(durations_ns: NDArray[np.int64]) -> NDArray[np.int64]:
+    """ vectorized `event_logger.histogram_bucket` """
+    durations_ns = np.maximum(durations_ns, 0)
+    # the bit length, exact since the durations are below 2**53 ns
+    _, exponents = np.frexp(durations_ns.astype(np.float64))
+    shifts = np.maximum(exponents - 4, 0)
+    sub_buckets = (durations_ns >> shifts) & (HISTOGRAM_SUB_BUCKETS - 1)
+    return np.where(
+        durations_ns < 16, durations_ns, 16 + (exponents - 5) * HISTOGRAM_SUB_BUCKETS + sub_buckets
+    ).astype(np.int64)
+
+
+def _event_stats(event_times: Dict[str, NDArray[np.float64]]) -> Dict[str, Dict[str, Any]]:
+    """ the raw statistics of the ended occurrences, same as the snapshots of AggregateEventLogger """
+    events = {}
+    for event_name, times in event_times.items():
+        times = np.asarray(times)
+        ended = (times[:, 1] > 0) & (times[:, 1] >= times[:, 0])
+        durations = np.round((times[ended, 1] - times[ended, 0]) * 1e9).astype(np.int64)
+        if len(durations) == 0:
+            continue
+        buckets, counts = np.unique(_histogram_buckets(durations), return_counts=True)
+        events[event_name] = {
+            "count": len(durations),
+            "sum": int(durations.sum()),
+            "min": int(durations.min()),
+            "max": int(durations.max()),
+            "histogram": [[int(b), int(n)] for b, n in zip(buckets, counts)],
+        }
+    return events
+
+
+def summarize_run(run: Dict[str, Any], cache: bool = False) -> Dict[str, Any]:
+    """parse and reduce the logs of a run, in a worker process
+
+    Args:
+        run (Dict[str, Any]): a run from `find_runs`
+        cache (bool, optional): parse through the sidecar caches, see `cache`. Defaults to False.
+
+    Returns:
+        Dict[str, Any]:
+            the run with its metadata ("date", "global_info") and statistics ("events", "resources"),
+            or with "error" if the logs cannot be parsed.
+    """
+    run = dict(run, events={}, resources={}, global_info={})
+    try:
+        log = run["resource_log"] if run["resource_log"] is not None else run["event_log"]
+        run["date"] = strftime("%Y-%m-%d", localtime(os.path.getmtime(log)))
+
+        if run["event_log"] is not None:
+            with open(run["event_log"], "rb") as f:
+                is_aggregate = f.read(1) == b"{"
+            if is_aggregate:
+                run["events"] = _load_event_stats_snapshot(run["event_log"])
+            else:
+                run["events"] = _event_stats(parse_event_log(run["event_log"], cache=cache))
+
+        if run["resource_log"] is not None:
+            global_info, resource_usage = parse_resource_log(run["resource_log"], cache=cache)
+            run["global_info"] = global_info
+            if len(resource_usage["time"]) > 0:
+                weights = sample_weights(resource_usage)
+                for column, values in resource_usage.items():
+                    if column == "time" or column in SCHEDULING_COLUMNS or column.startswith(FRESHNESS_COLUMN_PREFIX):
+                        continue
+                    run["resources"][column] = {
+                        "peak": float(np.max(values)),
+                        "mean": float(np.average(values, weights=weights)),
+                    }
+    except Exception as e:  # pylint: disable=broad-except
+        # a broken run should not stop the batch
+        run["error"] = f"{type(e).__name__}: {e}"
+    return run
+
+
+def _summarize_run_with_cache(run: Dict[str, Any]) -> Dict[str, Any]:
+    return summarize_run(run, cache=True)
+
+
+def group_of(run: Dict[str, Any], group_by: Sequence[str]) -> str:
+    """ the group of a run, e.g. "date=2024-01-01|info:cpu_count=8" """
+    if len(group_by) == 0 or list(group_by) == ["all"]:
+        return "all"
+    values = []
+    for key in group_by:
+        if key.startswith("info:"):
+            values.append(f"{key}={run['global_info'].get(key[len('info:'):], '')}")
+        else:
+            assert key in GROUP_KEYS, f"unknown group key {key}, expected one of {GROUP_KEYS} or info:<key>"
+            values.append(f"{key}={run[key]}")
+    return "|".join(values)
+
+
+def merge_runs(runs: Iterable[Dict[str, Any]], group_by: Sequence[str]) -> List[List[Any]]:
+    """merge the statistics of the runs by group
+
+    Args:
+        runs (Iterable[Dict[str, Any]]): results of `summarize_run`
+        group_by (Sequence[str]): the metadata to group by, see GROUP_KEYS
+
+    Returns:
+        List[List[Any]]: rows of (group, runs, kind, name, statistic, value), kind is "event" or "resource"
+    """
+    groups: Dict[str, Dict[str, Any]] = {}
+    for run in runs:
+        group = groups.setdefault(group_of(run, group_by), {"runs": 0, "events": {}, "resources": {}})
+        group["runs"] += 1
+        _merge_event_stats(group["events"], run["events"])
+        for column, stats in run["resources"].items():
+            group["resources"].setdefault(column, []).append([stats["peak"], stats["mean"]])
+
+    rows: List[List[Any]] = []
+    for group_name in sorted(groups):
+        group = groups[group_name]
+        for event_name, summary in sorted(_summarize_event_stats(group["events"]).items()):
+            for statistic in ("count", "mean", "p50", "p99", "p999", "max"):
+                rows.append([group_name, group["runs"], "event", event_name, statistic, summary[statistic]])
+        for column, per_run in group["resources"].items():
+            peaks, means = np.array(per_run).T
+            rows.append([group_name, group["runs"], "resource", column, "peak_max", float(peaks.max())])
+            rows.append([group_name, group["runs"], "resource", column, "peak_mean", float(peaks.mean())])
+            rows.append([group_name, group["runs"], "resource", column, "mean", float(means.mean())])
+    return rows
+
+
+def summarize_runs(
+    paths: Sequence[str],
+    group_by: Sequence[str] = ("all",),
+    processes: Optional[int] = None,
+    cache: bool = False,
+) -> List[List[Any]]:
+    """find, parse and merge the runs in a process pool, see `find_runs`, `summarize_run` and `merge_runs`
+
+    Args:
+        paths (Sequence[str]): directories or glob patterns of the log files
+        group_by (Sequence[str], optional): the metadata to group by. Defaults to ("all",), a single group.
+        processes (Optional[int], optional): size of the process pool. Defaults to None, the number of CPUs.
+        cache (bool, optional): parse through the sidecar caches, see `cache`. Defaults to False.
+
+    Returns:
+        List[List[Any]]: see `merge_runs`
+    """
+    runs = find_runs(paths)
+    processes = processes if processes is not None else (os.cpu_count() or 1)
+    worker = _summarize_run_with_cache if cache else summarize_run
+    results = []
+    with Pool(processes) as pool:
+        # results are small, big chunks keep the pool overhead low with thousands of runs
+        for run in pool.imap_unordered(worker, runs, chunksize=max(1, len(runs) // (4 * processes))):
+            if "error" in run:
+                print(f"skipped run {run['dir']} PID{run['pid']}: {run['error']}", file=sys.stderr)
+                continue
+            results.append(run)
+    return merge_runs(results, group_by)
+
+
+def main() -> None:
+    """ commandline interface """
+    parser = argparse.ArgumentParser(prog="python -m resource_monitor.report")
+    parser.add_argument(
+        "paths", type=str, nargs="+",
+        help="Directories (searched recursively) or glob patterns of resource_monitor_PID*.log/event_monitor_PID*.log."
+    )
+    parser.add_argument(
+        "--group_by", type=str, required=False, default="all",
+        help="Run metadata to group by, separated by comma: all, dir, pid, date, or info:<key> of the global "
+             "resource information like info:cpu_count. Defaults to \"all\"."
+    )
+    parser.add_argument(
+        "--processes", type=int, required=False, default=None,
+        help="Number of worker processes. Defaults to the number of CPUs."
+    )
+    parser.add_argument(
+        "--cache", action="store_true",
+        help="Parse the logs through sidecar caches, so a second report only parses what is appended."
+    )
+    parser.add_argument(
+        "--output", type=str, required=False, default="",
+        help="Output CSV file. If not provided, output to stdout."
+    )
+    args = parser.parse_args()
+    rows = summarize_runs(args.paths, args.group_by.split(","), args.processes, args.cache)
+    output = open(args.output, "w", encoding="utf-8", newline="") if len(args.output) > 0 else sys.stdout
+    writer = csv.writer(output)
+    writer.writerow(["group", "runs", "kind", "name", "statistic", "value"])
+    writer.writerows(rows)
+    if output is not sys.stdout:
+        output.close()
+
+
+if __name__ == "__main__":
+    main()
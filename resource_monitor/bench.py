@@ -0,0 +1,356 @@
+"""
+    Benchmarks of the monitor's own overhead, written to a JSON file to track regressions between releases.
+
+    * sampling: the latency distribution of polling the processes and of every collector, and of a whole tick;
+    * instrumentation: the per-call overhead of `monitor_function`, `monitor_region`, the event loggers and
+        the function tracer, against an undecorated baseline;
+    * startup: the time of importing the package and of `setup_root_resource_logger`/`setup_root_event_logger`,
+        each measured in a fresh interpreter;
+    * parsing: the throughput (MB/s) of `parse_event_log`/`parse_resource_log` on synthetic logs of every format.
+
+    Latencies are in seconds, per-call overheads in nanoseconds. The loops are repeated,
+        and the best repetition is kept for the per-call figures, to filter out the noise of the machine.
+
+    Usage:
+        python -m resource_monitor.bench --output bench.json
+        python -m resource_monitor.bench --parts sampling,parsing --scale 0.1
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+from time import perf_counter, perf_counter_ns, time
+from typing import Any, Callable, Dict, List, Optional, Sequence, TextIO
+
+import numpy as np
+
+from .collectors import COLLECTORS, resolve_cgroup
+from .event_logger import AggregateEventLogger, BinaryEventLogger, EventLogger
+from .log_format import BinaryResourceWriter, CsvResourceWriter
+from .report import parse_event_log, parse_resource_log
+from .resource_logger import ResourceLogger
+from .tracer import FunctionTracer
+from .utils import monitor_function, monitor_region
+
+
+PARTS = ("sampling", "instrumentation", "startup", "parsing")
+EVENT_LOGGER_MODES = ("text", "binary", "aggregate")
+
+
+def latency_stats(latencies: Sequence[float]) -> Dict[str, float]:
+    """ the count, mean, min, p50, p99 and max of latencies """
+    values = np.asarray(latencies, dtype=np.float64)
+    return {
+        "count": len(values), "mean": float(values.mean()), "min": float(values.min()),
+        "p50": float(np.percentile(values, 50)), "p99": float(np.percentile(values, 99)), "max": float(values.max()),
+    }
+
+
+def bench_sampling(rounds: int = 1000, backend: str = "auto") -> Dict[str, Any]:
+    """the latency distributions of sampling the current process
+
+    Args:
+        rounds (int, optional): The samples taken. Defaults to 1000.
+        backend (str, optional): The sampling backend, see ResourceLogger. Defaults to "auto".
+
+    Returns:
+        Dict[str, Any]: the backend, and the latency statistics of "poll", every collector and "tick"
+    """
+    metrics = [name for name in COLLECTORS if name not in ("gpu", "cgroup")]
+    cgroup: Optional[str] = None
+    try:
+        cgroup = resolve_cgroup("self")
+        metrics.append("cgroup")
+    except (OSError, AssertionError):
+        # not in a cgroup v2 hierarchy
+        pass
+    logger = ResourceLogger(os.getpid(), os.devnull, backend=backend, metrics=metrics, cgroup=cgroup)
+    latencies: Dict[str, List[float]] = dict((name, []) for name in ["poll"] + [c.name for c in logger.collectors])
+    ticks = []
+    try:
+        for _ in range(rounds):
+            start = perf_counter()
+            cpu_times = logger.sampler.poll()
+            latencies["poll"].append(perf_counter() - start)
+            for collector in logger.collectors:
+                collector_start = perf_counter()
+                collector.collect(cpu_times, collector_start)
+                latencies[collector.name].append(perf_counter() - collector_start)
+            ticks.append(perf_counter() - start)
+    finally:
+        logger.clean_up()
+        logger.writer.close()
+    result: Dict[str, Any] = {"backend": logger.backend}
+    result.update((name, latency_stats(values)) for name, values in latencies.items())
+    result["tick"] = latency_stats(ticks)
+    return result
+
+
+def _per_call_ns(function: Callable[[], Any], calls: int, repeats: int) -> float:
+    """ the time (ns) per call of `function`, of the best repetition """
+    best = float("inf")
+    for _ in range(repeats):
+        start = perf_counter_ns()
+        for _ in range(calls):
+            function()
+        best = min(best, (perf_counter_ns() - start) / calls)
+    return best
+
+
+def _new_event_logger(mode: str, output: str) -> EventLogger:
+    if mode == "binary":
+        return BinaryEventLogger(output)
+    if mode == "aggregate":
+        return AggregateEventLogger(output)
+    return EventLogger(output)
+
+
+def _reference_wrapper(func: Callable[[], Any], output: TextIO) -> Callable[[], Any]:
+    """
+        The text-mode `monitor_function` wrapper before threads and asyncio tasks were recorded, one line per
+            start/end without the thread and task columns, written straight to the file.
+        The overhead of `monitor_function` with the text event logger should not exceed the overhead of this one.
+    """
+    call_counter = 0
+
+    def func_wrapper(*args, **kwargs):
+        nonlocal call_counter
+        call_counter += 1
+        my_counter = call_counter
+        output.write(f"{perf_counter()},start,{func.__name__},{my_counter}\n")
+        results = func(*args, **kwargs)
+        output.write(f"{perf_counter()},end,{func.__name__},{my_counter}\n")
+        return results
+
+    return func_wrapper
+
+
+def bench_instrumentation(calls: int = 100000, repeats: int = 5) -> Dict[str, Any]:
+    """the per-call overhead (ns) of the instrumentation of every event logger, over an undecorated function
+
+    Args:
+        calls (int, optional): The calls per repetition. Defaults to 100000.
+        repeats (int, optional): The repetitions, the best is kept. Defaults to 5.
+
+    Returns:
+        Dict[str, Any]:
+            "baseline_ns", the time per call of an empty function, and per event logger mode,
+            the overhead per call of "monitor_function", "monitor_region", "log_start_end" (logging directly)
+            and "tracer" (FunctionTracer tracing every call).
+            For "text", "reference_monitor_function_ns" is the overhead of the original text wrapper
+            (see `_reference_wrapper`), which "monitor_function_ns" should not exceed.
+    """
+    # defined out of the package, which the tracer does not trace
+    namespace: Dict[str, Any] = {"__name__": "resource_monitor_bench_target"}
+    exec("def target():\n    pass\n", namespace)  # pylint: disable=exec-used
+    target = namespace["target"]
+    baseline = _per_call_ns(target, calls, repeats)
+    result: Dict[str, Any] = {"calls": calls, "baseline_ns": baseline}
+    with tempfile.TemporaryDirectory() as directory:
+        for mode in EVENT_LOGGER_MODES:
+            logger = _new_event_logger(mode, os.path.join(directory, f"{mode}.log"))
+            decorated = monitor_function(logger)(target)
+
+            def region(logger: EventLogger = logger) -> None:
+                with monitor_region("region", logger):
+                    pass
+
+            def log_start_end(logger: EventLogger = logger) -> None:
+                logger.log_start("event", 0)
+                logger.log_end("event", 0)
+
+            tracer = FunctionTracer(logger, include=["resource_monitor_bench_target.*"])
+            tracer.start()
+            try:
+                traced = _per_call_ns(target, calls, repeats)
+            finally:
+                tracer.stop()
+            result[mode] = {
+                "monitor_function_ns": _per_call_ns(decorated, calls, repeats) - baseline,
+                "monitor_region_ns": _per_call_ns(region, calls, repeats) - baseline,
+                "log_start_end_ns": _per_call_ns(log_start_end, calls, repeats) - baseline,
+                "tracer_ns": traced - baseline,
+            }
+            logger.clean_up()
+        with open(os.path.join(directory, "reference.log"), "w", encoding="utf-8") as output:
+            reference = _reference_wrapper(target, output)
+            result["text"]["reference_monitor_function_ns"] = _per_call_ns(reference, calls, repeats) - baseline
+    return result
+
+
+_STARTUP_SCRIPT = """
+import json, os, sys
+from time import perf_counter
+start = perf_counter()
+import resource_monitor
+from resource_monitor import utils
+imported = perf_counter()
+utils.setup_root_resource_logger(os.path.join(sys.argv[1], "resource.log"), interval=0.1)
+resource_logger = perf_counter()
+utils.setup_root_event_logger(os.path.join(sys.argv[1], "event.log"), mode="binary")
+event_logger = perf_counter()
+utils.clean_up()
+threaded_start = perf_counter()
+utils.setup_root_resource_logger(
+    os.path.join(sys.argv[1], "threaded.log"), interval=0.1, threaded=True, calibrate=False
+)
+threaded = perf_counter()
+utils.clean_up()
+print(json.dumps({
+    "import": imported - start, "setup_root_resource_logger": resource_logger - imported,
+    "setup_root_event_logger": event_logger - resource_logger,
+    "setup_root_resource_logger_threaded": threaded - threaded_start,
+}))
+"""
+
+
+def bench_startup(repeats: int = 5) -> Dict[str, Any]:
+    """the startup times (seconds), each repetition in a fresh interpreter
+
+    Args:
+        repeats (int, optional): The interpreters started. Defaults to 5.
+
+    Returns:
+        Dict[str, Any]:
+            the statistics of "import" (the package), "setup_root_resource_logger" (until the subprocess samples),
+            "setup_root_event_logger" (binary) and "setup_root_resource_logger_threaded" (without calibration)
+    """
+    package_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    python_path = [package_root] + [p for p in os.environ.get("PYTHONPATH", "").split(os.pathsep) if len(p) > 0]
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(python_path))
+    times: Dict[str, List[float]] = {}
+    for _ in range(repeats):
+        with tempfile.TemporaryDirectory() as directory:
+            output = subprocess.run(
+                [sys.executable, "-c", _STARTUP_SCRIPT, directory], env=env, check=True, capture_output=True, text=True
+            ).stdout
+        for name, value in json.loads(output.strip().splitlines()[-1]).items():
+            times.setdefault(name, []).append(value)
+    return dict((name, latency_stats(values)) for name, values in times.items())
+
+
+def _write_event_log(mode: str, output: str, n_events: int) -> None:
+    """ a synthetic event log of `n_events` occurrences of 16 events, by 4 interleaved ids each """
+    logger = _new_event_logger(mode, output)
+    for i in range(n_events // 4):
+        for j in range(4):
+            logger.log_start(f"event_{i % 16}", i * 4 + j)
+        for j in range(4):
+            logger.log_end(f"event_{i % 16}", i * 4 + j)
+    logger.clean_up()
+
+
+def _write_resource_log(output_format: str, output: str, n_rows: int) -> None:
+    """ a synthetic resource log with the columns of the default collectors """
+    logger_columns = ["time", "cpu_percent", "cpu_percent_global", "rss_mb", "vms_mb", "vm_used_mb", "swap_used_mb",
+                      "read_count", "read_mb", "write_count", "write_mb", "sampling_latency", "deadline_slip",
+                      "missed_ticks"]
+    writer = BinaryResourceWriter(output) if output_format == "binary" else CsvResourceWriter(output)
+    writer.write_preamble("synthetic", {"cpu_count": 1}, logger_columns)
+    random = np.random.default_rng(0)
+    for i in range(n_rows):
+        writer.write_row([i * 0.01, random.random() * 100, 12.5, 1024 + i % 100, 4096, 8192, 0, i, i // 10, i, i // 10,
+                          1e-5, 1e-6, 0])
+        if i % 1024 == 1023:
+            writer.flush()
+    writer.close()
+
+
+def _throughput(filename: str, parse: Callable[[str], Any], repeats: int) -> Dict[str, float]:
+    """ the size of a log and the throughput of parsing it, of the best repetition """
+    size = os.path.getsize(filename)
+    best = min(_timed(parse, filename) for _ in range(repeats))
+    return {"mb": size / 1024**2, "seconds": best, "mb_per_s": size / 1024**2 / best}
+
+
+def _timed(parse: Callable[[str], Any], filename: str) -> float:
+    start = perf_counter()
+    parse(filename)
+    return perf_counter() - start
+
+
+def bench_parsing(n_events: int = 200000, n_rows: int = 200000, repeats: int = 3) -> Dict[str, Any]:
+    """the throughput of the parsers on synthetic logs
+
+    Args:
+        n_events (int, optional): The event occurrences of the event logs. Defaults to 200000.
+        n_rows (int, optional): The samples of the resource logs. Defaults to 200000.
+        repeats (int, optional): The repetitions, the best is kept. Defaults to 3.
+
+    Returns:
+        Dict[str, Any]: per log, "mb" (its size), "seconds" (parsing it) and "mb_per_s"
+    """
+    result: Dict[str, Any] = {"n_events": n_events, "n_rows": n_rows}
+    with tempfile.TemporaryDirectory() as directory:
+        for mode in ("text", "binary"):
+            filename = os.path.join(directory, f"event_{mode}.log")
+            _write_event_log(mode, filename, n_events)
+            result[f"parse_event_log_{mode}"] = _throughput(filename, parse_event_log, repeats)
+        for output_format in ("csv", "binary"):
+            filename = os.path.join(directory, f"resource_{output_format}.log")
+            _write_resource_log(output_format, filename, n_rows)
+            result[f"parse_resource_log_{output_format}"] = _throughput(filename, parse_resource_log, repeats)
+    return result
+
+
+def run_benchmarks(parts: Sequence[str] = PARTS, scale: float = 1., backend: str = "auto") -> Dict[str, Any]:
+    """run the benchmarks
+
+    Args:
+        parts (Sequence[str], optional): The benchmarks to run, of PARTS. Defaults to all.
+        scale (float, optional): Scales the iterations of the benchmarks, e.g. 0.1 for a quick run. Defaults to 1.
+        backend (str, optional): The sampling backend, see ResourceLogger. Defaults to "auto".
+
+    Returns:
+        Dict[str, Any]: the environment and the results of every part
+    """
+    assert all(part in PARTS for part in parts), f"expected some of {PARTS}, got {parts}"
+    results: Dict[str, Any] = {
+        "time": time(), "python": platform.python_version(), "implementation": platform.python_implementation(),
+        "platform": platform.platform(), "cpu_count": os.cpu_count(), "numpy": np.__version__,
+    }
+    if "sampling" in parts:
+        results["sampling"] = bench_sampling(max(int(1000 * scale), 10), backend)
+    if "instrumentation" in parts:
+        results["instrumentation"] = bench_instrumentation(max(int(100000 * scale), 100))
+    if "startup" in parts:
+        results["startup"] = bench_startup(max(int(5 * scale), 1))
+    if "parsing" in parts:
+        results["parsing"] = bench_parsing(max(int(200000 * scale), 100), max(int(200000 * scale), 100))
+    return results
+
+
+def main() -> None:
+    """ commandline interface """
+    parser = argparse.ArgumentParser(prog="python -m resource_monitor.bench")
+    parser.add_argument(
+        "--output", type=str, required=False, default="bench.json",
+        help="Output JSON file, \"-\" for stdout. Defaults to \"bench.json\"."
+    )
+    parser.add_argument(
+        "--parts", type=str, required=False, default=",".join(PARTS),
+        help=f"Benchmarks to run, separated by comma. Defaults to \"{','.join(PARTS)}\"."
+    )
+    parser.add_argument(
+        "--scale", type=float, required=False, default=1.,
+        help="Scale of the iterations, e.g. 0.1 for a quick run. Defaults to 1."
+    )
+    parser.add_argument(
+        "--backend", type=str, required=False, default="auto", choices=["auto", "proc", "psutil"],
+        help="Sampling backend of the sampling benchmark. Defaults to \"auto\"."
+    )
+    args = parser.parse_args()
+    results = run_benchmarks([p for p in args.parts.split(",") if len(p) > 0], args.scale, args.backend)
+    text = json.dumps(results, indent=1)
+    if args.output == "-":
+        print(text)
+    else:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+
+
+if __name__ == "__main__":
+    main()
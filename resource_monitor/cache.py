@@ -0,0 +1,187 @@
+"""
+    Sidecar caches of the parsed text logs.
+
+    A parsed log is cached next to it, in `<log>.rmcache` (the data) and `<log>.rmcache.json` (the state).
+    The state records the identity of the log file (device, inode, and fingerprints of its head and of
+        the bytes before the parsed offset) and the byte offset parsed so far.
+    If the log has only grown since, only the new tail is parsed and appended to the cache,
+        otherwise the cache is rebuilt. Loading a cache is a memory-map.
+
+    * Resource logs are cached in the binary resource log format, see `log_format`.
+    * Event logs are cached as float64 (start, end) pairs of the ended occurrences,
+        appended in segments grouped by event name. The state indexes the segments of every event name,
+        so one event can be loaded without reading the others.
+"""
+import hashlib
+import json
+import os
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from numpy.typing import NDArray
+
+from .log_format import BinaryResourceWriter, read_binary_header, record_dtype
+from .stream import EventLogStream, ResourceLogStream
+
+
+CACHE_SUFFIX = ".rmcache"
+CACHE_VERSION = 3
+# the size of the fingerprints of the log in bytes
+FINGERPRINT_SIZE = 4096
+
+
+def _fingerprint(f: Any, start: int, end: int) -> str:
+    """ hash of the bytes [start, end) of the file """
+    f.seek(start)
+    return hashlib.sha1(f.read(end - start)).hexdigest()
+
+
+def _identify(filename: str, offset: int) -> Dict[str, Any]:
+    """ the identity of the log file, of the content before `offset` """
+    stat = os.stat(filename)
+    with open(filename, "rb") as f:
+        return {
+            "device": stat.st_dev,
+            "inode": stat.st_ino,
+            "head": _fingerprint(f, 0, min(offset, FINGERPRINT_SIZE)),
+            "tail": _fingerprint(f, max(offset - FINGERPRINT_SIZE, 0), offset),
+        }
+
+
+def _load_state(filename: str, kind: str) -> Optional[Dict[str, Any]]:
+    """ the state of the cache of the log, None if there is no valid cache for the current log file """
+    try:
+        with open(filename + CACHE_SUFFIX + ".json", "r", encoding="utf-8") as f:
+            state = json.load(f)
+        if state.get("version") != CACHE_VERSION or state.get("kind") != kind:
+            return None
+        if os.path.getsize(filename) < state["offset"] or os.path.getsize(filename + CACHE_SUFFIX) < state["size"]:
+            return None
+        if _identify(filename, state["offset"]) != state["identity"]:
+            # the log is rewritten
+            return None
+    except (OSError, ValueError, KeyError):
+        return None
+    return state
+
+
+def _save_state(filename: str, state: Dict[str, Any]) -> None:
+    """ write the state atomically, after the data it describes """
+    state["identity"] = _identify(filename, state["offset"])
+    state_file = filename + CACHE_SUFFIX + ".json"
+    with open(state_file + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(state, f)
+    os.replace(state_file + ".tmp", state_file)
+
+
+def load_resource_log(filename: str) -> Tuple[Dict[str, int], Dict[str, NDArray]]:
+    """parse a CSV resource log through its cache, see `report.parse_resource_log`
+
+    Args:
+        filename (str): CSV resource log file path
+
+    Returns:
+        Tuple[Dict[str, int], Dict[str, NDArray]]:
+            same as `report.parse_resource_log`, the arrays are views of the memory-mapped cache
+    """
+    cache_file = filename + CACHE_SUFFIX
+    state = _load_state(filename, "resource")
+    stream = ResourceLogStream(filename)
+    try:
+        if state is not None and [list(c) for c in stream.columns] == state["columns"]:
+            stream.offset = state["offset"]
+            cache = open(cache_file, "r+b")
+            # drop the records appended after the last saved state, if any
+            cache.truncate(state["size"])
+            cache.seek(state["size"])
+        else:
+            writer = BinaryResourceWriter(cache_file)
+            writer.write_preamble("", stream.global_info, [name for name, _ in stream.columns])
+            writer.close()
+            state = {
+                "version": CACHE_VERSION, "kind": "resource", "columns": [list(c) for c in stream.columns],
+                "offset": stream.offset, "size": os.path.getsize(cache_file),
+            }
+            cache = open(cache_file, "r+b")
+            cache.seek(state["size"])
+        with cache:
+            for block in stream:
+                records = np.empty(len(block["time"]), dtype=stream.dtype)
+                for name, _ in stream.columns:
+                    records[name] = block[name]
+                cache.write(records.tobytes())
+        state["offset"] = stream.offset
+        state["size"] = os.path.getsize(cache_file)
+        _save_state(filename, state)
+    finally:
+        stream.close()
+
+    with open(cache_file, "rb") as f:
+        header, data_offset = read_binary_header(f)
+    dtype = record_dtype(header["columns"])
+    n_records = (state["size"] - data_offset) // dtype.itemsize
+    if n_records == 0:
+        records = np.zeros(0, dtype=dtype)
+    else:
+        records = np.memmap(cache_file, dtype=dtype, mode="r", offset=data_offset, shape=(n_records,))
+    return header["global_info"], dict((name, records[name]) for name in dtype.names)
+
+
+def load_event_log(filename: str, event_names: Optional[Sequence[str]] = None) -> Dict[str, NDArray[np.float64]]:
+    """parse an event log (text or binary) through its cache, see `report.parse_event_log`
+
+    Args:
+        filename (str): event log file path
+        event_names (Optional[Sequence[str]], optional):
+            Only load these events, by the index of the cache. Defaults to None, all events.
+
+    Returns:
+        Dict[str, NDArray[np.float64]]:
+            same as `report.parse_event_log`. The events still running at the end of the log have end time 0.
+    """
+    cache_file = filename + CACHE_SUFFIX
+    state = _load_state(filename, "event")
+    stream = EventLogStream(filename)
+    try:
+        if state is not None:
+            stream.set_state(state["stream"])
+        else:
+            open(cache_file, "wb").close()
+            state = {"version": CACHE_VERSION, "kind": "event", "size": 0, "index": {}}
+        index: Dict[str, List[List[int]]] = state["index"]
+        with open(cache_file, "r+b") as cache:
+            # drop the occurrences appended after the last saved state, if any
+            cache.truncate(state["size"])
+            cache.seek(state["size"])
+            row = state["size"] // 16
+            for occurrences in stream.occurrences(unfinished=False):
+                for event_name, intervals in occurrences.items():
+                    cache.write(intervals.astype("<f8").tobytes())
+                    index.setdefault(event_name, []).append([row, len(intervals)])
+                    row += len(intervals)
+        state["stream"] = stream.get_state()
+        state["offset"] = stream.offset
+        state["size"] = os.path.getsize(cache_file)
+        _save_state(filename, state)
+        running = stream.running
+        names = stream.names
+    finally:
+        stream.close()
+
+    n_rows = state["size"] // 16
+    rows = np.memmap(cache_file, dtype="<f8", mode="r", shape=(n_rows, 2)) if n_rows > 0 else np.zeros((0, 2))
+    event_times: Dict[str, NDArray[np.float64]] = {}
+    for event_name, segments in index.items():
+        if event_names is None or event_name in event_names:
+            if len(segments) == 1:
+                event_times[event_name] = rows[segments[0][0]:segments[0][0] + segments[0][1]]
+            else:
+                event_times[event_name] = np.concatenate([rows[s:s + n] for s, n in segments])
+    for record in running.tolist():
+        event_name = names[record[2]]
+        if event_names is None or event_name in event_names:
+            unfinished = np.array([[record[0] / 1e9, 0.]])
+            event_times[event_name] = (
+                np.concatenate([event_times[event_name], unfinished]) if event_name in event_times else unfinished
+            )
+    return event_times
@@ -0,0 +1,623 @@
+"""
+    Collectors sample groups of metrics for ResourceLogger, each at its own interval.
+
+    A collector declares its columns and its relative cost. On every sampling tick, ResourceLogger
+        polls the monitored processes once, then every collector that is due samples its metrics.
+    A collector that is not due repeats its last values, and the row marks it stale
+        in the "fresh_<collector>" column. So expensive metrics (e.g. smaps) can be sampled
+        less often without slowing down the cheap ones (e.g. cpu).
+"""
+import os
+import re
+from fnmatch import fnmatchcase
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple, Type, Union
+
+from .proc_sampler import ProcSampler, _ProcFile
+from .psutil_sampler import PsutilSampler
+
+
+MEGABYTE = 1024**2
+# the interval (seconds) of the expensive collectors when it is not given
+EXPENSIVE_COLLECTOR_INTERVAL = 1.0
+# the mount point of the cgroup v2 hierarchy
+CGROUP_ROOT = "/sys/fs/cgroup"
+# the devices left out of the "diskdev" collector by default, along with the partitions
+EXCLUDED_DISK_DEVICES = ("loop*", "ram*")
+
+Sampler = Union[ProcSampler, PsutilSampler]
+Number = Union[int, float]
+
+
+class Collector:
+    """
+    The base class of collectors.
+
+    Subclasses define `name`, `cost` ("low", "medium" or "high"), `per_pid_columns`, `columns()` and `collect()`.
+    """
+    name: str = ""
+    cost: str = "low"
+    # the per-process columns, written to the per-PID side table
+    per_pid_columns: Tuple[str, ...] = ()
+
+    def __init__(self, sampler: Sampler, interval: Optional[float] = None) -> None:
+        """
+        Args:
+            sampler (Union[ProcSampler, PsutilSampler]): the sampling backend
+            interval (Optional[float], optional):
+                Time interval (seconds) between samples. Defaults to None, sampling on every tick.
+        """
+        assert interval is None or interval > 0, f"got {interval}"
+        self.sampler = sampler
+        self.interval: Optional[float] = interval
+        self.next_due: float = float("-inf")
+        self.values: List[Number] = []
+        # PID to the per-process values of the last sample
+        self.per_pid: Dict[int, List[Number]] = {}
+        self.fresh: bool = False
+
+    def columns(self) -> List[str]:
+        """ the columns of the resource log """
+        raise NotImplementedError
+
+    def collect(self, cpu_times: Dict[int, float], time: float) -> List[Number]:
+        """sample the metrics, and update `per_pid`
+
+        Args:
+            cpu_times (Dict[int, float]): PID to the CPU time (seconds) of the active processes, from `poll()`
+            time (float): the time of the tick
+
+        Returns:
+            List[Number]: the values of `columns()`
+        """
+        raise NotImplementedError
+
+    def update(self, cpu_times: Dict[int, float], time: float) -> List[Number]:
+        """ sample the metrics if due, otherwise return the last values """
+        self.fresh = time >= self.next_due
+        if self.fresh:
+            self.values = self.collect(cpu_times, time)
+            if self.interval is not None:
+                # keep the cadence, unless the collector falls behind by a whole interval
+                self.next_due = max(self.next_due + self.interval, time)
+        return self.values
+
+    def reset(self) -> None:
+        """ make the collector due on the next tick """
+        self.next_due = float("-inf")
+
+    def global_info(self) -> Dict[str, int]:
+        """ the global resource information written to the preamble of the log, e.g. the sizes of the devices """
+        return {}
+
+    def clean_up(self) -> None:
+        """ release what the collector holds, e.g. open files """
+
+
+class CpuCollector(Collector):
+    """ CPU utilization percent of the processes and of the system, since the last sample. """
+    name = "cpu"
+    per_pid_columns = ("cpu_percent",)
+
+    def __init__(self, sampler: Sampler, interval: Optional[float] = None) -> None:
+        super().__init__(sampler, interval)
+        # PID to (CPU time, time) of the last sample
+        self.last_cpu_times: Dict[int, Tuple[float, float]] = {}
+
+    def columns(self) -> List[str]:
+        return ["cpu_percent", "cpu_percent_global"]
+
+    def collect(self, cpu_times: Dict[int, float], time: float) -> List[Number]:
+        per_pid: Dict[int, List[Number]] = {}
+        last_cpu_times = {}
+        for pid, cpu_time in cpu_times.items():
+            last = self.last_cpu_times.get(pid)
+            # 0 on the first sample of a process, same as psutil
+            if last is None or time <= last[1]:
+                per_pid[pid] = [0.]
+            else:
+                per_pid[pid] = [(cpu_time - last[0]) / (time - last[1]) * 100]
+            last_cpu_times[pid] = (cpu_time, time)
+        self.per_pid = per_pid
+        self.last_cpu_times = last_cpu_times
+        return [sum(p[0] for p in per_pid.values()), self.sampler.sample_cpu_global()]
+
+    def reset(self) -> None:
+        super().reset()
+        # too short a span since the last sample gives noisy percents
+        self.last_cpu_times = {}
+
+
+class MemoryCollector(Collector):
+    """ RSS/VMS of the processes, used virtual memory and swap of the system. """
+    name = "memory"
+    per_pid_columns = ("rss_mb", "vms_mb")
+
+    def columns(self) -> List[str]:
+        return ["rss_mb", "vms_mb", "vms_global_mb", "swap_used_mb"]
+
+    def collect(self, cpu_times: Dict[int, float], time: float) -> List[Number]:
+        memory = self.sampler.sample_memory(list(cpu_times))
+        self.per_pid = dict((pid, [m[0] // MEGABYTE, m[1] // MEGABYTE]) for pid, m in memory.items())
+        vm_used, swap_used = self.sampler.sample_memory_global()
+        return [
+            sum(p[0] for p in self.per_pid.values()),
+            sum(p[1] for p in self.per_pid.values()),
+            vm_used // MEGABYTE,
+            swap_used // MEGABYTE,
+        ]
+
+
+class IoCollector(Collector):
+    """ Cumulative read/write counts and bytes of the processes. """
+    name = "io"
+    per_pid_columns = ("read_count", "read_mb", "write_count", "write_mb")
+
+    def columns(self) -> List[str]:
+        return ["read_count", "read_mb", "write_count", "write_mb"]
+
+    def collect(self, cpu_times: Dict[int, float], time: float) -> List[Number]:
+        io = self.sampler.sample_io(list(cpu_times))
+        self.per_pid = dict(
+            (pid, [p[0], p[1] // MEGABYTE, p[2], p[3] // MEGABYTE]) for pid, p in io.items()
+        )
+        return [sum(p[i] for p in self.per_pid.values()) for i in range(4)]
+
+
+class DiskCollector(Collector):
+    """ Cumulative read/write counts and bytes of all disks. """
+    name = "disk"
+
+    def columns(self) -> List[str]:
+        return ["read_count_global", "read_mb_global", "write_count_global", "write_mb_global"]
+
+    def collect(self, cpu_times: Dict[int, float], time: float) -> List[Number]:
+        read_count, read_bytes, write_count, write_bytes = self.sampler.sample_disk_global()
+        return [read_count, read_bytes // MEGABYTE, write_count, write_bytes // MEGABYTE]
+
+
+class SmapsCollector(Collector):
+    """
+    Proportional (PSS) and unique (USS) memory and proportional swap of the processes.
+    Unlike RSS, PSS/USS do not count shared pages repeatedly, but the kernel walks all the memory
+        mappings of a process to compute them.
+    """
+    name = "smaps"
+    cost = "high"
+    per_pid_columns = ("pss_mb", "uss_mb", "swap_pss_mb")
+
+    def columns(self) -> List[str]:
+        return ["pss_mb", "uss_mb", "swap_pss_mb"]
+
+    def collect(self, cpu_times: Dict[int, float], time: float) -> List[Number]:
+        smaps = self.sampler.sample_smaps(list(cpu_times))
+        self.per_pid = dict((pid, [m // MEGABYTE for m in p]) for pid, p in smaps.items())
+        return [sum(p[i] for p in self.per_pid.values()) for i in range(3)]
+
+
+class GpuCollector(Collector):
+    """ GPU memory used by the processes and in total, GPU utilization, and optionally SM utilization. """
+    name = "gpu"
+    cost = "medium"
+
+    def __init__(
+        self, sampler: Sampler, interval: Optional[float] = None,
+        gpu_logger: Any = None, gpu_ids: Sequence[int] = (),
+    ) -> None:
+        """
+        Args:
+            gpu_logger (GpuLogger): the GPU logger of the monitored GPUs
+            gpu_ids (Sequence[int]): indices of the monitored GPUs
+        """
+        super().__init__(sampler, interval)
+        assert gpu_logger is not None, "the gpu collector requires gpu_ids"
+        self.gpu_logger = gpu_logger
+        self.gpu_ids = list(gpu_ids)
+
+    def columns(self) -> List[str]:
+        columns = []
+        for i in self.gpu_ids:
+            columns.extend([f"gpu_{i}_mem_mb", f"gpu_{i}_mem_mb_global", f"gpu_{i}_utilization_percent_global"])
+            if self.gpu_logger.process_utilization:
+                columns.append(f"gpu_{i}_sm_utilization_percent")
+        return columns
+
+    def collect(self, cpu_times: Dict[int, float], time: float) -> List[Number]:
+        numbers: List[Number] = []
+        for sample in self.gpu_logger.sample().tolist():
+            numbers.extend([sample[0] // MEGABYTE, sample[1] // MEGABYTE, sample[2]])
+            if self.gpu_logger.process_utilization:
+                numbers.append(sample[3])
+        return numbers
+
+
+def resolve_cgroup(cgroup: str, pid: Optional[int] = None) -> str:
+    """the directory of a cgroup v2
+
+    Args:
+        cgroup (str):
+            A directory, or a path under the cgroup v2 mount like "/system.slice/job.service",
+            or "self" for the cgroup of process `pid`.
+        pid (Optional[int], optional): with "self", the process, defaults to None, the current process
+
+    Returns:
+        str: the directory of the cgroup
+    """
+    if cgroup == "self":
+        with open(f"/proc/{'self' if pid is None else pid}/cgroup", "r", encoding="utf-8") as f:
+            # the unified hierarchy is "0::<path>"
+            paths = [line.strip()[3:] for line in f if line.startswith("0::")]
+        assert len(paths) == 1, "the process is not in a cgroup v2 hierarchy"
+        cgroup = paths[0]
+    if not os.path.isdir(cgroup):
+        cgroup = os.path.join(CGROUP_ROOT, cgroup.lstrip("/"))
+    assert os.path.isfile(os.path.join(cgroup, "cgroup.procs")), f"not a cgroup v2 directory: {cgroup}"
+    return cgroup
+
+
+def _parse_keyed(content: bytes, separator: bytes = b" ") -> Dict[bytes, int]:
+    """ parse "<key><separator><integer>" tokens, e.g. the lines of cpu.stat or the fields of io.stat """
+    parsed = {}
+    for token in content.split(b"\n" if separator == b" " else None):
+        key, _, value = token.partition(separator)
+        if value.isdigit():
+            parsed[key] = int(value)
+    return parsed
+
+
+class CgroupCollector(Collector):
+    """
+    Whole-cgroup accounting from the cgroup v2 interface files, read once per tick whatever the number of processes.
+    The processes that exit between ticks are still accounted, unlike the per-process collectors.
+    * CPU: utilization and throttled percent since the last sample, from cpu.stat;
+    * memory: memory.current, and the anon/file memory from memory.stat;
+    * IO: cumulative read/write counts and bytes of all devices, from io.stat;
+    * pressure (PSI): the percent of the time since the last sample in which some or all (full) tasks
+        stalled on CPU/memory/IO, from the "total" stall times of {cpu,memory,io}.pressure.
+    The interface files of the controllers not enabled in the cgroup are missing, their columns are 0.
+    """
+    name = "cgroup"
+    pressure_resources = ("cpu", "memory", "io")
+
+    def __init__(self, sampler: Sampler, interval: Optional[float] = None, cgroup: Optional[str] = None) -> None:
+        """
+        Args:
+            cgroup (str): the directory of the cgroup v2, see `resolve_cgroup`
+        """
+        super().__init__(sampler, interval)
+        assert cgroup is not None, "the cgroup collector requires cgroup"
+        self.cgroup = cgroup
+        # interface file name to the kept-open file, None if missing
+        self.files: Dict[str, Optional[_ProcFile]] = {}
+        for name in ["cpu.stat", "memory.current", "memory.stat", "io.stat"] + \
+                [f"{r}.pressure" for r in self.pressure_resources]:
+            try:
+                self.files[name] = _ProcFile(os.path.join(cgroup, name))
+            except FileNotFoundError:
+                self.files[name] = None
+        # (time, [CPU usage, throttled time, stall times of the pressure columns] in microseconds) of the last sample
+        self.last: Optional[Tuple[float, List[int]]] = None
+
+    def columns(self) -> List[str]:
+        columns = [
+            "cgroup_cpu_percent", "cgroup_cpu_throttled_percent",
+            "cgroup_memory_mb", "cgroup_anon_mb", "cgroup_file_mb",
+            "cgroup_read_count", "cgroup_read_mb", "cgroup_write_count", "cgroup_write_mb",
+        ]
+        for resource in self.pressure_resources:
+            columns.extend([f"cgroup_{resource}_some_percent", f"cgroup_{resource}_full_percent"])
+        return columns
+
+    def _read(self, name: str) -> bytes:
+        file = self.files[name]
+        return b"" if file is None else file.read()
+
+    def collect(self, cpu_times: Dict[int, float], time: float) -> List[Number]:
+        cpu_stat = _parse_keyed(self._read("cpu.stat"))
+        # microseconds accumulated since the cgroup was created
+        totals = [cpu_stat.get(b"usage_usec", 0), cpu_stat.get(b"throttled_usec", 0)]
+        for resource in self.pressure_resources:
+            # "some <avg10=...> total=<microseconds>" and "full ...", "full" of CPU is missing on older kernels
+            stalls = dict(
+                (line[:4], _parse_keyed(line[5:], b"=").get(b"total", 0))
+                for line in self._read(f"{resource}.pressure").split(b"\n") if len(line) > 5
+            )
+            totals.extend([stalls.get(b"some", 0), stalls.get(b"full", 0)])
+        # 0 on the first sample, same as CpuCollector
+        percents = [0.] * len(totals)
+        if self.last is not None and time > self.last[0]:
+            elapsed = (time - self.last[0]) * 1e6
+            percents = [max(t - last, 0) / elapsed * 100 for t, last in zip(totals, self.last[1])]
+        self.last = (time, totals)
+
+        memory_current = self._read("memory.current").strip()
+        memory_stat = _parse_keyed(self._read("memory.stat"))
+        io = [0, 0, 0, 0]
+        for line in self._read("io.stat").split(b"\n"):
+            fields = _parse_keyed(line, b"=")
+            for i, key in enumerate((b"rios", b"rbytes", b"wios", b"wbytes")):
+                io[i] += fields.get(key, 0)
+        return percents[:2] + [
+            int(memory_current) // MEGABYTE if memory_current.isdigit() else 0,
+            memory_stat.get(b"anon", 0) // MEGABYTE,
+            memory_stat.get(b"file", 0) // MEGABYTE,
+            io[0], io[1] // MEGABYTE, io[2], io[3] // MEGABYTE,
+        ] + percents[2:]
+
+    def reset(self) -> None:
+        super().reset()
+        # too short a span since the last sample gives noisy percents
+        self.last = None
+
+    def clean_up(self) -> None:
+        for file in self.files.values():
+            if file is not None:
+                file.close()
+
+
+def select_devices(
+    names: Iterable[str], patterns: Optional[Sequence[str]], default: Callable[[str], bool]
+) -> List[str]:
+    """the devices or network interfaces to monitor
+
+    Args:
+        names (Iterable[str]): the names of the available ones
+        patterns (Optional[Sequence[str]]): fnmatch patterns of the names to keep, e.g. ["nvme*", "sda"]
+        default (Callable[[str], bool]): without `patterns`, whether to keep a name
+
+    Returns:
+        List[str]: the names kept, sorted
+    """
+    if patterns is None:
+        return sorted(n for n in names if default(n))
+    return sorted(n for n in names if any(fnmatchcase(n, p) for p in patterns))
+
+
+def network_namespace_pid(pid: int) -> Optional[int]:
+    """ `pid` if the process is in another network namespace than the current process, e.g. in a container """
+    try:
+        return pid if os.readlink(f"/proc/{pid}/ns/net") != os.readlink("/proc/self/ns/net") else None
+    except OSError:
+        return None
+
+
+def _column_name(device: str) -> str:
+    """ the device or network interface in the column names, e.g. "cciss_c0d0" for "cciss/c0d0" """
+    return re.sub(r"\W", "_", device)
+
+
+def _is_whole_disk(device: str) -> bool:
+    """ whether the device is a disk rather than a partition, same as `ProcSampler._locate_disks` """
+    return os.access(f"/sys/block/{device.replace('/', '!')}", os.F_OK)
+
+
+def _read_sysfs_int(path: str) -> Optional[int]:
+    """ the integer in a sysfs attribute file, None if it is missing or not an integer """
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return int(f.read())
+    except (OSError, ValueError):
+        return None
+
+
+class _DeviceRatesCollector(Collector):
+    """
+    The base class of the per-device collectors, which turn the cumulative counters of every device
+        into rates since the last sample, so a burst of small operations is visible in its own row.
+    Subclasses define `n_counters`, `_sample()` and `_rates()`.
+    """
+    n_counters = 0
+
+    def __init__(self, sampler: Sampler, interval: Optional[float], devices: Sequence[str]) -> None:
+        super().__init__(sampler, interval)
+        self.devices = list(devices)
+        self.device_set = frozenset(self.devices)
+        # (time, device to its counters) of the last sample
+        self.last: Optional[Tuple[float, Dict[str, List[int]]]] = None
+
+    def _sample(self) -> Dict[str, List[int]]:
+        """ the cumulative counters of `devices` """
+        raise NotImplementedError
+
+    def _rates(self, deltas: List[int], elapsed: float) -> List[Number]:
+        """ the columns of a device from the increments of its counters in `elapsed` seconds, not 0 """
+        raise NotImplementedError
+
+    def collect(self, cpu_times: Dict[int, float], time: float) -> List[Number]:
+        counters = self._sample()
+        last, self.last = self.last, (time, counters)
+        elapsed = 0. if last is None else time - last[0]
+        numbers: List[Number] = []
+        for device in self.devices:
+            current = counters.get(device)
+            previous = None if last is None else last[1].get(device)
+            # 0 on the first sample, same as CpuCollector, and while a device is missing
+            if current is None or previous is None or elapsed <= 0:
+                numbers.extend(self._rates([0] * self.n_counters, 1.))
+            else:
+                # a counter goes back if the device is removed and added again
+                numbers.extend(self._rates([max(c - p, 0) for c, p in zip(current, previous)], elapsed))
+        return numbers
+
+    def reset(self) -> None:
+        super().reset()
+        # too short a span since the last sample gives noisy rates
+        self.last = None
+
+
+class DiskDevicesCollector(_DeviceRatesCollector):
+    """
+    Per-device disk throughput, IOPS and queueing since the last sample, from /proc/diskstats:
+    * read/write bytes and operations per second;
+    * await: the mean time (ms) of an operation, queued and served (r_await/w_await of iostat, combined);
+    * busy: the percent of the time with operations in flight (%util of iostat);
+    * queue depth: the mean number of operations in flight (aqu-sz of iostat), 0 with the psutil backend.
+    The devices are chosen by fnmatch patterns, by default all the whole disks but loop and RAM disks.
+    """
+    name = "diskdev"
+    n_counters = 8
+
+    def __init__(
+        self, sampler: Sampler, interval: Optional[float] = None, devices: Optional[Sequence[str]] = None
+    ) -> None:
+        """
+        Args:
+            devices (Optional[Sequence[str]], optional):
+                fnmatch patterns of the devices, e.g. ["nvme*n1", "sda"], partitions can be selected too.
+                Defaults to None, the whole disks but EXCLUDED_DISK_DEVICES.
+        """
+        super().__init__(sampler, interval, select_devices(
+            sampler.sample_disk_devices(), devices,
+            lambda n: _is_whole_disk(n) and not any(fnmatchcase(n, p) for p in EXCLUDED_DISK_DEVICES)
+        ))
+
+    def columns(self) -> List[str]:
+        columns = []
+        for device in self.devices:
+            prefix = f"disk_{_column_name(device)}_"
+            columns.extend(prefix + c for c in (
+                "read_bytes_per_s", "write_bytes_per_s", "read_ops_per_s", "write_ops_per_s",
+                "await_ms", "busy_percent", "queue_depth",
+            ))
+        return columns
+
+    def _sample(self) -> Dict[str, List[int]]:
+        return self.sampler.sample_disk_devices(self.device_set)
+
+    def _rates(self, deltas: List[int], elapsed: float) -> List[Number]:
+        read_count, read_bytes, write_count, write_bytes, read_ms, write_ms, busy_ms, queue_ms = deltas
+        count = read_count + write_count
+        return [
+            read_bytes / elapsed, write_bytes / elapsed, read_count / elapsed, write_count / elapsed,
+            (read_ms + write_ms) / count if count > 0 else 0.,
+            min(busy_ms / elapsed / 10, 100.), queue_ms / elapsed / 1000,
+        ]
+
+    def global_info(self) -> Dict[str, int]:
+        info = {}
+        for device in self.devices:
+            # in 512-byte sectors whatever the sector size of the device
+            sectors = _read_sysfs_int(f"/sys/class/block/{device.replace('/', '!')}/size")
+            if sectors is not None:
+                info[f"disk_{_column_name(device)}_size_mb"] = sectors * 512 // MEGABYTE
+        return info
+
+
+class NetworkInterfacesCollector(_DeviceRatesCollector):
+    """
+    Per-interface network throughput since the last sample, from /proc/net/dev:
+        received/sent bytes and packets per second, and the errors and drops of both directions per second.
+    The counters are those of a network namespace, not of the processes: by default of the namespace of the logger,
+        or of a monitored process in another namespace, e.g. a container, from /proc/<pid>/net/dev.
+    The interfaces are chosen by fnmatch patterns, by default the physical ones, or all but loopback if none is.
+    """
+    name = "netdev"
+    n_counters = 5
+
+    def __init__(
+        self, sampler: Sampler, interval: Optional[float] = None,
+        interfaces: Optional[Sequence[str]] = None, pid: Optional[int] = None,
+    ) -> None:
+        """
+        Args:
+            interfaces (Optional[Sequence[str]], optional):
+                fnmatch patterns of the interfaces, e.g. ["eth*", "ib0"].
+                Defaults to None, the physical interfaces, or all but "lo" if none is.
+            pid (Optional[int], optional):
+                A process in the network namespace to monitor, see `network_namespace_pid`.
+                Defaults to None, the namespace of the logger.
+        """
+        self.pid = pid
+        available = sampler.sample_net_interfaces(pid=pid)
+        physical = [n for n in available if pid is None and os.path.exists(f"/sys/class/net/{n}/device")]
+        super().__init__(sampler, interval, select_devices(
+            available, interfaces, lambda n: n in physical if len(physical) > 0 else n != "lo"
+        ))
+
+    def columns(self) -> List[str]:
+        columns = []
+        for interface in self.devices:
+            prefix = f"net_{_column_name(interface)}_"
+            columns.extend(prefix + c for c in (
+                "recv_bytes_per_s", "sent_bytes_per_s", "recv_packets_per_s", "sent_packets_per_s", "dropped_per_s",
+            ))
+        return columns
+
+    def _sample(self) -> Dict[str, List[int]]:
+        return self.sampler.sample_net_interfaces(self.device_set, self.pid)
+
+    def _rates(self, deltas: List[int], elapsed: float) -> List[Number]:
+        recv_bytes, recv_packets, sent_bytes, sent_packets, dropped = deltas
+        return [
+            recv_bytes / elapsed, sent_bytes / elapsed, recv_packets / elapsed, sent_packets / elapsed,
+            dropped / elapsed,
+        ]
+
+    def global_info(self) -> Dict[str, int]:
+        info = {}
+        # the sysfs of the logger does not describe the interfaces of another namespace
+        for interface in self.devices if self.pid is None else []:
+            # -1 or unreadable for virtual interfaces
+            speed = _read_sysfs_int(f"/sys/class/net/{interface}/speed")
+            if speed is not None and speed > 0:
+                info[f"net_{_column_name(interface)}_speed_mbps"] = speed
+        return info
+
+
+COLLECTORS: Dict[str, Type[Collector]] = dict(
+    (c.name, c) for c in (
+        CpuCollector, MemoryCollector, IoCollector, DiskCollector, GpuCollector, SmapsCollector, CgroupCollector,
+        DiskDevicesCollector, NetworkInterfacesCollector,
+    )
+)
+DEFAULT_METRICS = ("cpu", "memory", "io", "disk", "gpu")
+
+
+def parse_metrics(metrics: Union[str, Sequence[str]]) -> List[Tuple[str, Optional[float]]]:
+    """parse the metrics selection, e.g. "cpu:0.01,memory,smaps:1"
+
+    Args:
+        metrics (Union[str, Sequence[str]]):
+            comma separated, or a list of, collector names, each optionally followed by ":<interval in seconds>".
+            Expensive collectors without an interval are sampled every EXPENSIVE_COLLECTOR_INTERVAL seconds,
+            the others on every tick.
+
+    Returns:
+        List[Tuple[str, Optional[float]]]: collector names and intervals, None meaning every tick
+    """
+    if isinstance(metrics, str):
+        metrics = [m for m in metrics.split(",") if m.strip() != ""]
+    parsed: List[Tuple[str, Optional[float]]] = []
+    for metric in metrics:
+        name, _, interval = metric.strip().partition(":")
+        assert name in COLLECTORS, f"unknown metric {name}, expected one of {list(COLLECTORS)}"
+        assert name not in [n for n, _ in parsed], f"duplicated metric {name}"
+        if interval != "":
+            parsed.append((name, float(interval)))
+        elif COLLECTORS[name].cost == "high":
+            parsed.append((name, EXPENSIVE_COLLECTOR_INTERVAL))
+        else:
+            parsed.append((name, None))
+    return parsed
+
+
+def column_order(columns: Sequence[str]) -> List[int]:
+    """the order of the columns in the resource log, as the original layout of the default columns:
+        every "<name>_global" column right after "<name>", e.g. "read_count", "read_count_global", "read_mb", ...
+
+    Args:
+        columns (Sequence[str]): the columns of the collectors, one collector after the other
+
+    Returns:
+        List[int]: the indices into `columns`, in the order of the log
+    """
+    index = dict((name, i) for i, name in enumerate(columns))
+    # the global columns following their process column
+    moved = set(index[f"{name}_global"] for name in columns if f"{name}_global" in index)
+    order = []
+    for i, name in enumerate(columns):
+        if i in moved:
+            continue
+        order.append(i)
+        if f"{name}_global" in index:
+            order.append(index[f"{name}_global"])
+    return order
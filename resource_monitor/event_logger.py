@@ -2,36 +2,544 @@
     Event loggers record the start/end of lasting events,
     like function calling & returning, file opening & closing.
 """
-from typing import Optional, TextIO, Union
-from time import perf_counter
-from sys import stdout
+import json
+import os
+import struct
+import weakref
+from array import array
+from os import getpid
+from threading import Lock, get_ident, local
+from typing import Any, BinaryIO, Dict, List, Optional, TextIO, Tuple, Union
+from time import perf_counter, perf_counter_ns
+from sys import byteorder, stderr, stdout
+
+
+EVENT_LOG_MAGIC = b"RMONEVT3"
+# the magic of every version to the number of fields per record,
+#   older versions lack the trailing fields (task_id since version 2, pid since version 3)
+EVENT_LOG_VERSIONS = {b"RMONEVT1": 5, b"RMONEVT2": 6, EVENT_LOG_MAGIC: 7}
+# a binary event log is the magic followed by chunks of (chunk kind, payload length in bytes, payload)
+EVENT_CHUNK_HEADER = struct.Struct("<II")
+# payload: UTF-8 JSON list of [name_id, event_name]
+EVENT_CHUNK_NAMES = 1
+# payload: little-endian int64 records of (perf_counter_ns, kind, name_id, event_id, thread_id, task_id, pid)
+EVENT_CHUNK_RECORDS = 2
+EVENT_RECORD_FIELDS = 7
+EVENT_KIND_START = 0
+EVENT_KIND_END = 1
+# the event ends by raising an exception
+EVENT_KIND_ERROR = 2
+# the kinds in text event logs
+EVENT_KIND_NAMES = ("start", "end", "error")
+
+# durations (ns) below 16 have their own buckets, above that every power of 2 is split into 8 buckets
+HISTOGRAM_SUB_BUCKETS = 8
+HISTOGRAM_BUCKETS = 16 + (63 - 4) * HISTOGRAM_SUB_BUCKETS
+
+
+def _discard_file(file: Any) -> None:
+    """ close an inherited file object without writing its buffer to the file, by pointing its descriptor to null """
+    if file is None or isinstance(file, str) or file in (stdout, stderr) or file.closed:
+        return
+    null = os.open(os.devnull, os.O_WRONLY)
+    try:
+        os.dup2(null, file.fileno())
+    finally:
+        os.close(null)
+    file.close()
+
+
+def histogram_bucket(duration_ns: int) -> int:
+    """ the log-scaled histogram bucket of a duration in nanoseconds """
+    if duration_ns < 16:
+        return max(duration_ns, 0)
+    exponent = duration_ns.bit_length()
+    return 16 + (exponent - 5) * HISTOGRAM_SUB_BUCKETS + ((duration_ns >> (exponent - 4)) & 7)
+
+
+def histogram_bucket_bounds(bucket: int) -> Tuple[int, int]:
+    """ the [lower, upper) bounds in nanoseconds of a histogram bucket """
+    if bucket < 16:
+        return bucket, bucket + 1
+    exponent, sub_bucket = divmod(bucket - 16, HISTOGRAM_SUB_BUCKETS)
+    return (8 + sub_bucket) << (exponent + 1), (9 + sub_bucket) << (exponent + 1)
+
+
+class _LineBuffer:
+    """ The unwritten lines of one thread of the text event logger, written out when the thread exits. """
+    __slots__ = ("lines", "thread_id", "pid", "logger", "__weakref__")
+
+    def __init__(self, logger: "EventLogger") -> None:
+        self.lines: List[str] = []
+        # formatted once, it is in every line
+        self.thread_id = str(get_ident())
+        self.pid = getpid()
+        # weak, a buffer left by a thread must not keep the logger alive
+        self.logger = weakref.ref(logger)
+
+    def __del__(self) -> None:
+        # the thread holding the buffer exits, only the thread-local reference was strong
+        logger = self.logger()
+        if logger is None or len(self.lines) == 0 or self.pid != getpid():
+            return
+        try:
+            logger._write(self)  # pylint: disable=protected-access
+        except (OSError, ValueError):
+            # the file is closed
+            pass
 
 
 class EventLogger:
-    """ Event logger """
-    def __init__(self, output: Optional[Union[str, TextIO]] = None) -> None:
+    """
+    Event logger
+
+    Every line is "time,kind,event_name,event_id,thread_id,task_id", kind being "start", "end" or "error".
+    The task ID identifies the asyncio task of the event, empty if none.
+    Text files are not thread-safe, so every thread appends its lines to a list of its own without locking,
+        and writes them under a lock `batch_lines` at a time, when it exits, and by flush()/clean_up().
+        The lines of a thread are in order, the lines of different threads are not.
+    The output is opened by the first write.
+    """
+    def __init__(self, output: Optional[Union[str, TextIO]] = None, batch_lines: int = 64) -> None:
+        """
+        Args:
+            output (Optional[Union[str, TextIO]], optional): Output file or stream. Defaults to None, stdout.
+            batch_lines (int, optional): lines written at a time per thread. Defaults to 64.
+        """
+        assert batch_lines > 0
         self.output: Optional[Union[str, TextIO]] = output
+        self.batch_lines = batch_lines
+        self.write_lock = Lock()
+        self.local = local()
+        # the buffers of the live threads, held by the threads only
+        self.line_buffers: "weakref.WeakSet[_LineBuffer]" = weakref.WeakSet()
 
-    def log_start(self, event_name: str, event_id: Optional[Union[int, str]] = None) -> None:
-        """ log the start of an event """
-        if self.output is None:
-            self.output = stdout
-        elif isinstance(self.output, str):
-            self.output = open(self.output, "w", encoding="utf-8")
+    def _new_line_buffer(self) -> _LineBuffer:
+        buffer = _LineBuffer(self)
+        self.local.line_buffer = buffer
+        with self.write_lock:
+            self.line_buffers.add(buffer)
+        return buffer
 
+    def _write(self, buffer: _LineBuffer) -> None:
+        """ write out the lines of a thread, the output is opened by the first write """
+        with self.write_lock:
+            if self.output is None:
+                self.output = stdout
+            elif isinstance(self.output, str):
+                self.output = open(self.output, "w", encoding="utf-8")
+            elif self.output.closed:
+                return
+            self.output.write("".join(buffer.lines))
+            buffer.lines.clear()
+
+    def _append(
+        self, time: int, kind: str, event_name: str, event_id: Optional[Union[int, str]], task_id: Optional[int]
+    ) -> None:
+        try:
+            buffer = self.local.line_buffer
+        except AttributeError:
+            buffer = self._new_line_buffer()
         assert "," not in event_name, f"got {event_name}"
-        event_id = "" if event_id is None else str(event_id)
-        self.output.write(f"{perf_counter()},start,{event_name},{event_id}\n")
+        lines = buffer.lines
+        # the seconds are formatted from the integer nanoseconds, much faster than from a float
+        digits = "%010d" % time
+        lines.append(
+            f"{digits[:-9]}.{digits[-9:]},{kind},{event_name},"
+            f"{'' if event_id is None else event_id},{buffer.thread_id},{'' if task_id is None else task_id}\n"
+        )
+        if len(lines) >= self.batch_lines:
+            self._write(buffer)
+
+    def log_start(
+        self, event_name: str, event_id: Optional[Union[int, str]] = None, task_id: Optional[int] = None
+    ) -> None:
+        """ log the start of an event """
+        self._append(perf_counter_ns(), "start", event_name, event_id, task_id)
 
-    def log_end(self, event_name: str, event_id: Optional[Union[int, str]] = None) -> None:
+    def log_end(
+        self, event_name: str, event_id: Optional[Union[int, str]] = None, task_id: Optional[int] = None
+    ) -> None:
         """ log the end of an event, the event start must previously be logged. """
-        assert self.output is not None and not isinstance(self.output, str)
-        assert "," not in event_name, f"got {event_name}"
-        event_id = "" if event_id is None else str(event_id)
-        self.output.write(f"{perf_counter()},end,{event_name},{event_id}\n")
+        self._append(perf_counter_ns(), "end", event_name, event_id, task_id)
+
+    def log_error(
+        self, event_name: str, event_id: Optional[Union[int, str]] = None, task_id: Optional[int] = None
+    ) -> None:
+        """ log the end of an event by an exception, the event start must previously be logged. """
+        self._append(perf_counter_ns(), "error", event_name, event_id, task_id)
+
+    def log_event(
+        self, event_name: str, start: int, end: int, event_id: Optional[Union[int, str]] = None,
+        task_id: Optional[int] = None, error: bool = False,
+    ) -> None:
+        """
+        log an event that has ended, e.g. if only the events lasting long enough are logged
+
+        Args:
+            event_name (str): event name
+            start (int): start time by `perf_counter_ns()`
+            end (int): end time by `perf_counter_ns()`
+            event_id (Optional[Union[int, str]], optional): event ID. Defaults to None.
+            task_id (Optional[int], optional): asyncio task ID. Defaults to None.
+            error (bool, optional): whether the event ended by an exception. Defaults to False.
+        """
+        self._append(start, "start", event_name, event_id, task_id)
+        self._append(end, "error" if error else "end", event_name, event_id, task_id)
+
+    def flush(self) -> None:
+        """ write out the lines buffered by all threads, the threads should not be logging meanwhile """
+        for buffer in list(self.line_buffers):
+            if len(buffer.lines) > 0:
+                self._write(buffer)
+        if self.output is not None and not isinstance(self.output, str) and not self.output.closed:
+            self.output.flush()
+
+    def discard(self) -> None:
+        """ drop the output and the buffered records without writing them, e.g. in a forked child process """
+        for buffer in list(self.line_buffers):
+            buffer.lines.clear()
+        self.line_buffers = weakref.WeakSet()
+        self.local = local()
+        _discard_file(self.output)
 
     def clean_up(self) -> None:
-        """ close the file handle """
-        assert self.output is not None and not isinstance(self.output, str)
-        if self.output is not stdout:
+        """ write out the buffered lines and close the file handle """
+        self.flush()
+        if self.output is not None and not isinstance(self.output, str) and self.output is not stdout:
             self.output.close()
+
+
+class _EventBuffer:
+    """ Preallocated records of one thread, written out and freed when the thread exits. """
+    __slots__ = ("records", "size", "capacity", "thread_id", "pid", "logger", "__weakref__")
+
+    def __init__(self, capacity: int, logger: "BinaryEventLogger") -> None:
+        self.records = array("q", bytes(8 * EVENT_RECORD_FIELDS * capacity))
+        self.size = 0
+        self.capacity = capacity
+        self.thread_id = get_ident()
+        self.pid = getpid()
+        # weak, a buffer left by a thread must not keep the logger alive
+        self.logger = weakref.ref(logger)
+
+    def __del__(self) -> None:
+        # the thread holding the buffer exits, only the thread-local reference was strong
+        logger = self.logger()
+        if logger is None or self.size == 0 or self.pid != getpid():
+            return
+        try:
+            logger._write(self)  # pylint: disable=protected-access
+        except (OSError, ValueError):
+            # the file is closed
+            pass
+
+
+class BinaryEventLogger(EventLogger):
+    """
+    Event logger with low overhead.
+
+    Event names are interned to integer IDs, and every thread appends fixed-size records
+        to its own preallocated buffer without locking.
+    A buffer is written out in bulk when it is full or when its thread exits, then it is freed,
+        and all buffers are written out by clean_up().
+    Event IDs must be integers. The log can be parsed by `report.parse_event_log`.
+    """
+    def __init__(self, output: str, buffer_size: int = 4096) -> None:
+        """
+        Args:
+            output (str): Output file.
+            buffer_size (int, optional): number of records buffered per thread. Defaults to 4096.
+        """
+        super().__init__(output)
+        assert buffer_size > 0
+        self.buffer_size = buffer_size
+        self.file: BinaryIO = self._open_file(output)
+        self.file.write(EVENT_LOG_MAGIC)
+
+        self.name_ids: Dict[str, int] = {}
+        self.unwritten_names: List[List[Union[int, str]]] = []
+        self.local = local()
+        # the buffers of the live threads, held by the threads only
+        self.buffers: "weakref.WeakSet[_EventBuffer]" = weakref.WeakSet()
+        # held when interning a new name or writing to the file, never when appending a record
+        self.lock = Lock()
+
+    def _open_file(self, output: str) -> BinaryIO:
+        """ the file the log is written to, subclasses may stream it elsewhere """
+        return open(output, "wb")
+
+    def _intern(self, event_name: str) -> int:
+        with self.lock:
+            if event_name not in self.name_ids:
+                self.name_ids[event_name] = len(self.name_ids)
+                self.unwritten_names.append([self.name_ids[event_name], event_name])
+            return self.name_ids[event_name]
+
+    def _new_buffer(self) -> _EventBuffer:
+        buffer = _EventBuffer(self.buffer_size, self)
+        self.local.buffer = buffer
+        with self.lock:
+            self.buffers.add(buffer)
+        return buffer
+
+    def _append(
+        self, kind: int, event_name: str, event_id: Optional[Union[int, str]], task_id: Optional[int],
+        time: Optional[int] = None,
+    ) -> None:
+        if time is None:
+            time = perf_counter_ns()
+        try:
+            buffer = self.local.buffer
+        except AttributeError:
+            buffer = self._new_buffer()
+        name_id = self.name_ids.get(event_name)
+        if name_id is None:
+            name_id = self._intern(event_name)
+
+        records = buffer.records
+        i = buffer.size * EVENT_RECORD_FIELDS
+        records[i] = time
+        records[i + 1] = kind
+        records[i + 2] = name_id
+        records[i + 3] = -1 if event_id is None else int(event_id)
+        records[i + 4] = buffer.thread_id
+        records[i + 5] = -1 if task_id is None else task_id
+        records[i + 6] = buffer.pid
+        buffer.size += 1
+        if buffer.size == buffer.capacity:
+            self._write(buffer)
+
+    def _write(self, buffer: _EventBuffer) -> None:
+        """ write out the buffered records and the new names """
+        with self.lock:
+            if self.file.closed:
+                return
+            if len(self.unwritten_names) > 0:
+                names = json.dumps(self.unwritten_names).encode("utf-8")
+                self.file.write(EVENT_CHUNK_HEADER.pack(EVENT_CHUNK_NAMES, len(names)) + names)
+                self.unwritten_names = []
+            if buffer.size > 0:
+                records = memoryview(buffer.records)[:buffer.size * EVENT_RECORD_FIELDS].cast("B")
+                if byteorder == "big":
+                    swapped = buffer.records[:buffer.size * EVENT_RECORD_FIELDS]
+                    swapped.byteswap()
+                    records = memoryview(swapped).cast("B")
+                self.file.write(EVENT_CHUNK_HEADER.pack(EVENT_CHUNK_RECORDS, len(records)))
+                self.file.write(records)
+            buffer.size = 0
+
+    def log_start(
+        self, event_name: str, event_id: Optional[Union[int, str]] = None, task_id: Optional[int] = None
+    ) -> None:
+        """ log the start of an event """
+        self._append(EVENT_KIND_START, event_name, event_id, task_id)
+
+    def log_end(
+        self, event_name: str, event_id: Optional[Union[int, str]] = None, task_id: Optional[int] = None
+    ) -> None:
+        """ log the end of an event, the event start must previously be logged. """
+        self._append(EVENT_KIND_END, event_name, event_id, task_id)
+
+    def log_error(
+        self, event_name: str, event_id: Optional[Union[int, str]] = None, task_id: Optional[int] = None
+    ) -> None:
+        """ log the end of an event by an exception, the event start must previously be logged. """
+        self._append(EVENT_KIND_ERROR, event_name, event_id, task_id)
+
+    def log_event(
+        self, event_name: str, start: int, end: int, event_id: Optional[Union[int, str]] = None,
+        task_id: Optional[int] = None, error: bool = False,
+    ) -> None:
+        """ log an event that has ended, see EventLogger.log_event """
+        self._append(EVENT_KIND_START, event_name, event_id, task_id, start)
+        self._append(EVENT_KIND_ERROR if error else EVENT_KIND_END, event_name, event_id, task_id, end)
+
+    def flush(self) -> None:
+        """ write out the records buffered by all threads, the threads should not be logging meanwhile """
+        for buffer in list(self.buffers):
+            self._write(buffer)
+        self.file.flush()
+
+    def discard(self) -> None:
+        """ drop the output and the buffered records without writing them, e.g. in a forked child process """
+        for buffer in list(self.buffers):
+            buffer.size = 0
+        self.buffers = weakref.WeakSet()
+        self.local = local()
+        _discard_file(self.file)
+
+    def clean_up(self) -> None:
+        """ write out the buffered records and close the file handle """
+        if self.file.closed:
+            return
+        self.flush()
+        self.file.close()
+
+
+class _EventStats:
+    """ Running statistics of the durations (ns) of an event. """
+    __slots__ = ("count", "errors", "total", "min", "max", "histogram")
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.errors = 0
+        self.total = 0
+        self.min = -1
+        self.max = -1
+        self.histogram = [0] * HISTOGRAM_BUCKETS
+
+    def add(self, duration: int) -> None:
+        """ add a duration """
+        self.count += 1
+        self.total += duration
+        if duration < self.min or self.min < 0:
+            self.min = duration
+        if duration > self.max:
+            self.max = duration
+        self.histogram[histogram_bucket(duration)] += 1
+
+    def merge(self, other: "_EventStats") -> None:
+        """ merge the statistics of another thread """
+        self.count += other.count
+        self.errors += other.errors
+        self.total += other.total
+        if other.min >= 0 and (other.min < self.min or self.min < 0):
+            self.min = other.min
+        self.max = max(self.max, other.max)
+        self.histogram = [a + b for a, b in zip(self.histogram, other.histogram)]
+
+    def to_dict(self) -> Dict[str, Any]:
+        """ serialize, only non-empty histogram buckets are kept """
+        return {
+            "count": self.count, "errors": self.errors, "sum": self.total, "min": self.min, "max": self.max,
+            "histogram": [[i, n] for i, n in enumerate(self.histogram) if n > 0],
+        }
+
+
+class _ThreadAggregation:
+    """ Running events and statistics of one thread. """
+    __slots__ = ("running", "stats")
+
+    def __init__(self) -> None:
+        self.running: Dict[Tuple[str, Optional[Union[int, str]]], int] = {}
+        self.stats: Dict[str, _EventStats] = {}
+
+
+class AggregateEventLogger(EventLogger):
+    """
+    Event logger keeping running statistics of event durations in memory, instead of raw records.
+
+    For every event name, the count, sum, min, max and a log-bucketed histogram of durations are kept,
+        so memory usage and log size do not grow with the number of calls.
+    Every thread aggregates separately without locking.
+    A snapshot of the statistics is appended to the output as a line of JSON
+        every `snapshot_interval` seconds (checked when an event ends) and by clean_up().
+    The snapshots can be loaded and merged by `report.parse_event_stats`/`report.merge_event_stats`.
+    """
+    def __init__(self, output: str, snapshot_interval: float = 10.0) -> None:
+        """
+        Args:
+            output (str): Output file.
+            snapshot_interval (float, optional): Time interval (seconds) between snapshots. Defaults to 10.0.
+        """
+        super().__init__(output)
+        assert snapshot_interval > 0
+        self.snapshot_interval_ns = int(snapshot_interval * 1e9)
+        self.next_snapshot_ns = perf_counter_ns() + self.snapshot_interval_ns
+        self.file: TextIO = open(output, "w", encoding="utf-8")
+
+        self.local = local()
+        self.aggregations: List[_ThreadAggregation] = []
+        self.lock = Lock()
+
+    def _new_aggregation(self) -> _ThreadAggregation:
+        aggregation = _ThreadAggregation()
+        self.local.aggregation = aggregation
+        with self.lock:
+            self.aggregations.append(aggregation)
+        return aggregation
+
+    def log_start(
+        self, event_name: str, event_id: Optional[Union[int, str]] = None, task_id: Optional[int] = None
+    ) -> None:
+        """ log the start of an event, `task_id` is not recorded """
+        try:
+            aggregation = self.local.aggregation
+        except AttributeError:
+            aggregation = self._new_aggregation()
+        aggregation.running[(event_name, event_id)] = perf_counter_ns()
+
+    def log_end(
+        self, event_name: str, event_id: Optional[Union[int, str]] = None, task_id: Optional[int] = None
+    ) -> None:
+        """ log the end of an event, the event start must previously be logged. """
+        self._end(event_name, event_id, False)
+
+    def log_error(
+        self, event_name: str, event_id: Optional[Union[int, str]] = None, task_id: Optional[int] = None
+    ) -> None:
+        """ log the end of an event by an exception, it is counted in "errors" besides the durations """
+        self._end(event_name, event_id, True)
+
+    def _end(self, event_name: str, event_id: Optional[Union[int, str]], error: bool) -> None:
+        time = perf_counter_ns()
+        try:
+            aggregation = self.local.aggregation
+            start = aggregation.running.pop((event_name, event_id))
+        except (AttributeError, KeyError):
+            return
+        self._add(aggregation, event_name, time - start, error)
+        if time >= self.next_snapshot_ns:
+            self.snapshot()
+
+    def _add(self, aggregation: _ThreadAggregation, event_name: str, duration: int, error: bool) -> None:
+        stats = aggregation.stats.get(event_name)
+        if stats is None:
+            stats = aggregation.stats[event_name] = _EventStats()
+        stats.add(duration)
+        if error:
+            stats.errors += 1
+
+    def log_event(
+        self, event_name: str, start: int, end: int, event_id: Optional[Union[int, str]] = None,
+        task_id: Optional[int] = None, error: bool = False,
+    ) -> None:
+        """ log an event that has ended, see EventLogger.log_event """
+        try:
+            aggregation = self.local.aggregation
+        except AttributeError:
+            aggregation = self._new_aggregation()
+        self._add(aggregation, event_name, end - start, error)
+        if end >= self.next_snapshot_ns:
+            self.snapshot()
+
+    def snapshot(self) -> None:
+        """ append a snapshot of the statistics of all threads to the output """
+        with self.lock:
+            if self.file.closed:
+                return
+            self.next_snapshot_ns = perf_counter_ns() + self.snapshot_interval_ns
+            merged: Dict[str, _EventStats] = {}
+            for aggregation in self.aggregations:
+                for event_name, stats in list(aggregation.stats.items()):
+                    if event_name not in merged:
+                        merged[event_name] = _EventStats()
+                    merged[event_name].merge(stats)
+            self.file.write(json.dumps({
+                "time": perf_counter(),
+                "pid": getpid(),
+                "events": dict((k, v.to_dict()) for k, v in merged.items()),
+            }) + "\n")
+            self.file.flush()
+
+    def discard(self) -> None:
+        """ drop the output and the statistics without writing them, e.g. in a forked child process """
+        _discard_file(self.file)
+
+    def clean_up(self) -> None:
+        """ write the last snapshot and close the file handle """
+        if self.file.closed:
+            return
+        self.snapshot()
+        self.file.close()
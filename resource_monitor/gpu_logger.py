@@ -1,25 +1,35 @@
 """ GPU Resource Logger """
-from typing import Sequence, List
+from typing import Dict, Sequence, List
 
+import numpy as np
+from numpy.typing import NDArray
 from pynvml import ( # type: ignore
     nvmlInit, nvmlDeviceGetHandleByIndex,
     nvmlDeviceGetMemoryInfo, nvmlDeviceGetComputeRunningProcesses,
-    nvmlDeviceGetUtilizationRates
+    nvmlDeviceGetUtilizationRates, nvmlDeviceGetProcessUtilization, NVMLError
 )
 
 
 class GpuLogger:
     """GPU Resource Logger. Currently on GPU memory usage is monitored."""
 
-    def __init__(self, pids: Sequence[int], gpu_ids: Sequence[int]) -> None:
+    def __init__(self, pids: Sequence[int], gpu_ids: Sequence[int], process_utilization: bool = False) -> None:
         """
         Args:
             pids (Sequence[int]): PID of the processes to monitor
             gpu_ids (Sequence[int]): indices of the GPUs to monitor
+            process_utilization (bool, optional):
+                whether sample() also collects the SM utilization of the processes. Defaults to False.
         """
         nvmlInit()
-        self.pids = pids
+        self.pids = set(pids)
         self.handles = [nvmlDeviceGetHandleByIndex(i) for i in gpu_ids]
+        self.process_utilization = process_utilization
+        # the timestamp of the last process utilization sample of each GPU, only newer samples are queried
+        self.last_seen_timestamps: Dict[int, int] = dict((i, 0) for i in range(len(self.handles)))
+        self.samples: NDArray[np.int64] = np.zeros(
+            (len(self.handles), 4 if process_utilization else 3), dtype=np.int64
+        )
 
     @property
     def num_gpus(self) -> int:
@@ -33,7 +43,7 @@ class GpuLogger:
 
     def set_pids(self, pids) -> None:
         """ update the PID of the processes to monitor """
-        self.pids = pids
+        self.pids = set(pids)
 
     def get_total(self) -> List[int]:
         """ get total memory of each GPU in bytes """
@@ -64,3 +74,47 @@ class GpuLogger:
             for processes in gpu_processes
         ]
         return gpu_used_mem
+
+    def _get_process_sm_utilization(self, i: int) -> int:
+        """
+        the SM utilization percent of the processes under monitoring on the i-th GPU, since the last query:
+        the sum over the processes of the mean of their samples, NVML returns a sample per process per period
+        """
+        try:
+            samples = nvmlDeviceGetProcessUtilization(self.handles[i], self.last_seen_timestamps[i])
+        except NVMLError:
+            # no new sample since the last query
+            return 0
+        # PID to the sum and the count of its samples
+        per_pid: Dict[int, List[int]] = {}
+        for sample in samples:
+            self.last_seen_timestamps[i] = max(self.last_seen_timestamps[i], sample.timeStamp)
+            if sample.pid in self.pids:
+                total = per_pid.setdefault(sample.pid, [0, 0])
+                total[0] += sample.smUtil
+                total[1] += 1
+        return min(sum(sm_sum // count for sm_sum, count in per_pid.values()), 100)
+
+    def sample(self) -> NDArray[np.int64]:
+        """
+        Query every GPU once.
+
+        Returns:
+            NDArray[np.int64]:
+                shape=(num_gpus, 3), or (num_gpus, 4) with `process_utilization`. Each row is
+                [memory used by the processes (bytes), memory used (bytes), utilization percent,
+                (SM utilization percent of the processes)].
+                The array is preallocated and overwritten by the next call.
+        """
+        samples = self.samples
+        for i, h in enumerate(self.handles):
+            samples[i, 0] = sum(
+                p.usedGpuMemory
+                for p in nvmlDeviceGetComputeRunningProcesses(h)
+                if p.usedGpuMemory is not None and p.pid in self.pids
+            )
+            samples[i, 1] = nvmlDeviceGetMemoryInfo(h).used
+            samples[i, 2] = nvmlDeviceGetUtilizationRates(h).gpu
+            if self.process_utilization:
+                samples[i, 3] = self._get_process_sm_utilization(i)
+        return samples
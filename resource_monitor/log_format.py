@@ -0,0 +1,356 @@
+"""
+    Writers of the resource log, in CSV, binary columnar or rollup format.
+
+    The binary format is
+        8 bytes magic | 4 bytes little-endian header length | UTF-8 JSON header | padding to 8 bytes
+    followed by fixed-width little-endian packed records, one per sample.
+    The JSON header holds the global resource information and the column names/dtypes.
+    Records are written by write() calls of whole records on an unbuffered file, repeated until all the bytes
+    are written (a write may be short, e.g. on a full disk or when interrupted by a signal),
+    so a crash leaves at most a partially written last record, which the reader skips.
+
+    The rollup format bounds the disk usage of long runs. After a header like the binary format's
+        (with magic "RMONRUP1"), the file holds fixed-size rings:
+        * the raw ring: the records of the last `raw_seconds` seconds, same as the binary format;
+        * a ring per tier of resolution R seconds: per R-second bucket of the last `retention` seconds,
+            the bucket start time, the sample count and the min/max/mean/last of every column.
+    The tiers are updated incrementally on every sample, and the bucket in progress is written on every flush,
+        so the file can be queried at any time, see `report.parse_rollup_log`.
+    Ring slots are written in place: the slot of a raw sample is its sequence number modulo the capacity,
+        the slot of a bucket is its number (start time // resolution) modulo the capacity.
+    The written slots are told from the unwritten ones (zeros) without relying on the times:
+        the bucket of a tier is written if its sample count is positive, and the raw slots written are given by
+        the count of raw samples written, an int64 after the last ring at "count_offset" of the raw ring's header.
+"""
+import json
+import os
+import struct
+from sys import stdout
+from typing import Any, BinaryIO, Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+
+RESOURCE_LOG_MAGIC = b"RMONRES1"
+ROLLUP_LOG_MAGIC = b"RMONRUP1"
+_HEADER_LENGTH = struct.Struct("<I")
+_ROLLUP_COUNT = struct.Struct("<q")
+
+# columns recorded as float64, the others are int64
+FLOAT_COLUMNS = (
+    "time", "cpu_percent", "cpu_percent_global", "sampling_interval", "sampling_latency", "deadline_slip",
+    "cgroup_cpu_percent", "cgroup_cpu_throttled_percent",
+    "cgroup_cpu_some_percent", "cgroup_cpu_full_percent", "cgroup_memory_some_percent", "cgroup_memory_full_percent",
+    "cgroup_io_some_percent", "cgroup_io_full_percent",
+)
+# the suffixes of the float64 columns named after devices, e.g. "disk_sda_read_bytes_per_s"
+FLOAT_COLUMN_SUFFIXES = ("_per_s", "_await_ms", "_busy_percent", "_queue_depth")
+# columns describing the sampling itself rather than the resource usage
+SCHEDULING_COLUMNS = ("sampling_interval", "sampling_latency", "deadline_slip", "missed_ticks")
+# "fresh_<collector>" columns tell whether the columns of a collector are sampled in the row
+FRESHNESS_COLUMN_PREFIX = "fresh_"
+# the statistics of every column in a rollup bucket
+ROLLUP_STATISTICS = ("min", "max", "mean", "last")
+# (resolution, retention) in seconds of the default rollup tiers: 10 s buckets for a day, 5 min buckets for 30 days
+DEFAULT_ROLLUP_TIERS = ((10., 86400.), (300., 30 * 86400.))
+# the most slots of a ring
+MAX_RING_SLOTS = 1 << 22
+# the index of a store of the remote collector, see `remote`
+STORE_INDEX = "agents.json"
+
+
+def column_dtype(name: str) -> str:
+    """ the dtype of a resource log column """
+    return "<f8" if name in FLOAT_COLUMNS or name.endswith(FLOAT_COLUMN_SUFFIXES) else "<i8"
+
+
+def record_dtype(columns: Sequence[Tuple[str, str]]) -> np.dtype:
+    """ the numpy structured dtype of a binary record """
+    return np.dtype([(name, dtype) for name, dtype in columns])
+
+
+def rollup_columns(columns: Sequence[str]) -> List[str]:
+    """ the columns summarized by the rollup tiers: all but the time and the freshness """
+    return [name for name in columns if name != "time" and not name.startswith(FRESHNESS_COLUMN_PREFIX)]
+
+
+def rollup_dtype(columns: Sequence[str]) -> np.dtype:
+    """ the numpy structured dtype of a rollup bucket, of the columns summarized """
+    fields = [("time", "<f8"), ("count", "<i8")]
+    for name in columns:
+        fields.extend((f"{name}_{statistic}", "<f8") for statistic in ROLLUP_STATISTICS)
+    return np.dtype(fields)
+
+
+def read_binary_header(f: BinaryIO, expected_magic: bytes = RESOURCE_LOG_MAGIC) -> Tuple[Dict[str, Any], int]:
+    """read the header of a binary resource log, or of a rollup resource log
+
+    Args:
+        f (BinaryIO): the log file opened in binary mode, at offset 0
+        expected_magic (bytes, optional): the magic of the format. Defaults to RESOURCE_LOG_MAGIC.
+
+    Returns:
+        Tuple[Dict[str, Any], int]: the JSON header and the byte offset of the first record
+    """
+    magic = f.read(len(expected_magic))
+    assert magic == expected_magic, f"not a {expected_magic!r} resource log, got magic {magic!r}"
+    (length,) = _HEADER_LENGTH.unpack(f.read(_HEADER_LENGTH.size))
+    header = json.loads(f.read(length).decode("utf-8"))
+    offset = len(expected_magic) + _HEADER_LENGTH.size + length
+    return header, offset + (-offset) % 8
+
+
+def is_binary_resource_log(filename: str) -> bool:
+    """ check the magic of the file """
+    with open(filename, "rb") as f:
+        return f.read(len(RESOURCE_LOG_MAGIC)) == RESOURCE_LOG_MAGIC
+
+
+def is_rollup_resource_log(filename: str) -> bool:
+    """ check the magic of the file """
+    with open(filename, "rb") as f:
+        return f.read(len(ROLLUP_LOG_MAGIC)) == ROLLUP_LOG_MAGIC
+
+
+def _write_all(file: BinaryIO, data: Union[bytes, bytearray]) -> None:
+    """ write all of `data` to an unbuffered file, whose write() may write only a part of it """
+    view = memoryview(data)
+    while len(view) > 0:
+        view = view[file.write(view):]
+
+
+def _pwrite_all(fd: int, data: bytes, offset: int) -> None:
+    """ os.pwrite all of `data` at `offset`, a pwrite may write only a part of it """
+    view = memoryview(data)
+    while len(view) > 0:
+        n = os.pwrite(fd, view, offset)
+        view = view[n:]
+        offset += n
+
+
+class CsvResourceWriter:
+    """ Write the resource log in CSV format, the numbers are converted to text. """
+
+    def __init__(self, output: Optional[str] = None) -> None:
+        """
+        Args:
+            output (Optional[str], optional): Output file. If None, output to stdout. Defaults to None.
+        """
+        self.output = stdout if output is None else open(output, "w", encoding="utf-8")
+
+    def write_preamble(self, message: str, global_info: Dict[str, int], headers: List[str]) -> None:
+        """ write the calibration message, the global resource information and the table header """
+        self.output.write(message + "\n")
+        self.output.write(",".join(f"{k}:{v}" for k, v in global_info.items()) + "\n")
+        self.output.write(",".join(headers) + "\n")
+        self.output.flush()
+
+    def write_row(self, numbers: List[Union[int, float]]) -> None:
+        """ write a row of numbers """
+        self.output.write(",".join([str(n) for n in numbers]) + "\n")
+
+    def flush(self) -> None:
+        """ flush the output """
+        self.output.flush()
+
+    def close(self) -> None:
+        """ close the file handle """
+        if self.output is not stdout:
+            self.output.close()
+
+
+class BinaryResourceWriter:
+    """ Write the resource log in binary columnar format. See the module docs. """
+
+    def __init__(self, output: str) -> None:
+        """
+        Args:
+            output (str): Output file.
+        """
+        # unbuffered, so that the records are in the file as soon as flush() returns
+        self.output: BinaryIO = open(output, "wb", buffering=0)
+        self.record: Optional[struct.Struct] = None
+        self.buffer = bytearray()
+
+    def write_preamble(self, message: str, global_info: Dict[str, int], headers: List[str]) -> None:
+        """ write the self-describing header """
+        columns = [(h, column_dtype(h)) for h in headers]
+        header = json.dumps({"message": message, "global_info": global_info, "columns": columns}).encode("utf-8")
+        preamble = RESOURCE_LOG_MAGIC + _HEADER_LENGTH.pack(len(header)) + header
+        _write_all(self.output, preamble + b"\0" * ((-len(preamble)) % 8))
+        self.record = struct.Struct("<" + "".join("d" if dtype == "<f8" else "q" for _, dtype in columns))
+
+    def write_row(self, numbers: List[Union[int, float]]) -> None:
+        """ buffer a packed record until flush() """
+        assert self.record is not None, "the preamble is not written"
+        self.buffer += self.record.pack(*numbers)
+
+    def write_records(self, records: bytes) -> None:
+        """ write packed records as they are, e.g. received from an agent (see `remote`) """
+        self.flush()
+        _write_all(self.output, records)
+
+    def flush(self) -> None:
+        """ write out the buffered records """
+        if len(self.buffer) > 0:
+            _write_all(self.output, self.buffer)
+            self.buffer = bytearray()
+
+    def close(self) -> None:
+        """ write out the buffered records and close the file handle """
+        self.flush()
+        self.output.close()
+
+
+class _Tier:
+    """ The bucket in progress of a rollup tier. """
+
+    def __init__(self, resolution: float, retention: float, offset: int, n_columns: int) -> None:
+        self.resolution = resolution
+        self.capacity = min(max(int(retention / resolution), 1), MAX_RING_SLOTS)
+        self.offset = offset
+        self.bucket = -1
+        self.count = 0
+        self.min = np.zeros(n_columns)
+        self.max = np.zeros(n_columns)
+        self.sum = np.zeros(n_columns)
+        self.last = np.zeros(n_columns)
+        # whether the bucket in progress has samples not written yet
+        self.dirty = False
+
+
+class RollupResourceWriter:
+    """ Write the resource log in rollup format, in fixed-size rings. See the module docs. """
+
+    def __init__(
+        self,
+        output: str,
+        raw_seconds: float = 600.,
+        tiers: Sequence[Tuple[float, float]] = DEFAULT_ROLLUP_TIERS,
+        min_interval: float = 1.,
+    ) -> None:
+        """
+        Args:
+            output (str): Output file.
+            raw_seconds (float, optional): Time span (seconds) of the raw samples kept. Defaults to 600.
+            tiers (Sequence[Tuple[float, float]], optional):
+                (resolution, retention) in seconds of the downsampled tiers. Defaults to DEFAULT_ROLLUP_TIERS.
+            min_interval (float, optional): The shortest time (seconds) between samples, to size the raw ring.
+                Defaults to 1.
+        """
+        assert raw_seconds > 0 and all(resolution > 0 and retention > 0 for resolution, retention in tiers)
+        self.fd = os.open(output, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+        self.raw_seconds = raw_seconds
+        self.raw_capacity = MAX_RING_SLOTS if min_interval <= 0 else \
+            min(int(raw_seconds / min_interval) + 1, MAX_RING_SLOTS)
+        self.tier_specs = sorted((float(resolution), float(retention)) for resolution, retention in tiers)
+        self.min_interval = min_interval
+        self.record: Optional[struct.Struct] = None
+        self.bucket_record: Optional[struct.Struct] = None
+        self.rolled: List[int] = []
+        self.tiers: List[_Tier] = []
+        # the byte offset of the raw ring, and of the count of raw samples written
+        self.raw_offset = 0
+        self.count_offset = 0
+        self.n_samples = 0
+        # (slot, packed record) of the raw samples not written yet
+        self.pending: List[Tuple[int, bytes]] = []
+
+    def write_preamble(self, message: str, global_info: Dict[str, int], headers: List[str]) -> None:
+        """ write the self-describing header, and allocate the rings """
+        columns = [(h, column_dtype(h)) for h in headers]
+        summarized = rollup_columns(headers)
+        self.rolled = [headers.index(name) for name in summarized]
+        self.record = struct.Struct("<" + "".join("d" if dtype == "<f8" else "q" for _, dtype in columns))
+        self.bucket_record = struct.Struct("<dq" + "d" * len(ROLLUP_STATISTICS) * len(summarized))
+
+        # the offsets are relative to the end of the header, which depends on them
+        offset = self.raw_capacity * self.record.size
+        self.tiers = []
+        for resolution, retention in self.tier_specs:
+            self.tiers.append(_Tier(resolution, retention, offset, len(summarized)))
+            offset += self.tiers[-1].capacity * self.bucket_record.size
+        count_offset = offset
+        offset += _ROLLUP_COUNT.size
+        header = json.dumps({
+            "message": message,
+            "global_info": global_info,
+            "columns": columns,
+            "raw": {
+                "seconds": self.raw_seconds, "min_interval": self.min_interval, "capacity": self.raw_capacity,
+                "count_offset": count_offset,
+            },
+            "tiers": [
+                {"resolution": t.resolution, "retention": retention, "capacity": t.capacity, "offset": t.offset}
+                for t, (_, retention) in zip(self.tiers, self.tier_specs)
+            ],
+        }).encode("utf-8")
+        preamble = ROLLUP_LOG_MAGIC + _HEADER_LENGTH.pack(len(header)) + header
+        preamble += b"\0" * ((-len(preamble)) % 8)
+        _pwrite_all(self.fd, preamble, 0)
+        self.raw_offset = len(preamble)
+        self.count_offset = len(preamble) + count_offset
+        for tier in self.tiers:
+            tier.offset += len(preamble)
+        # the rings are allocated at once as a sparse file of zeros, the disk usage does not grow afterwards
+        os.ftruncate(self.fd, len(preamble) + offset)
+
+    def write_row(self, numbers: List[Union[int, float]]) -> None:
+        """ buffer a raw record until flush(), and add the sample to the buckets in progress """
+        assert self.record is not None, "the preamble is not written"
+        self.pending.append((self.n_samples % self.raw_capacity, self.record.pack(*numbers)))
+        self.n_samples += 1
+        time = numbers[0]
+        values = np.array([numbers[i] for i in self.rolled], dtype=np.float64)
+        for tier in self.tiers:
+            bucket = int(time // tier.resolution)
+            if bucket != tier.bucket:
+                if tier.bucket >= 0:
+                    self._write_bucket(tier)
+                tier.bucket, tier.count = bucket, 1
+                tier.min[:] = values
+                tier.max[:] = values
+                tier.sum[:] = values
+            else:
+                tier.count += 1
+                np.minimum(tier.min, values, out=tier.min)
+                np.maximum(tier.max, values, out=tier.max)
+                tier.sum += values
+            tier.last[:] = values
+            tier.dirty = True
+
+    def _write_bucket(self, tier: _Tier) -> None:
+        """ write the bucket in progress of a tier to its slot """
+        assert self.bucket_record is not None
+        statistics = np.stack([tier.min, tier.max, tier.sum / tier.count, tier.last], axis=1)
+        record = self.bucket_record.pack(tier.bucket * tier.resolution, tier.count, *statistics.ravel().tolist())
+        _pwrite_all(self.fd, record, tier.offset + tier.bucket % tier.capacity * len(record))
+        tier.dirty = False
+
+    def flush(self) -> None:
+        """ write out the buffered raw records and the buckets in progress """
+        if len(self.pending) > 0:
+            assert self.record is not None
+            # a write per run of consecutive slots
+            first, run = self.pending[0][0], [self.pending[0][1]]
+            for slot, record in self.pending[1:]:
+                if slot != first + len(run):
+                    _pwrite_all(self.fd, b"".join(run), self.raw_offset + first * self.record.size)
+                    first, run = slot, []
+                run.append(record)
+            _pwrite_all(self.fd, b"".join(run), self.raw_offset + first * self.record.size)
+            self.pending = []
+            # after the records, a reader never counts a slot not written yet
+            _pwrite_all(self.fd, _ROLLUP_COUNT.pack(self.n_samples), self.count_offset)
+        for tier in self.tiers:
+            if tier.dirty:
+                self._write_bucket(tier)
+
+    def close(self) -> None:
+        """ write out the buffered records and close the file handle, once """
+        if self.fd < 0:
+            return
+        self.flush()
+        os.close(self.fd)
+        # a closed fd number can be reused by another open
+        self.fd = -1
@@ -0,0 +1,218 @@
+"""
+    Serve the latest resource sample in OpenMetrics text format, over HTTP or a Unix socket.
+
+    The resource logger pushes every sample it writes (see `MetricsSnapshot.update`), and scrapes are answered
+        from the pushed samples only, so the monitored processes are never queried on behalf of a scraper.
+    The page is rendered at the first scrape after a sample and cached until the next sample,
+        so any number of scrapers costs one rendering per sample at most.
+
+    Every column of the resource log is exported as a gauge `resource_monitor_<column>`, along with
+        `resource_monitor_<column>_min/_max/_mean{window="<seconds>"}` over the rolling windows.
+    The logger's own scheduling is exported too: the sampling latency and the deadline slip as gauges,
+        `resource_monitor_missed_ticks_total` and `resource_monitor_samples_total` as counters.
+
+    Example:
+        curl -s localhost:9400/metrics
+        curl -s --unix-socket /tmp/resource_monitor.sock http://localhost/metrics
+"""
+import math
+import os
+import socket
+import stat
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from socketserver import ThreadingUnixStreamServer
+from threading import Lock, Thread
+from typing import Any, List, Optional, Sequence, Union
+
+import numpy as np
+
+from .log_format import FRESHNESS_COLUMN_PREFIX
+
+
+METRIC_PREFIX = "resource_monitor_"
+CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+# the columns exported as counters, they only grow
+COUNTER_COLUMNS = ("missed_ticks",)
+# the most samples kept for the rolling windows
+MAX_WINDOW_SAMPLES = 1 << 16
+
+
+def _format_value(value: float) -> str:
+    """ the exact text of a value: integers (e.g. counters) in full, other floats by the shortest round trip """
+    value = float(value)
+    if math.isnan(value):
+        return "NaN"
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if value.is_integer() and abs(value) < 2**63:
+        return str(int(value))
+    return repr(value)
+
+
+class MetricsSnapshot:
+    """ The latest sample and the samples in the rolling windows, rendered to OpenMetrics text on demand. """
+
+    def __init__(
+        self, columns: Sequence[str], windows: Sequence[float] = (60., 300.), min_interval: float = 1.
+    ) -> None:
+        """
+        Args:
+            columns (Sequence[str]): The columns of the samples, the first is "time".
+            windows (Sequence[float], optional): The rolling windows (seconds). Defaults to (60., 300.).
+            min_interval (float, optional):
+                The shortest time (seconds) between samples, to size the windows. Defaults to 1.
+        """
+        assert columns[0] == "time" and all(w > 0 for w in windows)
+        self.columns = list(columns)
+        # the exported columns, the freshness of the tiered collectors only matters to the log
+        self.exported = [
+            i for i, c in enumerate(self.columns) if i > 0 and not c.startswith(FRESHNESS_COLUMN_PREFIX)
+        ]
+        self.windows = sorted(windows)
+        max_window = max(self.windows, default=0.)
+        self.capacity = MAX_WINDOW_SAMPLES if min_interval <= 0 else min(int(max_window / min_interval) + 2,
+                                                                         MAX_WINDOW_SAMPLES)
+        # ring buffer of the samples, of the exported columns
+        self.times = np.full(self.capacity, -np.inf)
+        self.values = np.zeros((self.capacity, len(self.exported)))
+        self.n_samples = 0
+        self.lock = Lock()
+        # the rendered page of the latest sample, None until a scrape
+        self.page: Optional[bytes] = None
+
+    def update(self, numbers: Sequence[Union[int, float]]) -> None:
+        """ push a sample, the values of `columns` """
+        with self.lock:
+            slot = self.n_samples % self.capacity
+            self.times[slot] = numbers[0]
+            self.values[slot] = [numbers[i] for i in self.exported]
+            self.n_samples += 1
+            self.page = None
+
+    def render(self) -> bytes:
+        """ the OpenMetrics text of the latest sample, cached until the next """
+        # the ring is copied under the lock and summarized outside it, so a scrape does not hold up `update()`
+        with self.lock:
+            if self.page is not None:
+                return self.page
+            n_samples = self.n_samples
+            times = self.times.copy()
+            values = self.values.copy()
+        page = self._render(n_samples, times, values).encode("utf-8")
+        with self.lock:
+            if self.n_samples == n_samples:
+                self.page = page
+        return page
+
+    def _render(self, n_samples: int, times: np.ndarray, values: np.ndarray) -> str:
+        lines: List[str] = []
+        lines.append(f"# TYPE {METRIC_PREFIX}samples counter")
+        lines.append(f"{METRIC_PREFIX}samples_total {n_samples}")
+        if n_samples > 0:
+            latest_slot = (n_samples - 1) % self.capacity
+            latest = values[latest_slot]
+            in_windows = [times >= times[latest_slot] - window for window in self.windows]
+            for j, i in enumerate(self.exported):
+                name = METRIC_PREFIX + self.columns[i]
+                if self.columns[i] in COUNTER_COLUMNS:
+                    lines.append(f"# TYPE {name} counter")
+                    lines.append(f"{name}_total {_format_value(latest[j])}")
+                    continue
+                lines.append(f"# TYPE {name} gauge")
+                lines.append(f"{name} {_format_value(latest[j])}")
+                for stat_name in ("min", "max", "mean"):
+                    lines.append(f"# TYPE {name}_{stat_name} gauge")
+                    for window, in_window in zip(self.windows, in_windows):
+                        window_values = values[in_window, j]
+                        value = window_values.min() if stat_name == "min" else window_values.max() \
+                            if stat_name == "max" else window_values.mean()
+                        lines.append(f'{name}_{stat_name}{{window="{window:g}"}} {_format_value(value)}')
+        lines.append("# EOF\n")
+        return "\n".join(lines)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    """ Answer GET /metrics from the snapshot of the server. """
+
+    def do_GET(self) -> None:  # pylint: disable=invalid-name
+        """ serve the page """
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        page = self.server.snapshot.render()  # type: ignore
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(page)))
+        self.end_headers()
+        self.wfile.write(page)
+
+    def log_message(self, format: str, *args: Any) -> None:  # pylint: disable=redefined-builtin
+        """ scrapes are not logged """
+
+
+class _UnixHTTPServer(ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def get_request(self):
+        request, _ = super().get_request()
+        # BaseHTTPRequestHandler expects a (host, port) address
+        return request, ("unix", 0)
+
+
+class _HTTPServer6(ThreadingHTTPServer):
+    address_family = socket.AF_INET6
+
+
+class MetricsServer:
+    """
+    Serve a MetricsSnapshot over HTTP at a port and/or a Unix socket, in daemon threads. See the module docs.
+
+    Example:
+        server = MetricsServer(MetricsSnapshot(columns), port=9400)
+        ...
+        server.snapshot.update(numbers)
+        ...
+        server.clean_up()
+    """
+
+    def __init__(
+        self, snapshot: MetricsSnapshot, port: Optional[int] = None, unix_socket: Optional[str] = None,
+        host: str = "127.0.0.1"
+    ) -> None:
+        """
+        Args:
+            snapshot (MetricsSnapshot): The snapshot to serve.
+            port (Optional[int], optional): The TCP port to serve at, 0 for any free one. Defaults to None.
+            unix_socket (Optional[str], optional): The path of a Unix socket to serve at. Defaults to None.
+            host (str, optional): The address to bind with `port`. Defaults to "127.0.0.1", local scrapers only.
+        """
+        assert port is not None or unix_socket is not None, "serve at a port or a Unix socket"
+        self.snapshot = snapshot
+        self.unix_socket = unix_socket
+        self.servers: List[Union[ThreadingHTTPServer, _UnixHTTPServer]] = []
+        if port is not None:
+            self.servers.append((_HTTPServer6 if ":" in host else ThreadingHTTPServer)((host, port), _MetricsHandler))
+        if unix_socket is not None:
+            # a socket left by a logger that was terminated
+            if os.path.exists(unix_socket) and stat.S_ISSOCK(os.stat(unix_socket).st_mode):
+                os.unlink(unix_socket)
+            self.servers.append(_UnixHTTPServer(unix_socket, _MetricsHandler))
+        self.threads: List[Thread] = []
+        for server in self.servers:
+            server.snapshot = snapshot  # type: ignore
+            thread = Thread(target=server.serve_forever, name="resource_monitor_metrics", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    @property
+    def addresses(self) -> List[Any]:
+        """ the bound addresses, e.g. to find the port when serving at port 0 """
+        return [server.server_address for server in self.servers]
+
+    def clean_up(self) -> None:
+        """ stop serving """
+        for server in self.servers:
+            server.shutdown()
+            server.server_close()
+        if self.unix_socket is not None and os.path.exists(self.unix_socket):
+            os.unlink(self.unix_socket)
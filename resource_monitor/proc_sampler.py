@@ -0,0 +1,316 @@
+"""
+    Linux sampling backend of ResourceLogger.
+
+    The files under /proc are opened once and re-read by `pread` into
+    preallocated buffers, so each sample costs a handful of syscalls
+    instead of the dozens made by psutil.
+"""
+import os
+from sys import platform
+from typing import Callable, Collection, Dict, List, Optional, Sequence, Tuple
+
+
+DISK_SECTOR_SIZE = 512
+# process states regarded as not running, see proc(5)
+INACTIVE_STATES = b"TXxZ"
+MEMINFO_KEYS = (
+    b"MemTotal:", b"MemAvailable:", b"SwapTotal:", b"SwapFree:", b"MemFree:", b"Buffers:", b"Cached:", b"SReclaimable:"
+)
+
+
+class _ProcFile:
+    """ A /proc file kept open and re-read from offset 0 into a fixed buffer. """
+
+    def __init__(self, path: str, buffer_size: int = 4096) -> None:
+        self.path = path
+        self.fd = os.open(path, os.O_RDONLY)
+        self.buffer = bytearray(buffer_size)
+        self.view = memoryview(self.buffer)
+
+    def read(self) -> bytes:
+        """ re-read the whole file, the buffer grows if the content does not fit """
+        while True:
+            n = os.preadv(self.fd, [self.buffer], 0)
+            if n < len(self.buffer):
+                return self.view[:n].tobytes()
+            self.buffer = bytearray(2 * len(self.buffer))
+            self.view = memoryview(self.buffer)
+
+    def close(self) -> None:
+        """ close the file descriptor """
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+class _ProcessFiles:
+    """ The kept-open /proc/<pid>/{stat,statm,io,smaps_rollup} of a process. """
+
+    def __init__(self, procfs: str, pid: int) -> None:
+        self.procfs = procfs
+        self.pid = pid
+        self.files: List[_ProcFile] = []
+        try:
+            self.stat = self._open(f"{procfs}/{pid}/stat")
+            self.statm = self._open(f"{procfs}/{pid}/statm", 256)
+            self.io = self._open(f"{procfs}/{pid}/io", 512)
+        except OSError:
+            self.close()
+            raise
+        # opened on demand, generating it walks all the memory mappings of the process
+        self.smaps_rollup: Optional[_ProcFile] = None
+
+    def get_smaps_rollup(self) -> _ProcFile:
+        """ open /proc/<pid>/smaps_rollup on the first call """
+        if self.smaps_rollup is None:
+            self.smaps_rollup = self._open(f"{self.procfs}/{self.pid}/smaps_rollup", 2048)
+        return self.smaps_rollup
+
+    def _open(self, path: str, buffer_size: int = 4096) -> _ProcFile:
+        f = _ProcFile(path, buffer_size)
+        self.files.append(f)
+        return f
+
+    def close(self) -> None:
+        """ close all file descriptors """
+        for f in self.files:
+            f.close()
+        self.files = []
+
+
+class ProcSampler:
+    """
+    Sample the resource usage of processes from /proc.
+
+    It has the same interface and returns the same numbers as PsutilSampler.
+    """
+
+    def __init__(self, pids: Sequence[int], procfs: str = "/proc") -> None:
+        """
+        Args:
+            pids (Sequence[int]): PID of the processes to monitor
+            procfs (str, optional): mount point of procfs. Defaults to "/proc".
+        """
+        self.procfs = procfs
+        self.page_size = os.sysconf("SC_PAGE_SIZE")
+        self.clock_ticks = os.sysconf("SC_CLK_TCK")
+
+        self.processes: Dict[int, _ProcessFiles] = {}
+        try:
+            for pid in pids:
+                self.processes[pid] = _ProcessFiles(procfs, pid)
+            self.cpu_stat = _ProcFile(f"{procfs}/stat", 16384)
+            self.meminfo = _ProcFile(f"{procfs}/meminfo", 8192)
+            self.diskstats = _ProcFile(f"{procfs}/diskstats", 16384)
+        except OSError:
+            self.clean_up()
+            raise
+
+        self.disk_lines = self._locate_disks(self.diskstats.read().split(b"\n"))
+        # PID (None for the logger) to the kept-open net/dev of its network namespace, opened on first use
+        self.net_dev: Dict[Optional[int], _ProcFile] = {}
+        self.last_cpu_global: Optional[List[int]] = None
+        self.meminfo_lines: Optional[List[int]] = None
+
+    @staticmethod
+    def is_available(procfs: str = "/proc") -> bool:
+        """ whether the backend can be used on the current platform """
+        return platform.startswith("linux") and hasattr(os, "preadv") and os.path.isdir(procfs)
+
+    def sample_cpu_global(self) -> float:
+        """ same as psutil.cpu_percent(), since the last call """
+        # user nice system idle iowait irq softirq steal guest guest_nice
+        times = [int(t) for t in self.cpu_stat.read().split(b"\n", 1)[0].split()[1:]]
+        # guest time is already counted in user/nice
+        total = sum(times[:8])
+        busy = total - times[3] - times[4]
+        last, self.last_cpu_global = self.last_cpu_global, [total, busy]
+        if last is None or total <= last[0]:
+            return 0.
+        return min(max((busy - last[1]) / (total - last[0]) * 100, 0.), 100.)
+
+    def sample_memory_global(self) -> List[int]:
+        """ return [vm_used, swap_used] in bytes, same as psutil """
+        lines = self.meminfo.read().split(b"\n")
+        if self.meminfo_lines is None or any(
+            not lines[i].startswith(key) for key, i in zip(MEMINFO_KEYS, self.meminfo_lines) if i >= 0
+        ):
+            # locate the lines once, the layout of /proc/meminfo does not change at runtime
+            keys = [line.split(b":", 1)[0] + b":" for line in lines]
+            self.meminfo_lines = [keys.index(key) if key in keys else -1 for key in MEMINFO_KEYS]
+        total, available, swap_total, swap_free, free, buffers, cached, reclaimable = [
+            int(lines[i].split()[1]) * 1024 if i >= 0 else 0 for i in self.meminfo_lines
+        ]
+        if available > 0:
+            used = total - available
+        else:
+            used = total - free - buffers - cached - reclaimable
+        return [used, swap_total - swap_free]
+
+    def sample_disk_global(self) -> List[int]:
+        """ return [read_count, read_bytes, write_count, write_bytes] of all disks """
+        lines = self.diskstats.read().split(b"\n")
+        read_count = read_sectors = write_count = write_sectors = 0
+        for name, i in self.disk_lines:
+            fields = lines[i].split() if i < len(lines) else []
+            if len(fields) < 10 or fields[2] != name:
+                # a device is added or removed, locate the lines again
+                self.disk_lines = self._locate_disks(lines)
+                return self.sample_disk_global()
+            read_count += int(fields[3])
+            read_sectors += int(fields[5])
+            write_count += int(fields[7])
+            write_sectors += int(fields[9])
+        return [read_count, read_sectors * DISK_SECTOR_SIZE, write_count, write_sectors * DISK_SECTOR_SIZE]
+
+    def sample_disk_devices(self, devices: Optional[Collection[str]] = None) -> Dict[str, List[int]]:
+        """return the cumulative counters of the devices, by default of all devices and partitions, same as psutil:
+        {device: [read_count, read_bytes, write_count, write_bytes, read_ms, write_ms, busy_ms, queue_ms]},
+        where busy_ms is the time with operations in flight, and queue_ms is the time weighted by their number
+        """
+        counters = {}
+        for line in self.diskstats.read().split(b"\n"):
+            fields = line.split()
+            if len(fields) < 14:
+                continue
+            name = fields[2].decode()
+            if devices is None or name in devices:
+                counters[name] = [  # see Documentation/admin-guide/iostats.rst of the kernel
+                    int(fields[3]), int(fields[5]) * DISK_SECTOR_SIZE,
+                    int(fields[7]), int(fields[9]) * DISK_SECTOR_SIZE,
+                    int(fields[6]), int(fields[10]), int(fields[12]), int(fields[13]),
+                ]
+        return counters
+
+    def sample_net_interfaces(
+        self, interfaces: Optional[Collection[str]] = None, pid: Optional[int] = None
+    ) -> Dict[str, List[int]]:
+        """return the cumulative counters of the network interfaces, by default of all:
+        {interface: [recv_bytes, recv_packets, sent_bytes, sent_packets, dropped]},
+        where dropped counts the errors and the drops of both directions.
+        The interfaces are those of the network namespace of process `pid`, by default of the logger.
+        None of them if the process is gone.
+        """
+        try:
+            net_dev = self.net_dev.get(pid)
+            if net_dev is None:
+                net_dev = _ProcFile(f"{self.procfs}/net/dev" if pid is None else f"{self.procfs}/{pid}/net/dev", 16384)
+                self.net_dev[pid] = net_dev
+            lines = net_dev.read().split(b"\n")
+        except OSError:
+            return {}
+        counters = {}
+        # the first two lines are the table header
+        for line in lines[2:]:
+            name, _, numbers = line.partition(b":")
+            fields = numbers.split()
+            if len(fields) < 16:
+                continue
+            interface = name.strip().decode()
+            if interfaces is None or interface in interfaces:
+                counters[interface] = [
+                    int(fields[0]), int(fields[1]), int(fields[8]), int(fields[9]),
+                    int(fields[2]) + int(fields[3]) + int(fields[10]) + int(fields[11]),
+                ]
+        return counters
+
+    @staticmethod
+    def _locate_disks(lines: List[bytes]) -> List[Tuple[bytes, int]]:
+        """ same as psutil.disk_io_counters(perdisk=False), partitions are excluded """
+        disk_lines = []
+        for i, line in enumerate(lines):
+            fields = line.split()
+            if len(fields) >= 10 and os.access(f"/sys/block/{fields[2].decode().replace('/', '!')}", os.F_OK):
+                disk_lines.append((fields[2], i))
+        return disk_lines
+
+    def set_pids(self, pids: Sequence[int]) -> None:
+        """ update the PID of the processes to monitor, the files of the kept processes stay open """
+        for pid in set(self.processes) - set(pids):
+            self.processes.pop(pid).close()
+        for pid in pids:
+            if pid not in self.processes:
+                try:
+                    self.processes[pid] = _ProcessFiles(self.procfs, pid)
+                except OSError:
+                    # the process is gone already
+                    continue
+
+    def _sample_files(
+        self, pids: Sequence[int], read: Callable[[_ProcessFiles], List[int]]
+    ) -> Dict[int, List[int]]:
+        """ apply `read` to the files of the processes, skipping the exited ones """
+        results = {}
+        for pid in pids:
+            process = self.processes.get(pid)
+            if process is None:
+                continue
+            try:
+                results[pid] = read(process)
+            except OSError:
+                # the process is gone, it is dropped by the next poll()
+                continue
+        return results
+
+    def poll(self) -> Dict[int, float]:
+        """
+        Check the monitored processes, the exited ones are dropped.
+        Returns PID to the CPU time (user + system, seconds) of the active processes.
+        """
+        cpu_times = {}
+        for pid, process in list(self.processes.items()):
+            try:
+                stat = process.stat.read()
+            except OSError:
+                # the process is gone, reading a kept-open file of it raises ESRCH
+                process.close()
+                del self.processes[pid]
+                continue
+            fields = stat[stat.rfind(b")") + 2:].split()
+            if fields[0] in INACTIVE_STATES:
+                continue
+            # utime and stime are the 14-th and 15-th fields of /proc/<pid>/stat
+            cpu_times[pid] = (int(fields[11]) + int(fields[12])) / self.clock_ticks
+        return cpu_times
+
+    def sample_memory(self, pids: Sequence[int]) -> Dict[int, List[int]]:
+        """ PID to [rss, vms] in bytes """
+        def read(process: _ProcessFiles) -> List[int]:
+            statm = process.statm.read().split()
+            return [int(statm[1]) * self.page_size, int(statm[0]) * self.page_size]
+        return self._sample_files(pids, read)
+
+    def sample_io(self, pids: Sequence[int]) -> Dict[int, List[int]]:
+        """ PID to [read_count, read_bytes, write_count, write_bytes] """
+        def read(process: _ProcessFiles) -> List[int]:
+            # rchar, wchar, syscr, syscw, read_bytes, write_bytes, cancelled_write_bytes
+            io = process.io.read().split()
+            return [int(io[5]), int(io[9]), int(io[7]), int(io[11])]
+        return self._sample_files(pids, read)
+
+    def sample_smaps(self, pids: Sequence[int]) -> Dict[int, List[int]]:
+        """ PID to [pss, uss, swap_pss] in bytes, from /proc/<pid>/smaps_rollup (Linux >= 4.14) """
+        def read(process: _ProcessFiles) -> List[int]:
+            fields = dict(
+                (line.split(b":", 1)[0], line.split()[1])
+                for line in process.get_smaps_rollup().read().splitlines()[1:]
+            )
+            return [
+                int(fields.get(b"Pss", 0)) * 1024,
+                (int(fields.get(b"Private_Clean", 0)) + int(fields.get(b"Private_Dirty", 0))) * 1024,
+                int(fields.get(b"SwapPss", 0)) * 1024,
+            ]
+        return self._sample_files(pids, read)
+
+    def clean_up(self) -> None:
+        """ close all file descriptors """
+        for process in self.processes.values():
+            process.close()
+        self.processes = {}
+        for name in ("cpu_stat", "meminfo", "diskstats"):
+            f = getattr(self, name, None)
+            if f is not None:
+                f.close()
+        for f in getattr(self, "net_dev", {}).values():
+            f.close()
+        self.net_dev = {}
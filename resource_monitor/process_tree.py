@@ -0,0 +1,101 @@
+"""
+    Track the descendants of the monitored processes.
+"""
+import os
+from typing import Collection, List, Optional, Sequence, Set
+
+import psutil  # type: ignore
+
+
+# the helper processes multiprocessing starts by exec, found in the command line
+HELPER_COMMANDS = (b"multiprocessing.resource_tracker", b"multiprocessing.forkserver")
+
+
+class ProcessTree:
+    """
+    The root processes and their descendants, discovered incrementally.
+
+    On Linux, the children of every known process are read from /proc/<pid>/task/<tid>/children,
+        so the whole process table is not scanned. Elsewhere, psutil.Process.children(recursive=True) is used.
+    The process running the tree (e.g. a resource logger subprocess), the helper processes of multiprocessing
+        (see HELPER_COMMANDS), `excluded_pids` and their descendants are never discovered,
+        so the monitor does not account its own usage.
+    """
+
+    def __init__(
+        self, root_pids: Sequence[int], procfs: str = "/proc", excluded_pids: Optional[Collection[int]] = None
+    ) -> None:
+        """
+        Args:
+            root_pids (Sequence[int]): PID of the root processes
+            procfs (str, optional): mount point of procfs. Defaults to "/proc".
+            excluded_pids (Optional[Collection[int]], optional):
+                PID of the processes not to discover, read on every refresh, so it can be updated in place,
+                e.g. a shared `multiprocessing.Array` (0 is ignored). Defaults to None.
+        """
+        self.root_pids: List[int] = list(root_pids)
+        self.pids: Set[int] = set(root_pids)
+        self.procfs = procfs
+        self.excluded_pids: Collection[int] = () if excluded_pids is None else excluded_pids
+        # the discovered helper processes, by their command line
+        self.helper_pids: Set[int] = set()
+        self.use_procfs = os.path.exists(f"{procfs}/{os.getpid()}/task/{os.getpid()}/children")
+
+    def _children_procfs(self, pid: int) -> List[int]:
+        children = []
+        try:
+            for tid in os.listdir(f"{self.procfs}/{pid}/task"):
+                with open(f"{self.procfs}/{pid}/task/{tid}/children", "rb") as f:
+                    children.extend(int(c) for c in f.read().split())
+        except OSError:
+            # the process or the thread is gone
+            pass
+        return children
+
+    def _descendants_psutil(self, pid: int) -> List[int]:
+        try:
+            return [p.pid for p in psutil.Process(pid).children(recursive=True)]
+        except psutil.Error:
+            return []
+
+    def _is_helper(self, pid: int) -> bool:
+        """ whether a new process is a helper process of multiprocessing """
+        try:
+            if self.use_procfs:
+                with open(f"{self.procfs}/{pid}/cmdline", "rb") as f:
+                    cmdline = f.read()
+            else:
+                cmdline = " ".join(psutil.Process(pid).cmdline()).encode("utf-8")
+        except (OSError, psutil.Error):
+            return False
+        if any(command in cmdline for command in HELPER_COMMANDS):
+            self.helper_pids.add(pid)
+            return True
+        return False
+
+    def refresh(self) -> bool:
+        """ drop the exited processes and discover new descendants, returns whether the set changes """
+        self.helper_pids = set(pid for pid in self.helper_pids if psutil.pid_exists(pid))
+        excluded = set(self.excluded_pids) | self.helper_pids
+        excluded.add(os.getpid())
+        # an excluded process can be discovered before it is excluded, e.g. right after it starts
+        pids = set(pid for pid in self.pids if pid not in excluded and psutil.pid_exists(pid))
+        # roots are kept even if exited, the set should never become empty on its own
+        pids.update(self.root_pids)
+        if self.use_procfs:
+            queue = list(pids)
+            while len(queue) > 0:
+                for child in self._children_procfs(queue.pop()):
+                    if child not in pids and child not in excluded and not self._is_helper(child):
+                        pids.add(child)
+                        queue.append(child)
+        else:
+            # a scan of the process table per root, the descendants of the excluded are not told apart
+            for root_pid in self.root_pids:
+                pids.update(
+                    pid for pid in self._descendants_psutil(root_pid)
+                    if pid not in excluded and (pid in self.pids or not self._is_helper(pid))
+                )
+        changed = pids != self.pids
+        self.pids = pids
+        return changed
@@ -0,0 +1,137 @@
+"""
+    Portable sampling backend of ResourceLogger, on top of psutil.
+"""
+from typing import Callable, Collection, Dict, List, Optional, Sequence
+
+import psutil  # type: ignore
+
+
+class PsutilSampler:
+    """
+    Sample the resource usage of processes with psutil.
+
+    The psutil.Process handles are cached, so psutil can reuse what it has read about a process.
+    It has the same interface and returns the same numbers as ProcSampler.
+    """
+
+    def __init__(self, pids: Sequence[int]) -> None:
+        """
+        Args:
+            pids (Sequence[int]): PID of the processes to monitor
+        """
+        self.processes: Dict[int, psutil.Process] = {}
+        self.set_pids(pids)
+
+    def set_pids(self, pids: Sequence[int]) -> None:
+        """ update the PID of the processes to monitor, the handles of the kept processes are reused """
+        processes = {}
+        for pid in pids:
+            try:
+                processes[pid] = self.processes[pid] if pid in self.processes else psutil.Process(pid)
+            except psutil.NoSuchProcess:
+                continue
+        self.processes = processes
+
+    def _sample_processes(
+        self, pids: Sequence[int], read: Callable[[psutil.Process], List[int]]
+    ) -> Dict[int, List[int]]:
+        """ apply `read` to the handles of the processes, skipping the exited ones """
+        results = {}
+        for pid in pids:
+            process = self.processes.get(pid)
+            if process is None:
+                continue
+            try:
+                results[pid] = read(process)
+            except psutil.NoSuchProcess:
+                continue
+        return results
+
+    def poll(self) -> Dict[int, float]:
+        """
+        Check the monitored processes, the exited ones are dropped.
+        Returns PID to the CPU time (user + system, seconds) of the active processes.
+        """
+        cpu_times = {}
+        for pid, process in list(self.processes.items()):
+            try:
+                # as_dict() queries the attributes in one shot
+                info = process.as_dict(attrs=["status", "cpu_times"])
+            except psutil.NoSuchProcess:
+                del self.processes[pid]
+                continue
+            if info["status"] in (
+                psutil.STATUS_STOPPED,
+                psutil.STATUS_DEAD,
+                psutil.STATUS_ZOMBIE,
+            ):
+                continue
+            cpu_times[pid] = info["cpu_times"].user + info["cpu_times"].system
+        return cpu_times
+
+    def sample_memory(self, pids: Sequence[int]) -> Dict[int, List[int]]:
+        """ PID to [rss, vms] in bytes """
+        def read(process: psutil.Process) -> List[int]:
+            memory_info = process.memory_info()
+            return [memory_info.rss, memory_info.vms]
+        return self._sample_processes(pids, read)
+
+    def sample_io(self, pids: Sequence[int]) -> Dict[int, List[int]]:
+        """ PID to [read_count, read_bytes, write_count, write_bytes] """
+        def read(process: psutil.Process) -> List[int]:
+            io_counters = process.io_counters()
+            return [io_counters.read_count, io_counters.read_bytes, io_counters.write_count, io_counters.write_bytes]
+        return self._sample_processes(pids, read)
+
+    def sample_smaps(self, pids: Sequence[int]) -> Dict[int, List[int]]:
+        """ PID to [pss, uss, swap_pss] in bytes, pss and swap are 0 where psutil does not provide them """
+        def read(process: psutil.Process) -> List[int]:
+            memory_info = process.memory_full_info()
+            return [getattr(memory_info, "pss", 0), memory_info.uss, getattr(memory_info, "swap", 0)]
+        return self._sample_processes(pids, read)
+
+    @staticmethod
+    def sample_cpu_global() -> float:
+        """ psutil.cpu_percent(), since the last call """
+        return psutil.cpu_percent()
+
+    @staticmethod
+    def sample_memory_global() -> List[int]:
+        """ [vm_used, swap_used] in bytes """
+        return [psutil.virtual_memory().used, psutil.swap_memory().used]
+
+    @staticmethod
+    def sample_disk_global() -> List[int]:
+        """ [read_count, read_bytes, write_count, write_bytes] of all disks """
+        io_counters = psutil.disk_io_counters()
+        return [io_counters.read_count, io_counters.read_bytes, io_counters.write_count, io_counters.write_bytes]
+
+    @staticmethod
+    def sample_disk_devices(devices: Optional[Collection[str]] = None) -> Dict[str, List[int]]:
+        """
+        {device: [read_count, read_bytes, write_count, write_bytes, read_ms, write_ms, busy_ms, queue_ms]}
+        of the devices, by default of all. psutil does not report queue_ms, it is 0, and busy_ms is Linux only.
+        """
+        return dict(
+            (name, [c.read_count, c.read_bytes, c.write_count, c.write_bytes, c.read_time, c.write_time,
+                    getattr(c, "busy_time", 0), 0])
+            for name, c in psutil.disk_io_counters(perdisk=True).items() if devices is None or name in devices
+        )
+
+    @staticmethod
+    def sample_net_interfaces(
+        interfaces: Optional[Collection[str]] = None, pid: Optional[int] = None  # pylint: disable=unused-argument
+    ) -> Dict[str, List[int]]:
+        """
+        {interface: [recv_bytes, recv_packets, sent_bytes, sent_packets, dropped]} of the network interfaces,
+        by default of all. psutil only reads the network namespace of the logger, `pid` is ignored.
+        """
+        return dict(
+            (name, [c.bytes_recv, c.packets_recv, c.bytes_sent, c.packets_sent,
+                    c.errin + c.errout + c.dropin + c.dropout])
+            for name, c in psutil.net_io_counters(pernic=True).items() if interfaces is None or name in interfaces
+        )
+
+    def clean_up(self) -> None:
+        """ drop the handles """
+        self.processes = {}
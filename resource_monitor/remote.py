@@ -0,0 +1,599 @@
+"""
+    Stream the resource samples and the events of many hosts to one collector, over TCP or a Unix socket.
+
+    An agent is a resource logger writing with `output_format="agent"` (see AgentResourceWriter), or an event logger
+        set up with `setup_root_event_logger(address, mode="agent")` (see AgentEventLogger).
+    Agents send batches, not samples: a resource agent sends the packed records of the samples once per
+        `batch_interval`, an event agent sends the bytes of its binary event log (see BinaryEventLogger)
+        when a thread's buffer is written out, at most once per `batch_interval` unless 64 KiB are pending.
+    So an agent sampling at 100 Hz sends about one frame per second, and the collector does one write per frame.
+
+    The timestamps are `perf_counter` times, which cannot be compared across hosts. The collector pings every agent
+        and the agent answers with its clock. The offset of the agent's clock is estimated from the exchange with
+        the shortest round trip among the latest ones, like NTP, and is accurate to half that round trip.
+    The collector shifts the times it receives onto its own clock, and writes per agent
+        "<host>_PID<pid>_resource.log" (binary resource log) or "<host>_PID<pid>_event.log" (binary event log)
+        to the store directory, along with the index "agents.json" of the agents, their clock offsets and the
+        `time() - perf_counter()` of the collector, to convert the times to wall-clock times.
+    The store is read by `report.parse_remote_store`.
+
+    Frames are (kind, payload length) as little-endian uint32 followed by the payload:
+        * HELLO, agent to collector, UTF-8 JSON: host, pid, kind ("resource" or "event"),
+            and message, global_info and columns for the resource agents;
+        * PING, collector to agent: the collector's `perf_counter_ns` as int64;
+        * PONG, agent to collector: the PING's time and the agent's `perf_counter_ns` as int64;
+        * SAMPLES, agent to collector: packed resource records, see `log_format`;
+        * EVENTS, agent to collector: the next bytes of a binary event log.
+
+    Usage:
+        python -m resource_monitor.remote --listen :9500 --store merged_logs
+        python -m resource_monitor --pid 1234 --format agent --output collector-host:9500
+        setup_root_event_logger("collector-host:9500", mode="agent")
+"""
+import argparse
+import json
+import os
+import socket
+import stat
+import struct
+import sys
+from collections import deque
+from socketserver import BaseRequestHandler, ThreadingTCPServer, ThreadingUnixStreamServer
+from threading import Event, Lock, Thread
+from time import perf_counter, perf_counter_ns, time
+from typing import Any, BinaryIO, Deque, Dict, List, Optional, Tuple, Union
+
+import numpy as np
+
+from .event_logger import (
+    EVENT_CHUNK_HEADER, EVENT_CHUNK_RECORDS, EVENT_LOG_MAGIC, EVENT_LOG_VERSIONS, BinaryEventLogger
+)
+from .log_format import STORE_INDEX, BinaryResourceWriter, column_dtype, record_dtype
+
+
+FRAME_HEADER = struct.Struct("<II")
+FRAME_HELLO = 1
+FRAME_PING = 2
+FRAME_PONG = 3
+FRAME_SAMPLES = 4
+FRAME_EVENTS = 5
+_PING = struct.Struct("<q")
+_PONG = struct.Struct("<qq")
+# the event log bytes sent at once at most
+MAX_BATCH_BYTES = 1 << 16
+# the pings sent to a new agent, to estimate its clock offset before its data are written
+INITIAL_PINGS = 8
+# the latest ping exchanges the clock offset is estimated from
+OFFSET_WINDOW = 16
+
+
+def parse_address(address: str) -> Tuple[int, Union[str, Tuple[str, int]]]:
+    """ the socket family and address of "host:port", "[ipv6]:port" or "unix:/path/to/socket" """
+    if address.startswith("unix:"):
+        return socket.AF_UNIX, address[len("unix:"):]
+    host, separator, port = address.rpartition(":")
+    assert len(separator) > 0, f"expected host:port or unix:path, got {address}"
+    host = host.strip("[]")
+    return (socket.AF_INET6 if ":" in host else socket.AF_INET), (host, int(port))
+
+
+def _receive_exactly(sock: socket.socket, size: int) -> Optional[bytes]:
+    """ `size` bytes from the socket, None at the end of the stream """
+    data = bytearray(size)
+    view = memoryview(data)
+    received = 0
+    while received < size:
+        n = sock.recv_into(view[received:])
+        if n == 0:
+            return None
+        received += n
+    return bytes(data)
+
+
+def read_frame(sock: socket.socket) -> Optional[Tuple[int, bytes]]:
+    """ the next (kind, payload) from the socket, None at the end of the stream """
+    header = _receive_exactly(sock, FRAME_HEADER.size)
+    if header is None:
+        return None
+    kind, length = FRAME_HEADER.unpack(header)
+    payload = _receive_exactly(sock, length) if length > 0 else b""
+    if payload is None:
+        return None
+    return kind, payload
+
+
+class AgentConnection:
+    """
+    The connection of an agent to the collector. The pings of the collector are answered by a daemon thread.
+    Sending never raises: if the collector is gone, a warning is printed once and the data are dropped,
+        so the monitored program is not disturbed.
+    """
+
+    def __init__(self, address: str, hello: Dict[str, Any]) -> None:
+        """
+        Args:
+            address (str): The collector, "host:port" or "unix:/path/to/socket".
+            hello (Dict[str, Any]): Describes the agent, see the module docs.
+        """
+        family, socket_address = parse_address(address)
+        self.address = address
+        self.socket = socket.socket(family, socket.SOCK_STREAM)
+        self.socket.connect(socket_address)
+        if family != socket.AF_UNIX:
+            # the pongs must not wait for more data to send
+            self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.pid = os.getpid()
+        self.lock = Lock()
+        self.broken = False
+        self.send(FRAME_HELLO, json.dumps(hello).encode("utf-8"))
+        self.thread = Thread(target=self._answer_pings, name="resource_monitor_agent", daemon=True)
+        self.thread.start()
+
+    def send(self, kind: int, payload: bytes) -> None:
+        """ send a frame, dropped if the connection is broken """
+        if self.broken:
+            return
+        try:
+            with self.lock:
+                self.socket.sendall(FRAME_HEADER.pack(kind, len(payload)) + payload)
+        except OSError as e:
+            self.broken = True
+            print(f"resource_monitor: lost the collector at {self.address}, dropping the data: {e}", file=sys.stderr)
+
+    def _answer_pings(self) -> None:
+        while True:
+            try:
+                frame = read_frame(self.socket)
+            except OSError:
+                return
+            if frame is None:
+                return
+            kind, payload = frame
+            if kind == FRAME_PING:
+                (collector_time,) = _PING.unpack(payload)
+                self.send(FRAME_PONG, _PONG.pack(collector_time, perf_counter_ns()))
+
+    def fileno(self) -> int:
+        """ the descriptor of the socket """
+        return self.socket.fileno()
+
+    def close(self) -> None:
+        """ end the stream after the data sent, then close the socket """
+        if os.getpid() == self.pid and not self.broken:
+            try:
+                with self.lock:
+                    # the pongs to the pings still coming are not sent
+                    self.broken = True
+                    self.socket.shutdown(socket.SHUT_WR)
+                # the collector closes its end after reading all the data, which ends the thread
+                self.thread.join(timeout=5.)
+            except OSError:
+                pass
+        # a forked child only closes its descriptor, the connection is the parent's
+        self.socket.close()
+
+
+def _hello(kind: str, **kwargs: Any) -> Dict[str, Any]:
+    return dict(host=socket.gethostname(), pid=os.getpid(), kind=kind, **kwargs)
+
+
+class AgentResourceWriter:
+    """ Send the resource log to a collector in batches of packed records, with the interface of the writers. """
+
+    def __init__(self, output: str, batch_interval: float = 1.) -> None:
+        """
+        Args:
+            output (str): The collector, "host:port" or "unix:/path/to/socket".
+            batch_interval (float, optional): The shortest time (seconds) between batches. Defaults to 1.
+        """
+        self.address = output
+        self.batch_interval = batch_interval
+        self.connection: Optional[AgentConnection] = None
+        self.record: Optional[struct.Struct] = None
+        self.buffer = bytearray()
+        self.last_batch = perf_counter()
+
+    def write_preamble(self, message: str, global_info: Dict[str, int], headers: List[str]) -> None:
+        """ connect, sending the header of the log """
+        columns = [(h, column_dtype(h)) for h in headers]
+        self.connection = AgentConnection(
+            self.address, _hello("resource", message=message, global_info=global_info, columns=columns)
+        )
+        self.record = struct.Struct("<" + "".join("d" if dtype == "<f8" else "q" for _, dtype in columns))
+
+    def write_row(self, numbers: List[Union[int, float]]) -> None:
+        """ buffer a packed record until the next batch """
+        assert self.record is not None, "the preamble is not written"
+        self.buffer += self.record.pack(*numbers)
+
+    def _send(self) -> None:
+        if len(self.buffer) > 0 and self.connection is not None:
+            self.connection.send(FRAME_SAMPLES, bytes(self.buffer))
+        self.buffer = bytearray()
+        self.last_batch = perf_counter()
+
+    def flush(self) -> None:
+        """ send the buffered records, if `batch_interval` has passed since the last batch """
+        if perf_counter() - self.last_batch >= self.batch_interval:
+            self._send()
+
+    def close(self) -> None:
+        """ send the buffered records and disconnect """
+        self._send()
+        if self.connection is not None:
+            self.connection.close()
+
+
+class _AgentFile:
+    """ A write-only binary file sending its bytes to the collector in batches. """
+
+    def __init__(self, connection: AgentConnection, batch_interval: float) -> None:
+        self.connection = connection
+        self.batch_interval = batch_interval
+        self.buffer = bytearray()
+        self.last_batch = perf_counter()
+        self.closed = False
+
+    def write(self, data: bytes) -> int:
+        """ buffer the data, sent if `batch_interval` has passed since the last batch or enough are pending """
+        self.buffer += data
+        if len(self.buffer) >= MAX_BATCH_BYTES or perf_counter() - self.last_batch >= self.batch_interval:
+            self.flush()
+        return len(data)
+
+    def flush(self) -> None:
+        """ send the buffered data """
+        # the buffer inherited by a forked child is the parent's to send
+        if len(self.buffer) > 0 and os.getpid() == self.connection.pid:
+            self.connection.send(FRAME_EVENTS, bytes(self.buffer))
+        self.buffer = bytearray()
+        self.last_batch = perf_counter()
+
+    def fileno(self) -> int:
+        """ the descriptor of the socket """
+        return self.connection.fileno()
+
+    def close(self) -> None:
+        """ send the buffered data and disconnect """
+        if self.closed:
+            return
+        self.flush()
+        self.connection.close()
+        self.closed = True
+
+
+class AgentEventLogger(BinaryEventLogger):
+    """
+    BinaryEventLogger sending the log to a collector instead of a file, see the module docs.
+    The records are sent when the buffer of a thread is full and by flush() and clean_up(),
+        a smaller `buffer_size` sends the events sooner.
+    """
+
+    def __init__(self, output: str, buffer_size: int = 4096, batch_interval: float = 1.) -> None:
+        """
+        Args:
+            output (str): The collector, "host:port" or "unix:/path/to/socket".
+            buffer_size (int, optional): number of records buffered per thread. Defaults to 4096.
+            batch_interval (float, optional): The shortest time (seconds) between batches. Defaults to 1.
+        """
+        self.batch_interval = batch_interval
+        super().__init__(output, buffer_size)
+
+    def _open_file(self, output: str) -> BinaryIO:
+        return _AgentFile(AgentConnection(output, _hello("event")), self.batch_interval)  # type: ignore
+
+
+class _ClockOffset:
+    """ The offset of an agent's clock from the collector's, from the ping exchange with the shortest round trip. """
+
+    def __init__(self) -> None:
+        # (round trip, offset) in ns of the latest exchanges
+        self.exchanges: Deque[Tuple[int, int]] = deque(maxlen=OFFSET_WINDOW)
+
+    def add(self, sent: int, agent_time: int, received: int) -> None:
+        """ add an exchange: the collector's times of the ping and the pong, the agent's time in between """
+        self.exchanges.append((received - sent, agent_time - (sent + received) // 2))
+
+    @property
+    def best(self) -> Optional[Tuple[int, int]]:
+        """ (round trip, offset) in ns, None before the first exchange """
+        return min(self.exchanges) if len(self.exchanges) > 0 else None
+
+
+class _AgentSession:
+    """ The connection of an agent to the collector, writing its data to the store. """
+
+    def __init__(self, sock: socket.socket, hello: Dict[str, Any], path: str) -> None:
+        self.socket = sock
+        self.hello = hello
+        self.kind = hello["kind"]
+        self.path = path
+        self.lock = Lock()
+        self.clock = _ClockOffset()
+        # the data received before the first pong, written once the offset is known
+        self.pending: List[bytes] = []
+        self.connected = True
+        if self.kind == "resource":
+            columns = [tuple(c) for c in hello["columns"]]
+            self.dtype = record_dtype(columns)  # type: ignore
+            self.writer = BinaryResourceWriter(path)
+            self.writer.write_preamble(hello["message"], hello["global_info"], [name for name, _ in columns])
+        else:
+            assert self.kind == "event", f"got {self.kind}"
+            self.file: BinaryIO = open(path, "wb")
+            self.stream = bytearray()
+            self.record_fields = 0
+
+    def ping(self) -> None:
+        """ send a ping, ignoring a closing connection """
+        try:
+            with self.lock:
+                self.socket.sendall(FRAME_HEADER.pack(FRAME_PING, _PING.size) + _PING.pack(perf_counter_ns()))
+        except OSError:
+            pass
+
+    def receive(self, kind: int, payload: bytes) -> None:
+        """ handle a frame """
+        if kind == FRAME_PONG:
+            received = perf_counter_ns()
+            sent, agent_time = _PONG.unpack(payload)
+            self.clock.add(sent, agent_time, received)
+            if len(self.pending) > 0:
+                self._write_pending()
+        elif kind in (FRAME_SAMPLES, FRAME_EVENTS):
+            if self.clock.best is None:
+                self.pending.append(payload)
+            else:
+                self._write(payload)
+
+    def _write_pending(self) -> None:
+        for payload in self.pending:
+            self._write(payload)
+        self.pending = []
+
+    @property
+    def offset(self) -> int:
+        """ the clock offset (ns) of the agent, 0 if unknown """
+        best = self.clock.best
+        return best[1] if best is not None else 0
+
+    def _write(self, payload: bytes) -> None:
+        if self.kind == "resource":
+            records = np.frombuffer(payload, dtype=self.dtype).copy()
+            records["time"] -= self.offset / 1e9
+            self.writer.write_records(records.tobytes())
+            return
+        self.stream += payload
+        if self.record_fields == 0:
+            if len(self.stream) < len(EVENT_LOG_MAGIC):
+                return
+            magic = bytes(self.stream[:len(EVENT_LOG_MAGIC)])
+            assert magic in EVENT_LOG_VERSIONS, f"not an event log: {magic!r}"
+            self.record_fields = EVENT_LOG_VERSIONS[magic]
+            self.file.write(magic)
+            del self.stream[:len(magic)]
+        # write the complete chunks, shifting the times of the records
+        start = 0
+        while len(self.stream) - start >= EVENT_CHUNK_HEADER.size:
+            chunk_kind, length = EVENT_CHUNK_HEADER.unpack_from(self.stream, start)
+            end = start + EVENT_CHUNK_HEADER.size + length
+            if end > len(self.stream):
+                break
+            chunk = bytes(self.stream[start + EVENT_CHUNK_HEADER.size:end])
+            if chunk_kind == EVENT_CHUNK_RECORDS:
+                records = np.frombuffer(chunk, dtype="<i8").reshape(-1, self.record_fields).copy()
+                records[:, 0] -= self.offset
+                chunk = records.tobytes()
+            self.file.write(EVENT_CHUNK_HEADER.pack(chunk_kind, length) + chunk)
+            start = end
+        del self.stream[:start]
+        self.file.flush()
+
+    def close(self) -> None:
+        """ write the data still pending, with a zero offset if none was estimated, and close the log """
+        self._write_pending()
+        self.connected = False
+        if self.kind == "resource":
+            self.writer.close()
+        else:
+            self.file.close()
+
+    def to_dict(self) -> Dict[str, Any]:
+        """ the entry of the index """
+        best = self.clock.best
+        return {
+            "host": self.hello["host"], "pid": self.hello["pid"], "kind": self.kind,
+            "file": os.path.basename(self.path), "connected": self.connected,
+            "clock_offset_ns": best[1] if best is not None else None,
+            "round_trip_ns": best[0] if best is not None else None,
+        }
+
+
+class _AgentHandler(BaseRequestHandler):
+    def handle(self) -> None:
+        self.server.collector._serve(self.request)  # type: ignore # pylint: disable=protected-access
+
+
+class _TCPServer(ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class _TCPServer6(_TCPServer):
+    address_family = socket.AF_INET6
+
+
+class _UnixServer(ThreadingUnixStreamServer):
+    daemon_threads = True
+
+
+class RemoteCollector:
+    """
+    Receive the data of agents and write them to a time-aligned store, see the module docs.
+
+    Example:
+        collector = RemoteCollector("127.0.0.1:9500", "merged_logs")
+        collector.start()
+        ...
+        collector.clean_up()
+        agents = report.parse_remote_store("merged_logs")
+    """
+
+    def __init__(self, listen: str, store: str, ping_interval: float = 5.) -> None:
+        """
+        Args:
+            listen (str): The address to listen at, "host:port" (port 0 for any free one) or "unix:/path/to/socket".
+            store (str): The store directory, created if missing.
+            ping_interval (float, optional): Time (seconds) between the pings of an agent. Defaults to 5.
+        """
+        self.store = store
+        self.ping_interval = ping_interval
+        os.makedirs(store, exist_ok=True)
+        self.epoch_offset = time() - perf_counter()
+        self.sessions: List[_AgentSession] = []
+        # the agents of the index from previous runs of a collector on the same store
+        self.previous_agents: List[Dict[str, Any]] = []
+        if os.path.exists(os.path.join(store, STORE_INDEX)):
+            with open(os.path.join(store, STORE_INDEX), encoding="utf-8") as f:
+                self.previous_agents = [dict(agent, connected=False) for agent in json.load(f)["agents"]]
+        self.lock = Lock()
+        family, address = parse_address(listen)
+        self.unix_socket: Optional[str] = None
+        self.server: Union[_TCPServer, _UnixServer]
+        if family == socket.AF_UNIX:
+            assert isinstance(address, str)
+            # a socket left by a collector that was terminated
+            if os.path.exists(address) and stat.S_ISSOCK(os.stat(address).st_mode):
+                os.unlink(address)
+            self.unix_socket = address
+            self.server = _UnixServer(address, _AgentHandler)
+        else:
+            self.server = (_TCPServer6 if family == socket.AF_INET6 else _TCPServer)(address, _AgentHandler)
+        self.server.collector = self  # type: ignore
+        self.stop_event = Event()
+        self.threads: List[Thread] = []
+
+    @property
+    def address(self) -> Any:
+        """ the bound address, e.g. to find the port when listening at port 0 """
+        return self.server.server_address
+
+    def _new_path(self, hello: Dict[str, Any]) -> str:
+        """ a new log in the store for an agent, numbered if the agent reconnects """
+        stem = f"{hello['host']}_PID{hello['pid']}_{hello['kind']}"
+        path = os.path.join(self.store, stem + ".log")
+        n = 1
+        while os.path.exists(path):
+            path = os.path.join(self.store, f"{stem}_{n}.log")
+            n += 1
+        return path
+
+    def _serve(self, sock: socket.socket) -> None:
+        if sock.family != socket.AF_UNIX:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        frame = read_frame(sock)
+        if frame is None or frame[0] != FRAME_HELLO:
+            return
+        hello = json.loads(frame[1])
+        with self.lock:
+            session = _AgentSession(sock, hello, self._new_path(hello))
+            self.sessions.append(session)
+            self._write_index()
+        for _ in range(INITIAL_PINGS):
+            session.ping()
+        try:
+            while True:
+                frame = read_frame(sock)
+                if frame is None:
+                    break
+                session.receive(*frame)
+        except OSError:
+            pass
+        finally:
+            with self.lock:
+                session.close()
+                self._write_index()
+
+    def _ping(self) -> None:
+        while not self.stop_event.wait(self.ping_interval):
+            with self.lock:
+                sessions = [s for s in self.sessions if s.connected]
+            for session in sessions:
+                session.ping()
+            with self.lock:
+                self._write_index()
+
+    def _write_index(self) -> None:
+        """ rewrite the index, the lock is held """
+        index = {
+            "epoch_offset": self.epoch_offset,
+            "agents": self.previous_agents + [session.to_dict() for session in self.sessions],
+        }
+        temp = os.path.join(self.store, STORE_INDEX + ".tmp")
+        with open(temp, "w", encoding="utf-8") as f:
+            json.dump(index, f, indent=1)
+        os.replace(temp, os.path.join(self.store, STORE_INDEX))
+
+    def start(self) -> None:
+        """ serve in daemon threads """
+        with self.lock:
+            self._write_index()
+        for target, name in ((self.server.serve_forever, "resource_monitor_collector"),
+                             (self._ping, "resource_monitor_collector_ping")):
+            thread = Thread(target=target, name=name, daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def serve_forever(self) -> None:
+        """ serve until interrupted """
+        self.start()
+        try:
+            while self.threads[0].is_alive():
+                self.threads[0].join(1.)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.clean_up()
+
+    def clean_up(self) -> None:
+        """ stop serving, and close the logs of the agents still connected """
+        self.stop_event.set()
+        self.server.shutdown()
+        self.server.server_close()
+        with self.lock:
+            for session in self.sessions:
+                if session.connected:
+                    try:
+                        session.socket.shutdown(socket.SHUT_RDWR)
+                    except OSError:
+                        pass
+        # the handlers close the sessions as their connections end
+        for session in list(self.sessions):
+            while session.connected:
+                self.stop_event.wait(0.01)
+        if self.unix_socket is not None and os.path.exists(self.unix_socket):
+            os.unlink(self.unix_socket)
+
+
+def main() -> None:
+    """ commandline interface """
+    parser = argparse.ArgumentParser(prog="python -m resource_monitor.remote")
+    parser.add_argument(
+        "--listen", type=str, required=False, default="127.0.0.1:9500",
+        help="Address to receive the agents at, \"host:port\" or \"unix:/path/to/socket\". "
+        "Defaults to \"127.0.0.1:9500\", use \":9500\" for all interfaces."
+    )
+    parser.add_argument(
+        "--store", type=str, required=True,
+        help="Directory to write the time-aligned logs of the agents to, see report.parse_remote_store."
+    )
+    parser.add_argument(
+        "--ping_interval", type=float, required=False, default=5.,
+        help="Time (second) between the clock offset estimations of an agent. Defaults to 5."
+    )
+    args = parser.parse_args()
+    RemoteCollector(args.listen, args.store, args.ping_interval).serve_forever()
+
+
+if __name__ == "__main__":
+    main()
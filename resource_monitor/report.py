@@ -1,49 +1,225 @@
 """
     Merge the logs of EventLogger and ResourceLogger,
     and report a event-wise resource monitoring result.
+
+    Parse the logs by `parse_event_log` and `parse_resource_log`,
+    then attribute the resource usage to every event occurrence by `attribute_events`.
+    To process logs larger than memory, or logs still being written, use the streams in `stream`.
 """
-from typing import Dict, List, Tuple
+import json
+import os
+from typing import Any, Dict, List, Optional, Sequence, Tuple
 import numpy as np
 from numpy.typing import NDArray
 
+from .event_logger import (
+    EVENT_LOG_MAGIC, EVENT_LOG_VERSIONS, EVENT_RECORD_FIELDS, HISTOGRAM_BUCKETS, histogram_bucket_bounds
+)
+from .log_format import (
+    FRESHNESS_COLUMN_PREFIX, ROLLUP_LOG_MAGIC, SCHEDULING_COLUMNS, STORE_INDEX, column_dtype, is_binary_resource_log,
+    is_rollup_resource_log, read_binary_header, record_dtype, rollup_columns, rollup_dtype
+)
+from .cache import load_event_log, load_resource_log
+from .stream import EventLogStream, ResourceLogStream
+
 
-def parse_event_log(filename: str) -> Dict[str, NDArray[np.float64]]:
+def parse_event_log(
+    filename: str, cache: bool = False, event_names: Optional[Sequence[str]] = None
+) -> Dict[str, NDArray[np.float64]]:
     """parse the event log to a dict of event name to the start/end times of different event id
 
     Args:
         filename (str): event log file path
+        cache (bool, optional):
+            Parse through a sidecar cache next to the log, see `cache`. The next parse only reads
+            the appended tail of the log. Defaults to False.
+        event_names (Optional[Sequence[str]], optional):
+            Only return these events. With `cache`, the other events are not read. Defaults to None, all events.
 
     Returns:
         Dict[str, NDArray[np.float64]]:
             event name and a 2-dim ndarray (shape=(n_occurrences, 2)) indicating the start/finish time
     """
-    with open(filename, mode="r", encoding="utf-8") as f:
-        records = f.readlines()
+    if cache:
+        try:
+            return load_event_log(filename, event_names)
+        except OSError:
+            # e.g. the directory of the log is read-only
+            pass
+    stream = EventLogStream(filename)
+    event_intervals: Dict[str, List[NDArray[np.float64]]] = {}
+    try:
+        # only the running events are kept across blocks, besides the results
+        for occurrences in stream.occurrences():
+            for event_name, intervals in occurrences.items():
+                if event_names is None or event_name in event_names:
+                    event_intervals.setdefault(event_name, []).append(intervals)
+    finally:
+        stream.close()
+    return dict((k, np.concatenate(v)) for k, v in event_intervals.items())
 
-    event_intervals: Dict[str, Dict[str, List[float]]] = {}
-    for record in records:
-        record = record.strip("\n")
-        time, start, event_name, event_id = record.split(",")
-        if event_name not in event_intervals:
-            event_intervals[event_name] = {}
-        if event_id not in event_intervals[event_name]:
-            event_intervals[event_name][event_id] = [0., 0.]
 
-        if start == "start":
-            event_intervals[event_name][event_id][0] = float(time)
-        else:
-            event_intervals[event_name][event_id][1] = float(time)
+def parse_binary_event_log(filename: str) -> Tuple[List[str], NDArray[np.int64]]:
+    """read the raw records of a binary event log written by BinaryEventLogger
+
+    Args:
+        filename (str): binary event log file path
+
+    Returns:
+        Tuple[List[str], NDArray[np.int64]]:
+            event names indexed by name ID, and a 2-dim ndarray (shape=(n_records, 7)) of
+                (perf_counter_ns, kind, name_id, event_id, thread_id, task_id, pid).
+            Kind is EVENT_KIND_START, EVENT_KIND_END or EVENT_KIND_ERROR. Task ID is -1 outside asyncio tasks.
+            PID is -1 in the logs of older versions.
+            A partially written last chunk is skipped.
+    """
+    with open(filename, "rb") as f:
+        magic = f.read(len(EVENT_LOG_MAGIC))
+    assert magic in EVENT_LOG_VERSIONS, f"not a binary event log: {filename}"
+    stream = EventLogStream(filename)
+    try:
+        chunks = list(stream)
+    finally:
+        stream.close()
+    records = np.concatenate(chunks) if len(chunks) > 0 else np.zeros((0, EVENT_RECORD_FIELDS), dtype=np.int64)
+    return stream.names, records
+
+
+def pair_events(
+    names: List[str],
+    times: NDArray[np.float64],
+    is_end: NDArray[np.bool_],
+    name_ids: NDArray[np.int64],
+    event_ids: NDArray[np.int64],
+) -> Dict[str, NDArray[np.float64]]:
+    """pair the start/end records of events by (event name, event id), vectorized
+
+    Args:
+        names (List[str]): event names indexed by name ID
+        times (NDArray[np.float64]): time of the records
+        is_end (NDArray[np.bool_]): whether the records are event ends
+        name_ids (NDArray[np.int64]): name ID of the records
+        event_ids (NDArray[np.int64]): event ID of the records
+
+    Returns:
+        Dict[str, NDArray[np.float64]]: same as `parse_event_log`
+    """
+    if len(times) == 0:
+        return {}
+    order = np.lexsort((event_ids, name_ids))
+    name_ids, event_ids = name_ids[order], event_ids[order]
+    new_occurrence = np.ones(len(order), dtype=bool)
+    new_occurrence[1:] = (name_ids[1:] != name_ids[:-1]) | (event_ids[1:] != event_ids[:-1])
+    occurrence = np.cumsum(new_occurrence) - 1
+
+    intervals = np.zeros((occurrence[-1] + 1, 2), dtype=np.float64)
+    # the sort is stable, so a later record of the same (name, id, kind) overwrites an earlier one
+    intervals[occurrence, is_end[order].astype(np.int64)] = times[order]
+
+    occurrence_name_ids = name_ids[new_occurrence]
+    boundaries = np.flatnonzero(np.diff(occurrence_name_ids)) + 1
+    starts = np.concatenate([[0], boundaries])
+    ends = np.concatenate([boundaries, [len(occurrence_name_ids)]])
+    return dict(
+        (names[occurrence_name_ids[s]], intervals[s:e]) for s, e in zip(starts, ends)
+    )
+
+
+def _load_event_stats_snapshot(filename: str, snapshot: int = -1) -> Dict[str, Dict[str, Any]]:
+    """ load a snapshot (the last one by default) of an AggregateEventLogger log, skipping a partial last line """
+    snapshots = []
+    with open(filename, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.endswith("\n"):
+                snapshots.append(line)
+    if len(snapshots) == 0:
+        return {}
+    return json.loads(snapshots[snapshot])["events"]
+
+
+def _summarize_event_stats(events: Dict[str, Dict[str, Any]]) -> Dict[str, Dict[str, float]]:
+    """ compute the mean and the percentiles from the histograms """
+    lower, upper = np.array([histogram_bucket_bounds(i) for i in range(HISTOGRAM_BUCKETS)], dtype=np.float64).T
+    # durations in a bucket are estimated by the bucket midpoint
+    midpoints = (lower + upper - 1) / 2
+
+    summary = {}
+    for event_name, stats in events.items():
+        histogram = np.zeros(HISTOGRAM_BUCKETS, dtype=np.int64)
+        for bucket, count in stats["histogram"]:
+            histogram[bucket] += count
+        cumulative = np.cumsum(histogram)
+        result = {
+            "count": float(stats["count"]),
+            "errors": float(stats.get("errors", 0)),
+            "sum": stats["sum"] / 1e9,
+            "mean": stats["sum"] / max(stats["count"], 1) / 1e9,
+            "min": max(stats["min"], 0) / 1e9,
+            "max": max(stats["max"], 0) / 1e9,
+        }
+        for name, q in (("p50", 0.5), ("p99", 0.99), ("p999", 0.999)):
+            bucket = np.searchsorted(cumulative, q * cumulative[-1]) if cumulative[-1] > 0 else 0
+            result[name] = float(np.clip(midpoints[bucket], stats["min"], stats["max"])) / 1e9
+        summary[event_name] = result
+    return summary
+
+
+def _merge_event_stats(merged: Dict[str, Dict[str, Any]], events: Dict[str, Dict[str, Any]]) -> None:
+    """ merge the raw statistics (see `_load_event_stats_snapshot`) of `events` into `merged` """
+    for event_name, stats in events.items():
+        if event_name not in merged:
+            merged[event_name] = {"count": 0, "errors": 0, "sum": 0, "min": -1, "max": -1, "histogram": []}
+        m = merged[event_name]
+        m["count"] += stats["count"]
+        m["errors"] += stats.get("errors", 0)
+        m["sum"] += stats["sum"]
+        if stats["min"] >= 0 and (stats["min"] < m["min"] or m["min"] < 0):
+            m["min"] = stats["min"]
+        m["max"] = max(m["max"], stats["max"])
+        m["histogram"].extend(stats["histogram"])
+
+
+def merge_event_stats(filenames: Sequence[str]) -> Dict[str, Dict[str, float]]:
+    """merge the last snapshots of several AggregateEventLogger logs, e.g. of different processes
+
+    Args:
+        filenames (Sequence[str]): the log file paths
+
+    Returns:
+        Dict[str, Dict[str, float]]: see `parse_event_stats`
+    """
+    merged: Dict[str, Dict[str, Any]] = {}
+    for filename in filenames:
+        _merge_event_stats(merged, _load_event_stats_snapshot(filename))
+    return _summarize_event_stats(merged)
+
+
+def parse_event_stats(filename: str, snapshot: int = -1) -> Dict[str, Dict[str, float]]:
+    """parse a snapshot of the log of AggregateEventLogger
+
+    Args:
+        filename (str): the log file path
+        snapshot (int, optional): index of the snapshot. Snapshots are cumulative. Defaults to -1, the last one.
 
-    return dict((k, np.array(list(v.values()))) for k, v in event_intervals.items())
+    Returns:
+        Dict[str, Dict[str, float]]:
+            event name and its statistics: count, errors (occurrences ended by an exception),
+            and sum/mean/min/max/p50/p99/p999 of the durations in seconds.
+            The percentiles are estimated from a log-bucketed histogram, with a relative error of about 6%.
+    """
+    return _summarize_event_stats(_load_event_stats_snapshot(filename, snapshot))
 
 
 def parse_resource_log(
-    filename: str,
+    filename: str, cache: bool = False,
 ) -> Tuple[Dict[str, int], Dict[str, NDArray]]:
     """parse the event log to a dict of global information and a dict of resource usage
 
     Args:
         filename (str): resource log file path
+        cache (bool, optional):
+            Parse a CSV log through a sidecar cache next to it, see `cache`. The next parse memory-maps the cache
+            and only reads the appended tail of the log. Defaults to False.
 
     Returns:
         Tuple[Dict[str, int], Dict[str, NDArray]]:
@@ -52,24 +228,454 @@ def parse_resource_log(
             The second dict is the process-specific resource information,
                 mapping resource name (str) or logging time to a 1-D int64/float64 NDarray (same length).
                 See ResourceLogger or the 2-nd row of the log file.
+            Binary logs are memory-mapped, the arrays are views of the mapped file.
+            Of rollup logs, the raw samples kept are returned, see `parse_rollup_log` for the tiers.
+    """
+    if is_binary_resource_log(filename):
+        global_info, records = parse_binary_resource_log(filename)
+        return global_info, dict((name, records[name]) for name in records.dtype.names)
+    if is_rollup_resource_log(filename):
+        global_info, _, resource_usage = parse_rollup_log(filename, resolution=0.)
+        return global_info, resource_usage
+    if cache:
+        try:
+            return load_resource_log(filename)
+        except OSError:
+            # e.g. the directory of the log is read-only
+            pass
+
+    stream = ResourceLogStream(filename)
+    try:
+        blocks = list(stream)
+    finally:
+        stream.close()
+    resource_usage = {}
+    for name, dtype in stream.columns:
+        resource_usage[name] = (
+            np.concatenate([block[name] for block in blocks]) if len(blocks) > 0 else np.zeros(0, dtype=dtype)
+        )
+    return stream.global_info, resource_usage
+
+
+def parse_per_pid_log(filename: str) -> Dict[int, Dict[str, NDArray]]:
+    """parse the per-PID side table written by ResourceLogger(per_pid_output=...)
+
+    Args:
+        filename (str): per-PID log file path
+
+    Returns:
+        Dict[int, Dict[str, NDArray]]:
+            PID to a dict of resource name (same as the resource log) or time to a 1-D ndarray.
     """
     with open(filename, "r", encoding="utf-8") as f:
-        lines = f.readlines()
+        headers = f.readline().strip("\n").split(",")
+        lines = [line for line in f.readlines() if line.endswith("\n")]
+    records = np.fromstring(",".join(lines), sep=",", dtype=np.float64).reshape((-1, len(headers)))
+    pid_column = headers.index("pid")
+    per_pid = {}
+    for pid in np.unique(records[:, pid_column]).astype(np.int64):
+        rows = records[records[:, pid_column] == pid]
+        per_pid[int(pid)] = dict(
+            (h, rows[:, i].astype(np.float64 if column_dtype(h) == "<f8" else np.int64))
+            for i, h in enumerate(headers) if h != "pid"
+        )
+    return per_pid
+
+
+def sample_weights(resource_usage: Dict[str, NDArray]) -> NDArray[np.float64]:
+    """the time span (seconds) covered by each resource sample, to weight the samples in averages
+
+    Args:
+        resource_usage (Dict[str, NDArray]): the 2-nd result of `parse_resource_log`
+
+    Returns:
+        NDArray[np.float64]:
+            The sampling interval recorded in the "sampling_interval" column if present
+                (the logger samples faster in marked regions), otherwise ones.
+    """
+    if "sampling_interval" in resource_usage:
+        return np.asarray(resource_usage["sampling_interval"], dtype=np.float64)
+    return np.ones(len(resource_usage["time"]), dtype=np.float64)
+
+
+def parse_binary_resource_log(filename: str) -> Tuple[Dict[str, int], NDArray]:
+    """memory-map a binary resource log (see `log_format`) without copying
+
+    Args:
+        filename (str): binary resource log file path
+
+    Returns:
+        Tuple[Dict[str, int], NDArray]:
+            The global resource information,
+                and a 1-D structured array (np.memmap) of the records, one field per column.
+            A partially written last record is skipped.
+    """
+    with open(filename, "rb") as f:
+        header, offset = read_binary_header(f)
+    dtype = record_dtype(header["columns"])
+    n_records = max(os.path.getsize(filename) - offset, 0) // dtype.itemsize
+    if n_records == 0:
+        return header["global_info"], np.zeros(0, dtype=dtype)
+    records = np.memmap(filename, dtype=dtype, mode="r", offset=offset, shape=(n_records,))
+    return header["global_info"], records
+
 
-    global_info_line = lines[1].strip("\n")
-    global_info = dict(
-        (g.split(":")[0], int(g.split(":")[1])) for g in global_info_line.split(",")
+def parse_rollup_log(
+    filename: str,
+    start: Optional[float] = None,
+    end: Optional[float] = None,
+    resolution: Optional[float] = None,
+) -> Tuple[Dict[str, int], float, Dict[str, NDArray]]:
+    """query a time range of a rollup resource log (see `log_format`) at the finest resolution covering it
+
+    Args:
+        filename (str): rollup resource log file path
+        start (Optional[float], optional): Start of the range (`perf_counter` seconds). Defaults to None, the oldest.
+        end (Optional[float], optional): End of the range. Defaults to None, the latest.
+        resolution (Optional[float], optional):
+            The resolution to read, 0 for the raw samples or the resolution of a tier.
+            Defaults to None: the raw samples if they reach back to `start`, otherwise the finest tier that does,
+            otherwise the coarsest tier.
+
+    Returns:
+        Tuple[Dict[str, int], float, Dict[str, NDArray]]:
+            The global resource information, the resolution read (0 for the raw samples),
+                and a dict of column name to a 1-D ndarray sorted by time.
+            Raw samples have the columns of `parse_resource_log`. Tier buckets have "time" (the bucket start),
+                "count" (the samples in the bucket) and "<column>_min/_max/_mean/_last" of every column.
+    """
+    with open(filename, "rb") as f:
+        header, offset = read_binary_header(f, ROLLUP_LOG_MAGIC)
+        n_raw: Optional[int] = None
+        if "count_offset" in header["raw"]:
+            f.seek(offset + header["raw"]["count_offset"])
+            n_raw = int(np.frombuffer(f.read(8), dtype="<i8")[0])
+    raw_dtype = record_dtype(header["columns"])
+    bucket_dtype = rollup_dtype(rollup_columns([name for name, _ in header["columns"]]))
+    # (resolution, the slots), finest first
+    levels = [(0., np.memmap(filename, dtype=raw_dtype, mode="r", offset=offset, shape=(header["raw"]["capacity"],)))]
+    for tier in header["tiers"]:
+        levels.append((tier["resolution"], np.memmap(
+            filename, dtype=bucket_dtype, mode="r", offset=offset + tier["offset"], shape=(tier["capacity"],)
+        )))
+    # the slots written: the first n_raw raw slots (all once the ring wraps around), the buckets with samples
+    if n_raw is None:
+        # logs written before the count, told by the zero time
+        valid = [levels[0][1]["time"] > 0]
+    else:
+        valid = [np.arange(header["raw"]["capacity"]) < n_raw]
+    valid.extend(slots["count"] > 0 for _, slots in levels[1:])
+
+    if resolution is not None:
+        choices = [i for i, (r, _) in enumerate(levels) if r == resolution]
+        assert len(choices) > 0, f"no tier of resolution {resolution}, got {[r for r, _ in levels]}"
+        chosen = choices[0]
+    else:
+        oldest = [slots["time"][v].min() if v.any() else np.inf for (_, slots), v in zip(levels, valid)]
+        target = start if start is not None else min(oldest)
+        # a level covers the target if its oldest sample/bucket is not later than the target by its resolution
+        raw_tolerance = header["raw"]["min_interval"]
+        covering = [
+            i for i, (r, _) in enumerate(levels) if oldest[i] <= target + (r if r > 0 else raw_tolerance)
+        ]
+        chosen = covering[0] if len(covering) > 0 else len(levels) - 1
+    chosen_resolution, slots = levels[chosen]
+    times = slots["time"]
+    selected = valid[chosen].copy()
+    if start is not None:
+        # the buckets overlapping the range
+        selected &= times + chosen_resolution >= start
+    if end is not None:
+        selected &= times <= end
+    indices = np.flatnonzero(selected)
+    indices = indices[np.argsort(times[indices], kind="stable")]
+    records = slots[indices]
+    return header["global_info"], chosen_resolution, dict((name, records[name]) for name in records.dtype.names)
+
+
+def parse_remote_store(store: str) -> List[Dict[str, Any]]:
+    """parse the logs of the agents in a store written by `remote.RemoteCollector`
+
+    Args:
+        store (str): the store directory
+
+    Returns:
+        List[Dict[str, Any]]:
+            Per agent, the entry of the index: "host", "pid", "kind" ("resource" or "event"), "file",
+                "clock_offset_ns" and "round_trip_ns" (None if the clock offset was not estimated),
+                "epoch_offset" (the `time()` minus `perf_counter()` of the collector, to convert to wall-clock times),
+            and the parsed log: "global_info" and "resource_usage" for the resource agents (see `parse_resource_log`),
+                "events" for the event agents (see `parse_event_log`).
+            The times of all the agents are on the clock of the collector.
+    """
+    with open(os.path.join(store, STORE_INDEX), encoding="utf-8") as f:
+        index = json.load(f)
+    agents = []
+    for agent in index["agents"]:
+        agent = dict(agent, epoch_offset=index["epoch_offset"])
+        filename = os.path.join(store, agent["file"])
+        if agent["kind"] == "resource":
+            agent["global_info"], agent["resource_usage"] = parse_resource_log(filename)
+        else:
+            agent["events"] = parse_event_log(filename)
+        agents.append(agent)
+    return agents
+
+
+# cumulative counters, attributed to an event by their increase during the event
+CUMULATIVE_COLUMN_PREFIXES = ("read_", "write_")
+
+
+def _sparse_table(values: NDArray[np.float64], levels: int) -> List[NDArray[np.float64]]:
+    """ table[k][i] = max(values[i:i + 2**k]) (truncated at the end), for k <= levels """
+    table = [values]
+    for k in range(1, levels + 1):
+        step = 1 << (k - 1)
+        level = table[-1].copy()
+        level[:-step] = np.maximum(table[-1][:-step], table[-1][step:])
+        table.append(level)
+    return table
+
+
+def _query_sparse_table(
+    table: List[NDArray[np.float64]], lo: NDArray[np.int64], hi: NDArray[np.int64]
+) -> NDArray[np.float64]:
+    """ max(values[lo[i]:hi[i]]), requires 0 < hi - lo < 2 ** len(table) """
+    result = np.empty(len(lo), dtype=np.float64)
+    levels = np.frexp((hi - lo).astype(np.float64))[1] - 1
+    for k in np.unique(levels):
+        mask = levels == k
+        result[mask] = np.maximum(table[k][lo[mask]], table[k][hi[mask] - (1 << k)])
+    return result
+
+
+def _window_max(
+    values: NDArray[np.float64], lo: NDArray[np.int64], hi: NDArray[np.int64], block_size: int = 64
+) -> NDArray[np.float64]:
+    """
+    max(values[lo[i]:hi[i]]) for every i, -inf for empty windows, without a Python loop over the windows.
+    Short windows are answered by a sparse table of limited height, long windows by the max of
+        the partial first block, the partial last block and the full blocks in between, so memory stays O(n).
+    """
+    result = np.full(len(lo), -np.inf)
+    levels = (2 * block_size).bit_length() - 1
+    short = (hi > lo) & (hi - lo <= 2 * block_size)
+    if short.any():
+        result[short] = _query_sparse_table(_sparse_table(values, levels), lo[short], hi[short])
+
+    long = hi - lo > 2 * block_size
+    if long.any():
+        lo, hi = lo[long], hi[long]
+        blocks = np.append(values, np.full((-len(values)) % block_size, -np.inf)).reshape((-1, block_size))
+        prefix_max = np.maximum.accumulate(blocks, axis=1).reshape(-1)
+        suffix_max = np.maximum.accumulate(blocks[:, ::-1], axis=1)[:, ::-1].reshape(-1)
+        block_table = _sparse_table(blocks.max(axis=1), max(len(blocks).bit_length() - 1, 0))
+        first_block, last_block = lo // block_size, (hi - 1) // block_size
+        result[long] = np.maximum(
+            np.maximum(suffix_max[lo], prefix_max[hi - 1]),
+            _query_sparse_table(block_table, first_block + 1, last_block),
+        )
+    return result
+
+
+def attribute_events(
+    event_times: Dict[str, NDArray[np.float64]],
+    resource_usage: Dict[str, NDArray],
+    columns: Optional[Sequence[str]] = None,
+) -> Dict[str, Dict[str, NDArray[np.float64]]]:
+    """attribute the resource usage to every occurrence of the events, vectorized over all occurrences
+
+    The samples of a percent column are regarded as the mean usage since the previous sample,
+        so they are integrated over time and interpolated at the event start/end,
+        which gives sensible results for events shorter than the sampling interval.
+    Other columns are linearly interpolated at the event start/end.
+
+    Args:
+        event_times (Dict[str, NDArray[np.float64]]): the result of `parse_event_log`
+        resource_usage (Dict[str, NDArray]): the 2-nd result of `parse_resource_log`
+        columns (Optional[Sequence[str]], optional):
+            the resource columns to attribute. Defaults to all except the time and scheduling columns.
+
+    Returns:
+        Dict[str, Dict[str, NDArray[np.float64]]]:
+            event name to a dict of per-occurrence 1-D arrays (in the order of `event_times`):
+            * "start", "end", "duration": in seconds.
+            * "cpu_seconds": CPU time used by the monitored processes, from "cpu_percent".
+            * "<column>_mean" for percent columns: the mean during the event.
+            * "<column>_delta" for cumulative counters (read_*/write_*): the increase during the event.
+            * "<column>_peak" and "<column>_delta" for other columns (e.g. rss_mb, gpu_0_mem_mb):
+                the peak during the event, and the change from the start to the end.
+            Occurrences without a recorded end get NaN.
+    """
+    times = np.asarray(resource_usage["time"], dtype=np.float64)
+    if columns is None:
+        columns = [
+            c for c in resource_usage
+            if c != "time" and c not in SCHEDULING_COLUMNS and not c.startswith(FRESHNESS_COLUMN_PREFIX)
+        ]
+
+    names = list(event_times.keys())
+    counts = [len(event_times[k]) for k in names]
+    if len(names) == 0:
+        return {}
+    intervals = np.concatenate([event_times[k].reshape((-1, 2)) for k in names])
+    starts, ends = intervals[:, 0], intervals[:, 1]
+    invalid = ends < starts
+    ends = np.where(invalid, starts, ends)
+    durations = ends - starts
+
+    # samples strictly inside an event, for the peaks
+    lo = np.searchsorted(times, starts, side="right")
+    hi = np.searchsorted(times, ends, side="left")
+
+    attributed: Dict[str, NDArray[np.float64]] = {
+        "start": starts, "end": ends, "duration": durations
+    }
+    for column in columns:
+        values = np.asarray(resource_usage[column], dtype=np.float64)
+        if "percent" in column:
+            # cumulative integral of the usage, the i-th sample covers (times[i-1], times[i]]
+            integral = np.zeros_like(values)
+            integral[1:] = np.cumsum(values[1:] * np.diff(times)) / 100
+            used = np.interp(ends, times, integral) - np.interp(starts, times, integral)
+            if column == "cpu_percent":
+                attributed["cpu_seconds"] = used
+            at_start = np.interp(starts, times, values)
+            attributed[f"{column}_mean"] = np.where(
+                durations > 0, used * 100 / np.where(durations > 0, durations, 1), at_start
+            )
+        elif column.startswith(CUMULATIVE_COLUMN_PREFIXES):
+            attributed[f"{column}_delta"] = np.interp(ends, times, values) - np.interp(starts, times, values)
+        else:
+            at_start, at_end = np.interp(starts, times, values), np.interp(ends, times, values)
+            attributed[f"{column}_peak"] = np.maximum(np.maximum(at_start, at_end), _window_max(values, lo, hi))
+            attributed[f"{column}_delta"] = at_end - at_start
+
+    offsets = np.cumsum([0] + counts)
+    result = {}
+    for i, name in enumerate(names):
+        result[name] = dict(
+            (k, np.where(invalid[offsets[i]:offsets[i + 1]], np.nan, v[offsets[i]:offsets[i + 1]]))
+            for k, v in attributed.items()
+        )
+    return result
+
+
+def parse_stack_profile(filename: str) -> Tuple[List[List[str]], NDArray[np.float64], Dict[str, float]]:
+    """parse the log of StackProfiler
+
+    Args:
+        filename (str): the log file path
+
+    Returns:
+        Tuple[List[List[str]], NDArray[np.float64], Dict[str, float]]:
+            The stacks indexed by stack ID, each a list of frames "function (file:line)" from the outermost;
+            a 2-dim ndarray (shape=(n, 3)) of (tag, stack ID, count), tag being the time of the resource sample
+                preceding the stack samples;
+            and the overhead: "ticks" (number of sampling passes), "overhead" (seconds spent on sampling).
+            A partially written last line is skipped.
+    """
+    stacks: Dict[int, List[str]] = {}
+    samples = []
+    overhead = {"ticks": 0., "overhead": 0.}
+    with open(filename, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.endswith("\n"):
+                break
+            flushed = json.loads(line)
+            stacks.update((int(k), v) for k, v in flushed["stacks"].items())
+            if len(flushed["samples"]) > 0:
+                samples.append(np.array(flushed["samples"], dtype=np.float64))
+            overhead["ticks"] += flushed["ticks"]
+            overhead["overhead"] += flushed["overhead"]
+    return (
+        [stacks.get(i, []) for i in range(max(stacks, default=-1) + 1)],
+        np.concatenate(samples) if len(samples) > 0 else np.zeros((0, 3)),
+        overhead,
     )
 
-    headers = lines[2].strip("\n").split(",")
-    records = np.fromstring(",".join(lines[3:]), sep=",", dtype=np.float64).reshape(
-        (-1, len(headers))
+
+def attribute_stacks(
+    stack_profile: Tuple[List[List[str]], NDArray[np.float64], Dict[str, float]],
+    resource_usage: Dict[str, NDArray],
+    by: str = "function",
+    inclusive: bool = True,
+) -> Dict[str, Dict[str, float]]:
+    """attribute the CPU time and the RSS growth to functions or lines by the stack samples, vectorized
+
+    The CPU time and the RSS change between two resource samples are split among the stacks sampled
+        in between, in proportion to their counts. All threads are sampled, so the waiting threads
+        take their shares too. Both count all the monitored processes, e.g. with `track_children`.
+
+    Args:
+        stack_profile: the result of `parse_stack_profile`
+        resource_usage (Dict[str, NDArray]): the 2-nd result of `parse_resource_log`, with "cpu_percent"/"rss_mb"
+        by (str, optional):
+            "function" to group the frames by "function (file)", "line" by "function (file:line)".
+            Defaults to "function".
+        inclusive (bool, optional):
+            Attribute to every function/line on the stack (once per stack), otherwise only to the innermost.
+            Defaults to True.
+
+    Returns:
+        Dict[str, Dict[str, float]]:
+            function/line to "samples", "cpu_seconds" and "rss_mb_delta", sorted by "cpu_seconds" descendingly.
+    """
+    assert by in ("function", "line"), f"got {by}"
+    stacks, samples, _ = stack_profile
+    times = np.asarray(resource_usage["time"], dtype=np.float64)
+    if len(samples) == 0 or len(times) < 2:
+        return {}
+
+    # the resource interval (times[k], times[k + 1]] of every sample, tagged with times[k]
+    interval = np.searchsorted(times, samples[:, 0], side="right") - 1
+    valid = (interval >= 0) & (interval < len(times) - 1)
+    samples, interval = samples[valid], interval[valid]
+    counts = samples[:, 2]
+    share = counts / np.bincount(interval, weights=counts, minlength=len(times))[interval]
+    cpu_seconds = (
+        np.asarray(resource_usage["cpu_percent"], dtype=np.float64)[1:] / 100 * np.diff(times)
+        if "cpu_percent" in resource_usage else np.zeros(len(times) - 1)
     )
-    resource_usage = {}
-    for i, header in enumerate(headers):
-        if header in ("time", "cpu_percent", "cpu_percent_global"):
-            resource_usage[header] = records[:, i].astype(np.float64)
-        else:
-            resource_usage[header] = records[:, i].astype(np.int64)
+    rss_delta = (
+        np.diff(np.asarray(resource_usage["rss_mb"], dtype=np.float64))
+        if "rss_mb" in resource_usage else np.zeros(len(times) - 1)
+    )
+
+    # the keys of every stack
+    keys: Dict[str, int] = {}
+    stack_keys: List[List[int]] = []
+    for frames in stacks:
+        if by == "function":
+            frames = [frame.rsplit(":", 1)[0] + ")" for frame in frames]
+        if not inclusive:
+            frames = frames[-1:]
+        stack_keys.append(sorted(set(keys.setdefault(frame, len(keys)) for frame in frames)))
+    lengths = np.array([len(k) for k in stack_keys], dtype=np.int64)
+    flat_keys = np.array([k for ks in stack_keys for k in ks], dtype=np.int64)
+    offsets = np.concatenate([[0], np.cumsum(lengths)])
+
+    # expand every sample to the keys of its stack
+    stack_ids = samples[:, 1].astype(np.int64)
+    repeats = lengths[stack_ids]
+    sample_index = np.repeat(np.arange(len(samples)), repeats)
+    position = np.arange(len(sample_index)) - np.repeat(np.cumsum(repeats) - repeats, repeats)
+    key_index = flat_keys[offsets[stack_ids][sample_index] + position]
+
+    totals = np.stack([
+        np.bincount(key_index, weights=counts[sample_index], minlength=len(keys)),
+        np.bincount(key_index, weights=(share * cpu_seconds[interval])[sample_index], minlength=len(keys)),
+        np.bincount(key_index, weights=(share * rss_delta[interval])[sample_index], minlength=len(keys)),
+    ], axis=1)
+    names = list(keys)
+    order = np.argsort(-totals[:, 1], kind="stable")
+    return dict(
+        (names[i], dict(zip(("samples", "cpu_seconds", "rss_mb_delta"), totals[i].tolist())))
+        for i in order if totals[i, 0] > 0
+    )
+
 
-    return global_info, resource_usage
+if __name__ == "__main__":
+    # python -m resource_monitor.report: summarize many runs, see `batch`
+    from .batch import main
+    main()
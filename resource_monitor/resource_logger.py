@@ -1,14 +1,33 @@
 """
     ResourceLogger class
 """
+import json
+import platform
 from threading import Event
 from time import sleep, perf_counter
-from typing import List, Optional, Sequence, Union
-from sys import stdout
-from os import getpid
+from typing import TYPE_CHECKING, Collection, Dict, List, Optional, Sequence, TextIO, Tuple, Union
+from os import getpid, path, replace
 
 import psutil  # type: ignore
 
+from .collectors import (
+    COLLECTORS, DEFAULT_METRICS, CgroupCollector, Collector, DiskDevicesCollector, GpuCollector,
+    NetworkInterfacesCollector, column_order, network_namespace_pid, parse_metrics, resolve_cgroup
+)
+from .log_format import (
+    DEFAULT_ROLLUP_TIERS, FRESHNESS_COLUMN_PREFIX, BinaryResourceWriter, CsvResourceWriter, RollupResourceWriter
+)
+from .proc_sampler import ProcSampler
+from .process_tree import ProcessTree
+from .psutil_sampler import PsutilSampler
+
+if TYPE_CHECKING:
+    # slow to import or requiring optional modules, only annotations
+    from multiprocessing.sharedctypes import Synchronized
+    from .gpu_logger import GpuLogger
+    from .metrics_server import MetricsServer
+    from .remote import AgentResourceWriter
+
 
 MEGABYTE = 1024**2
 GIGABYTE = 1024**3
@@ -20,9 +39,11 @@ class ResourceLogger:
 
     ResourceLogger.run() should be running in a separete process,
         wake at a certain frequency to record system resource usage.
-    The results will be written to a file in CSV format.
+    The results will be written to a file in CSV format, or optionally in binary columnar format,
+        or in rollup format of bounded size for long runs.
 
-    TODO: document what resource will be monitored.
+    The metrics are sampled by collectors (see `collectors`), each at its own interval.
+    Optionally, the latest sample is served in OpenMetrics format (see `metrics_server`).
 
     """
     RESOURCE_LOGGING_LATENCY = 0.01
@@ -34,11 +55,34 @@ class ResourceLogger:
         interval: float = 1.0,
         gpu_ids: Optional[Union[int, Sequence[int]]] = None,
         stop_event: Optional[Event] = None,
+        backend: str = "auto",
+        output_format: str = "csv",
+        burst_interval: Optional[float] = None,
+        burst_counter: Optional["Synchronized"] = None,
+        flush_every: int = 1,
+        track_children: bool = False,
+        discovery_interval: float = 1.0,
+        per_pid_output: Optional[str] = None,
+        gpu_process_utilization: bool = False,
+        metrics: Optional[Union[str, Sequence[str]]] = None,
+        sample_time: Optional["Synchronized"] = None,
+        serve_port: Optional[int] = None,
+        serve_unix: Optional[str] = None,
+        serve_host: str = "127.0.0.1",
+        serve_windows: Sequence[float] = (60., 300.),
+        rollup_raw_seconds: float = 600.,
+        rollup_tiers: Sequence[Tuple[float, float]] = DEFAULT_ROLLUP_TIERS,
+        cgroup: Optional[str] = None,
+        calibrate: bool = True,
+        calibration_cache: Optional[str] = None,
+        disk_devices: Optional[Sequence[str]] = None,
+        net_interfaces: Optional[Sequence[str]] = None,
+        excluded_pids: Optional[Collection[int]] = None,
     ) -> None:
         """
         Args:
             pid (Optional[Union[int, Sequence[int]]], optional):
-                PID of the processes to monitor. Defaults to None.
+                PID of the processes to monitor. Defaults to None, the current process, or none with `cgroup`.
             output (Optional[Union[str, TextIO]], optional):
                 Output file. The results are appended to the file. Defaults to None.
             interval (float, optional):
@@ -48,25 +92,136 @@ class ResourceLogger:
                 Defaults to 1.0.
             gpu_ids (Optional[Union[int, Sequence[int]]], optional):
                 GPU indices to monitor. Requires `pynvml`. Defaults to None.
+            backend (str, optional):
+                How resource usage is sampled. "psutil" queries psutil on every sample.
+                "proc" keeps the files under /proc open and re-reads them, which is much faster (Linux only).
+                "auto" uses "proc" if available, otherwise "psutil". Defaults to "auto".
+            output_format (str, optional):
+                "csv", "binary", "rollup" or "agent". The binary format is compact and fast to write/load,
+                see `log_format` and `report.parse_binary_resource_log`. The rollup format keeps the raw samples of
+                the last `rollup_raw_seconds` and downsampled tiers in fixed-size rings, see `log_format` and
+                `report.parse_rollup_log`. Both require `output`. "agent" sends the samples in batches to
+                the collector at `output`, "host:port" or "unix:/path/to/socket", see `remote`. Defaults to "csv".
+            burst_interval (Optional[float], optional):
+                Time interval (seconds) between recording while any marked region is active,
+                i.e. while `burst_counter` is positive. The interval of each row is recorded in
+                the "sampling_interval" column. Defaults to None, sampling at a fixed interval.
+            burst_counter (Optional[Synchronized], optional):
+                A shared `multiprocessing.Value("i")` counting the active marked regions,
+                see `utils.monitor_region`. Required by `burst_interval`. Defaults to None.
+            flush_every (int, optional):
+                Flush the output every `flush_every` rows. Defaults to 1.
+            track_children (bool, optional):
+                Also monitor the descendants of the processes, e.g. worker subprocesses.
+                They are discovered every `discovery_interval` seconds. Defaults to False.
+            discovery_interval (float, optional):
+                Time interval (seconds) between discoveries of descendants. Defaults to 1.0.
+            per_pid_output (Optional[str], optional):
+                If given, the usage of every process is also written to this file in CSV format,
+                see `report.parse_per_pid_log`. Defaults to None.
+            gpu_process_utilization (bool, optional):
+                Also record the SM utilization percent of the processes on each GPU. Defaults to False.
+            metrics (Optional[Union[str, Sequence[str]]], optional):
+                The collectors to use and their intervals (seconds), e.g. "cpu:0.01,memory,smaps:1",
+                see `collectors.parse_metrics`. A collector without an interval samples on every tick.
+                If any collector has an interval, a "fresh_<collector>" column per such collector
+                tells whether its columns are sampled in the row (1) or repeated from before (0).
+                Defaults to None, meaning "cpu,memory,io,disk", plus "gpu" if `gpu_ids` is given,
+                "diskdev" if `disk_devices` is given, and "netdev" if `net_interfaces` is given.
+            sample_time (Optional[Synchronized], optional):
+                A shared `multiprocessing.Value("d")` set to the time of every sample,
+                for the stack samples of `StackProfiler` to be tagged with. Defaults to None.
+            serve_port (Optional[int], optional):
+                If given, serve the latest sample and its rolling min/max/mean over HTTP at this port,
+                in OpenMetrics format. Scrapes never trigger sampling. Defaults to None.
+            serve_unix (Optional[str], optional): Same as `serve_port`, at this Unix socket. Defaults to None.
+            serve_host (str, optional): The address to bind with `serve_port`. Defaults to "127.0.0.1".
+            serve_windows (Sequence[float], optional):
+                The rolling windows (seconds) of the served min/max/mean. Defaults to (60., 300.).
+            rollup_raw_seconds (float, optional):
+                With the rollup format, the time span (seconds) of the raw samples kept. Defaults to 600.
+            rollup_tiers (Sequence[Tuple[float, float]], optional):
+                With the rollup format, (resolution, retention) in seconds of the downsampled tiers.
+                Defaults to 10 s buckets for a day and 5 min buckets for 30 days.
+            cgroup (Optional[str], optional):
+                A cgroup v2 to monitor as a whole by the "cgroup" collector, see `collectors.CgroupCollector`:
+                a directory, a path under /sys/fs/cgroup, or "self" for the cgroup of the (first) monitored process.
+                Without `pid`, only the cgroup is monitored, by default with the "cgroup" and "disk" collectors,
+                until the cgroup is removed. Defaults to None.
+            calibrate (bool, optional):
+                Measure the latency of sampling at start (8 samples), and check that the interval is
+                at least twice of it. If not, the logger starts faster, unchecked. Defaults to True.
+            calibration_cache (Optional[str], optional):
+                A JSON file caching the measured latencies, per host, backend and collectors. A cached calibration
+                is reused instead of measured again, e.g. across the runs of a short-lived tool. Defaults to None.
+            disk_devices (Optional[Sequence[str]], optional):
+                fnmatch patterns of the devices of the "diskdev" collector, see `collectors.DiskDevicesCollector`.
+                If given, the collector is used by default. Defaults to None, all the whole disks.
+            net_interfaces (Optional[Sequence[str]], optional):
+                fnmatch patterns of the interfaces of the "netdev" collector,
+                see `collectors.NetworkInterfacesCollector`. If given, the collector is used by default.
+                Defaults to None, the physical interfaces.
+            excluded_pids (Optional[Collection[int]], optional):
+                With `track_children`, PID of the descendants not to monitor, e.g. the helper subprocesses
+                of `utils`, see `process_tree.ProcessTree`. The logger's own process is always excluded.
+                Defaults to None.
         """
+        self.cgroup: Optional[str] = None
+        if cgroup is not None:
+            self.cgroup = resolve_cgroup(cgroup, pid if isinstance(pid, int) else pid[0] if pid else None)
         if pid is None:
-            pid = [getpid()]
+            pid = [getpid()] if self.cgroup is None else []
         elif isinstance(pid, int):
             pid = [pid]
         else:
             pid = list(pid)
         self.pids: List[int] = pid
 
-        if output is None:
-            self.output = stdout
+        assert discovery_interval > 0
+        self.discovery_interval: float = discovery_interval
+        self.process_tree: Optional[ProcessTree] = (
+            ProcessTree(self.pids, excluded_pids=excluded_pids) if track_children else None
+        )
+        if self.process_tree is not None:
+            self.process_tree.refresh()
+            self.pids = sorted(self.process_tree.pids)
+        # PID of the active processes in the last sample
+        self.active_pids: List[int] = []
+
+        assert output_format in ("csv", "binary", "rollup", "agent"), f"got {output_format}"
+        self.writer: Union[CsvResourceWriter, BinaryResourceWriter, RollupResourceWriter, "AgentResourceWriter"]
+        if output_format == "agent":
+            assert output is not None, "the agent needs the address of the collector"
+            from .remote import AgentResourceWriter
+            self.writer = AgentResourceWriter(output)
+        elif output_format == "binary":
+            assert output is not None, "binary resource log must be written to a file"
+            self.writer = BinaryResourceWriter(output)
+        elif output_format == "rollup":
+            assert output is not None, "rollup resource log must be written to a file"
+            self.writer = RollupResourceWriter(
+                output, rollup_raw_seconds, rollup_tiers, interval if burst_interval is None else burst_interval
+            )
         else:
-            self.output = open(output, "w", encoding="utf-8")
+            self.writer = CsvResourceWriter(output)
 
         self.stop_event: Optional[Event] = stop_event
 
         assert interval >= 0.
         self.interval: float = interval
 
+        assert (burst_interval is None) == (burst_counter is None), \
+            "burst_interval and burst_counter must be given together"
+        assert burst_interval is None or 0. < burst_interval <= interval, f"got {burst_interval}"
+        self.burst_interval: Optional[float] = burst_interval
+        self.burst_counter: Optional["Synchronized"] = burst_counter
+        self.sample_time: Optional["Synchronized"] = sample_time
+
+        assert flush_every >= 1
+        self.flush_every: int = flush_every
+        # the number of samples skipped because sampling fell behind the schedule
+        self.missed_ticks: int = 0
+
         if gpu_ids is None:
             gpu_ids = []
         elif isinstance(gpu_ids, int):
@@ -79,152 +234,287 @@ class ResourceLogger:
         if len(self.gpu_ids) > 0:
             # GpuLogger requires module `pynvml`
             from .gpu_logger import GpuLogger
-            self.gpu_logger = GpuLogger(self.pids, self.gpu_ids)
+            self.gpu_logger = GpuLogger(self.pids, self.gpu_ids, gpu_process_utilization)
         else:
             self.gpu_logger = None
 
-        # benchmark the latency of resource logging
-        processes = [psutil.Process(pid) for pid in self.pids]
-        start = perf_counter()
-        for _ in range(8):
-            __ = self.get_resource_info(processes)
-        end = perf_counter()
-        ResourceLogger.RESOURCE_LOGGING_LATENCY = (end - start)/8
-        self.output.write(
-            "In current environment, the latency of resource logging is estimated to be "
-            f"{ResourceLogger.RESOURCE_LOGGING_LATENCY:.4e} s, "
-            "your interval is advised to be 2x greater than it.\n"
+        assert backend in ("auto", "proc", "psutil"), f"got {backend}"
+        proc_sampler: Optional[ProcSampler] = None
+        if backend in ("auto", "proc"):
+            try:
+                if not ProcSampler.is_available():
+                    raise OSError("/proc sampling backend is not available on this platform")
+                proc_sampler = ProcSampler(self.pids)
+            except OSError:
+                if backend == "proc":
+                    raise
+        self.sampler: Union[ProcSampler, PsutilSampler] = (
+            PsutilSampler(self.pids) if proc_sampler is None else proc_sampler
         )
-        assert self.interval >= 2 * ResourceLogger.RESOURCE_LOGGING_LATENCY, \
-            f"estimated resource logging latency: {ResourceLogger.RESOURCE_LOGGING_LATENCY:.4e} s"
+        self.backend: str = "proc" if isinstance(self.sampler, ProcSampler) else "psutil"
+
+        if metrics is None:
+            metrics = [m for m in DEFAULT_METRICS if m != "gpu" or self.gpu_logger is not None]
+            if self.cgroup is not None:
+                # the per-process collectors have nothing to sample without processes
+                metrics = ["cgroup"] + [m for m in metrics if len(self.pids) > 0 or m in ("disk", "gpu")]
+            if disk_devices is not None:
+                metrics.append("diskdev")
+            if net_interfaces is not None:
+                metrics.append("netdev")
+        self.collectors: List[Collector] = []
+        for name, metric_interval in parse_metrics(metrics):
+            if name == "gpu":
+                self.collectors.append(GpuCollector(self.sampler, metric_interval, self.gpu_logger, self.gpu_ids))
+            elif name == "cgroup":
+                self.collectors.append(CgroupCollector(self.sampler, metric_interval, self.cgroup))
+            elif name == "diskdev":
+                self.collectors.append(DiskDevicesCollector(self.sampler, metric_interval, disk_devices))
+            elif name == "netdev":
+                # the counters of a monitored process in a container are those of the container
+                self.collectors.append(NetworkInterfacesCollector(
+                    self.sampler, metric_interval, net_interfaces,
+                    network_namespace_pid(self.pids[0]) if len(self.pids) > 0 else None
+                ))
+            else:
+                self.collectors.append(COLLECTORS[name](self.sampler, metric_interval))
+        # only the collectors with their own interval can be stale
+        self.tiered_collectors: List[Collector] = [c for c in self.collectors if c.interval is not None]
+
+        self.per_pid_output: Optional[TextIO] = None
+        if per_pid_output is not None:
+            self.per_pid_output = open(per_pid_output, "w", encoding="utf-8")
+            self.per_pid_output.write(
+                ",".join(["time", "pid"] + [h for c in self.collectors for h in c.per_pid_columns]) + "\n"
+            )
+
+        # benchmark the latency of resource logging, of a tick when only the collectors without an interval sample
+        latencies = self._cached_calibration(calibration_cache) if calibration_cache is not None else None
+        if latencies is None and calibrate:
+            latencies = self._calibrate()
+            if calibration_cache is not None:
+                self._cache_calibration(calibration_cache, latencies)
+        min_interval = self.interval if self.burst_interval is None else self.burst_interval
+        if latencies is not None:
+            ResourceLogger.RESOURCE_LOGGING_LATENCY = latencies["poll"] + sum(
+                latencies[c.name] for c in self.collectors if c.interval is None
+            )
+            message = (
+                f"In current environment, the latency of resource logging (backend: {self.backend}) is estimated "
+                f"to be {ResourceLogger.RESOURCE_LOGGING_LATENCY:.4e} s, "
+                "your interval is advised to be 2x greater than it. "
+                "Per collector: " + " ".join(f"{k}:{v:.4e}s" for k, v in latencies.items())
+            )
+            assert min_interval >= 2 * ResourceLogger.RESOURCE_LOGGING_LATENCY, \
+                f"estimated resource logging latency: {ResourceLogger.RESOURCE_LOGGING_LATENCY:.4e} s"
+        else:
+            message = f"The latency of resource logging (backend: {self.backend}) is not calibrated."
 
         # log global resource information
-        global_info = []
-        global_info.append(f"logger_process_pid:{getpid()}")
-        global_info.append(f"cpu_count:{psutil.cpu_count(logical=False)}")
+        global_info: Dict[str, int] = {}
+        global_info["logger_process_pid"] = getpid()
+        global_info["cpu_count"] = psutil.cpu_count(logical=False)
         virtual_memory = psutil.virtual_memory()
-        global_info.append(f"vm_total_mb:{virtual_memory.total//MEGABYTE}")
-        global_info.append(f"vm_available_mb:{virtual_memory.available//MEGABYTE}")
+        global_info["vm_total_mb"] = virtual_memory.total//MEGABYTE
+        global_info["vm_available_mb"] = virtual_memory.available//MEGABYTE
         swap_memory = psutil.swap_memory()
-        global_info.append(f"swap_total_mb:{swap_memory.total//MEGABYTE}")
-        global_info.append(f"swap_free_mb:{swap_memory.free//MEGABYTE}")
-        # TODO: add disk information
-        # TODO: add network information
+        global_info["swap_total_mb"] = swap_memory.total//MEGABYTE
+        global_info["swap_free_mb"] = swap_memory.free//MEGABYTE
+        # e.g. the sizes of the disks and the speeds of the network interfaces
+        for collector in self.collectors:
+            global_info.update(collector.global_info())
         if self.gpu_logger is not None:
             for gpu_id, total, free in zip(
                 self.gpu_ids, self.gpu_logger.get_total(), self.gpu_logger.get_free()
             ):
-                global_info.append(f"gpu_{gpu_id}_total_mb:{total//MEGABYTE}")
-                global_info.append(f"gpu_{gpu_id}_free_mb:{free//MEGABYTE}")
-        self.output.write(",".join(global_info) + "\n")
+                global_info[f"gpu_{gpu_id}_total_mb"] = total//MEGABYTE
+                global_info[f"gpu_{gpu_id}_free_mb"] = free//MEGABYTE
 
         # log the header of the table
         # all numbers are resource consumption numbers, global means that of all processes
-        headers = [
-            "time",
-            "cpu_percent",
-            "cpu_percent_global",
-            "rss_mb",
-            "vms_mb",
-            "vms_global_mb",
-            "swap_used_mb",
-            "read_count",
-            "read_count_global",
-            "read_mb",
-            "read_mb_global",
-            "write_count",
-            "write_count_global",
-            "write_mb",
-            "write_mb_global"
-        ]
-        if self.gpu_logger is not None:
-            for i in self.gpu_ids:
-                headers.extend([f"gpu_{i}_mem_mb", f"gpu_{i}_mem_mb_global", f"gpu_{i}_utilization_percent_global"])
-        self.output.write(",".join(headers) + "\n")
+        columns = [h for c in self.collectors for h in c.columns()]
+        order = column_order(columns)
+        # the indices of the collector values in the order of the header, None if in the same order
+        self.column_order: Optional[List[int]] = None if order == list(range(len(columns))) else order
+        headers = ["time"] + [columns[i] for i in order]
+        if self.burst_counter is not None:
+            headers.append("sampling_interval")
+        # the time spent on sampling, the delay of sampling after its deadline, and the cumulative missed ticks
+        headers.extend(["sampling_latency", "deadline_slip", "missed_ticks"])
+        headers.extend(FRESHNESS_COLUMN_PREFIX + c.name for c in self.tiered_collectors)
+        self.writer.write_preamble(message, global_info, headers)
 
-        self.output.flush()
+        self.metrics_server: Optional["MetricsServer"] = None
+        if serve_port is not None or serve_unix is not None:
+            # imported on use, http.server is slow to import
+            from .metrics_server import MetricsServer, MetricsSnapshot
+            snapshot = MetricsSnapshot(headers, serve_windows, min_interval)
+            self.metrics_server = MetricsServer(snapshot, serve_port, serve_unix, serve_host)
 
-    def get_resource_info(self, processes: List[psutil.Process]) -> Optional[List[Union[int, float]]]:
-        """" get the resource info """
-        # TODO: options to dynamically include the subprocesses
-        active_processes = []
-        for p in processes:
-            try:
-                if p.status() not in (
-                    psutil.STATUS_STOPPED,
-                    psutil.STATUS_DEAD,
-                    psutil.STATUS_ZOMBIE,
-                ):
-                    active_processes.append(p)
-            except psutil.NoSuchProcess:
-                continue
+    def _calibration_key(self) -> str:
+        """ the key of the calibration in the cache: the calibration depends on the host, backend and collectors """
+        return ":".join([platform.node(), self.backend] + [c.name for c in self.collectors])
 
-        processes = active_processes
-        if len(processes) == 0:
+    def _cached_calibration(self, calibration_cache: str) -> Optional[Dict[str, float]]:
+        """ the cached latencies, None if not cached """
+        try:
+            with open(calibration_cache, "r", encoding="utf-8") as f:
+                return json.load(f).get(self._calibration_key())
+        except (OSError, ValueError):
             return None
 
-        process_infos = [p.as_dict(attrs=["cpu_percent", "memory_info", "io_counters"]) for p in processes]
-
-        numbers = []
-        numbers.append(perf_counter())  # time
-        numbers.append(sum(p["cpu_percent"] for p in process_infos))  # cpu_percent
-        numbers.append(psutil.cpu_percent())  # cpu_percent_global
-        numbers.append(
-            sum(p["memory_info"].rss // MEGABYTE for p in process_infos)
-        )  # rss_mb
-        numbers.append(
-            sum(p["memory_info"].vms // MEGABYTE for p in process_infos)
-        )  # vms_mb
-        numbers.append(
-            psutil.virtual_memory().used // MEGABYTE
-        )  # vms_global_mb
-        numbers.append(psutil.swap_memory().used // MEGABYTE)  # swap_used_mb
-        global_io_counter = psutil.disk_io_counters()
-        numbers.append(
-            sum(p["io_counters"].read_count for p in process_infos)
-        )  # read_count
-        numbers.append(global_io_counter.read_count)  # read_count_global
-        numbers.append(
-            sum(p["io_counters"].read_bytes // MEGABYTE for p in process_infos)
-        )  # read_mb
-        numbers.append(global_io_counter.read_bytes // MEGABYTE)  # read_mb_global
-        numbers.append(
-            sum(p["io_counters"].write_count for p in process_infos)
-        )  # write_count
-        numbers.append(global_io_counter.write_count)  # write_count_global
-        numbers.append(
-            sum(p["io_counters"].write_bytes // MEGABYTE for p in process_infos)
-        )  # write_mb
-        numbers.append(global_io_counter.write_bytes // MEGABYTE)  # write_mb_global
+    def _cache_calibration(self, calibration_cache: str, latencies: Dict[str, float]) -> None:
+        """ add the latencies to the cache, replaced as a whole so that concurrent loggers do not read it partially """
+        try:
+            with open(calibration_cache, "r", encoding="utf-8") as f:
+                cache = json.load(f)
+        except (OSError, ValueError):
+            cache = {}
+        cache[self._calibration_key()] = latencies
+        temp = f"{calibration_cache}.{getpid()}.tmp"
+        try:
+            with open(temp, "w", encoding="utf-8") as f:
+                json.dump(cache, f)
+            replace(temp, calibration_cache)
+        except OSError:
+            # e.g. a read-only directory, the next logger calibrates again
+            pass
+
+    def _calibrate(self, rounds: int = 8) -> Dict[str, float]:
+        """ the mean latency (seconds) of polling the processes and of each collector """
+        latencies = dict((name, 0.) for name in ["poll"] + [c.name for c in self.collectors])
+        for _ in range(rounds):
+            start = perf_counter()
+            cpu_times = self.sampler.poll()
+            latencies["poll"] += perf_counter() - start
+            for collector in self.collectors:
+                start = perf_counter()
+                collector.collect(cpu_times, start)
+                latencies[collector.name] += perf_counter() - start
+        for collector in self.collectors:
+            collector.reset()
+        return dict((k, v / rounds) for k, v in latencies.items())
+
+    def get_resource_info(self) -> Optional[List[Union[int, float]]]:
+        """"
+        get the resource info, None if none of the processes is active (and the cgroup is removed, if monitored).
+        Only the due collectors sample, the others repeat their last values.
+        """
+        time = perf_counter()
+        cpu_times = self.sampler.poll()
+        self.active_pids = list(cpu_times)
+        if len(cpu_times) == 0 and (self.cgroup is None or not path.isdir(self.cgroup)):
+            return None
+        values: List[Union[int, float]] = []
+        for collector in self.collectors:
+            values.extend(collector.update(cpu_times, time))
+        if self.column_order is not None:
+            values = [values[i] for i in self.column_order]
+        return [time] + values
+
+    def _refresh_processes(self) -> None:
+        """ discover the descendants of the monitored processes, and sync the samplers """
+        assert self.process_tree is not None
+        if not self.process_tree.refresh():
+            return
+        self.pids = sorted(self.process_tree.pids)
+        self.sampler.set_pids(self.pids)
         if self.gpu_logger is not None:
-            for process_used, global_used, utilization in zip(
-                self.gpu_logger.get_process_used(),
-                self.gpu_logger.get_used(),
-                self.gpu_logger.get_utilization(),
-            ):
-                numbers.extend(
-                    [process_used // MEGABYTE, global_used // MEGABYTE, utilization]
-                )  # "gpu_{i}_mem_mb", "gpu_{i}_mem_mb_global", "gpu_{i}_utilization_global"
+            self.gpu_logger.set_pids(self.pids)
 
-        return numbers
+    def _write_per_pid_rows(self, time: float) -> None:
+        """ write the usage of every active process to the per-PID side table """
+        assert self.per_pid_output is not None
+        for pid in self.active_pids:
+            numbers: List[Union[int, float]] = [time, pid]
+            for collector in self.collectors:
+                # a process missing from a collector's last sample, e.g. a new child, gets 0
+                numbers.extend(collector.per_pid.get(pid, [0] * len(collector.per_pid_columns)))
+            self.per_pid_output.write(",".join([str(n) for n in numbers]) + "\n")
 
     def run(self) -> None:
         """
             Start monitoring. It runs util all the processes stop running.
+            Samples are scheduled against absolute deadlines, so the sampling period does not drift.
+            If sampling falls behind by whole intervals, the missed ticks are skipped and counted.
         """
-        processes = [psutil.Process(pid) for pid in self.pids]
+        deadline = perf_counter()
+        next_discovery = deadline + self.discovery_interval
+        unflushed = 0
         while True:
-            sleep(self.interval - ResourceLogger.RESOURCE_LOGGING_LATENCY)
-            numbers = self.get_resource_info(processes)
+            deadline, interval = self._wait(deadline)
+            start = perf_counter()
+            if self.process_tree is not None and start >= next_discovery:
+                self._refresh_processes()
+                next_discovery = start + self.discovery_interval
+            numbers = self.get_resource_info()
             if numbers is None:
                 break
             if self.stop_event is not None and self.stop_event.is_set():
                 break
-            row = ",".join([str(n) for n in numbers])
-            self.output.write(row + '\n')
-            self.output.flush()
+            end = perf_counter()
+            # the slip of this sample, before the deadline skips the missed ticks
+            slip = start - deadline
+            if end - deadline >= interval:
+                missed = int((end - deadline) // interval)
+                self.missed_ticks += missed
+                deadline += missed * interval
+            if self.burst_counter is not None:
+                numbers.append(interval)
+            numbers.extend([end - start, slip, self.missed_ticks])
+            numbers.extend(int(c.fresh) for c in self.tiered_collectors)
+            self.writer.write_row(numbers)
+            if self.metrics_server is not None:
+                self.metrics_server.snapshot.update(numbers)
+            if self.sample_time is not None:
+                self.sample_time.value = numbers[0]
+            if self.per_pid_output is not None:
+                self._write_per_pid_rows(numbers[0])
+            unflushed += 1
+            if unflushed >= self.flush_every:
+                self.writer.flush()
+                if self.per_pid_output is not None:
+                    self.per_pid_output.flush()
+                unflushed = 0
+        self.writer.flush()
+
+    def _bursting(self) -> bool:
+        """ whether any marked region is active """
+        return self.burst_counter is not None and self.burst_counter.value > 0
+
+    def _wait(self, last_deadline: float) -> Tuple[float, float]:
+        """
+        sleep until the deadline of the next sample, returns the deadline and the sampling interval in use.
+        The stop event ends the sleep, so that a stopped logger exits without waiting for a long interval.
+        """
+        bursting = self._bursting()
+        interval = self.burst_interval if bursting and self.burst_interval is not None else self.interval
+        deadline = last_deadline + interval
+        while True:
+            remaining = deadline - perf_counter()
+            if remaining <= 0 or (self.stop_event is not None and self.stop_event.is_set()):
+                return deadline, interval
+            if self.burst_interval is None or bursting:
+                self._sleep(remaining)
+                continue
+            # at the base rate, poll the counter at the burst rate to catch the regions as soon as they start
+            self._sleep(min(remaining, self.burst_interval))
+            if self._bursting():
+                return perf_counter(), self.burst_interval
+
+    def _sleep(self, seconds: float) -> None:
+        if self.stop_event is not None:
+            self.stop_event.wait(seconds)
+        else:
+            sleep(seconds)
 
     def clean_up(self) -> None:
         """ close file handle """
-        if self.output is not stdout:
-            self.output.close()
+        if self.metrics_server is not None:
+            self.metrics_server.clean_up()
+        for collector in self.collectors:
+            collector.clean_up()
+        self.sampler.clean_up()
+        if self.per_pid_output is not None:
+            self.per_pid_output.close()
+        self.writer.close()
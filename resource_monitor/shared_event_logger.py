@@ -0,0 +1,455 @@
+"""
+    Event log shared by a process tree through shared memory.
+
+    The root process creates a shared memory block divided into slots. Every thread of every process
+        (forked or spawned children included) claims a slot on its first event, and appends fixed-size
+        records to it without locking: a slot is a single-producer single-consumer ring,
+        the writing thread only advances its head and the drainer only advances its tail.
+    A single drainer (see SharedEventDrainer) copies the records of all slots in bulk,
+        orders them by time and appends them to one binary event log, see BinaryEventLogger.
+        The records carry the PID and `perf_counter_ns()` is a system-wide clock,
+        so the events of the whole process tree are on one timeline.
+
+    Event names are interned per slot: a new name is appended to the name area of the slot
+        before the first record using it, and the drainer interns it globally.
+    A slot is freed by the drainer after its thread exits, or its process exits or dies.
+    Logging never raises: while all the slots are taken, or the name area of a slot is full,
+        the records are dropped and counted.
+"""
+import json
+import os
+import warnings
+import weakref
+from multiprocessing.shared_memory import SharedMemory
+from threading import Event, get_ident, local
+from time import perf_counter, perf_counter_ns, sleep
+from typing import Any, BinaryIO, Dict, List, Optional, Union
+
+import numpy as np
+
+from .event_logger import (
+    EVENT_CHUNK_HEADER, EVENT_CHUNK_NAMES, EVENT_CHUNK_RECORDS, EVENT_KIND_END, EVENT_KIND_ERROR, EVENT_KIND_START,
+    EVENT_LOG_MAGIC, EVENT_RECORD_FIELDS, EventLogger
+)
+
+
+SHARED_EVENT_MAGIC = b"RMONSHM1"
+# the header of the shared memory: magic, number of slots, records per slot, bytes of the name area per slot,
+# and the number of records dropped because no slot was free
+_HEADER_FIELDS = 5
+_UNCLAIMED_DROPPED = 4
+# the header of a slot
+_SLOT_FIELDS = 8
+_OWNER = 0  # PID of the owner, 0 if free
+_HEAD = 1  # number of records written
+_TAIL = 2  # number of records drained
+_NAMES_SIZE = 3  # bytes written to the name area
+_RELEASED = 4  # 1 if the owner thread no longer writes
+_DROPPED = 5  # number of records dropped because the ring or the name area is full
+# the environment variable holding `SharedEventLogger.spec()`, to attach spawned child processes
+SHARED_EVENT_ENV = "RESOURCE_MONITOR_SHARED_EVENT_LOG"
+
+
+def _process_exited(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return True
+    except PermissionError:
+        pass
+    return False
+
+
+def _slot_size(slot_records: int, name_bytes: int) -> int:
+    return 8 * (_SLOT_FIELDS + slot_records * EVENT_RECORD_FIELDS) + name_bytes
+
+
+class _Slot:
+    """ A claimed slot, held by its thread. """
+    __slots__ = ("index", "fields", "names", "head", "name_ids", "names_size", "pid", "logger", "__weakref__")
+
+    def __init__(self, logger: "SharedEventLogger", index: int) -> None:
+        self.logger = logger
+        self.index = index
+        offset = logger.slots_offset + index * logger.slot_size
+        records_end = offset + 8 * (_SLOT_FIELDS + logger.slot_records * EVENT_RECORD_FIELDS)
+        self.fields = logger.memory.buf[offset:records_end].cast("q")
+        self.names = logger.memory.buf[records_end:offset + logger.slot_size]
+        self.head = 0
+        self.name_ids: Dict[str, int] = {}
+        self.names_size = 0
+        self.pid = os.getpid()
+
+    def release(self) -> None:
+        """ mark the slot to be freed by the drainer, once its records are drained """
+        if self.fields is not None and os.getpid() == self.pid:
+            self.fields[_RELEASED] = 1
+        self.fields = None
+
+    def __del__(self) -> None:
+        # the thread holding the slot exits
+        try:
+            self.release()
+        except (ValueError, TypeError):
+            # the shared memory is closed
+            pass
+
+
+class SharedEventLogger(EventLogger):
+    """
+    Event logger writing to a ring buffer in shared memory, for a tree of processes. See the module docs.
+
+    Create it in the root process with `SharedEventLogger(output)` and run a SharedEventDrainer on it.
+    Forked child processes use it after calling `after_fork()` (done by the root event logger
+        of `utils`), spawned child processes attach to it by `SharedEventLogger.attach(...)`.
+    Event IDs must be integers. If a slot is full, the writer waits for the drainer up to `full_timeout`
+        seconds and then drops the record. If all the slots are taken, the records of a thread without one
+        are dropped until a slot is freed. The dropped records are counted by the drainer.
+    """
+    def __init__(
+        self,
+        output: str,
+        slots: int = 64,
+        slot_records: int = 4096,
+        name_bytes: int = 16384,
+        full_timeout: float = 1.0,
+        name: Optional[str] = None,
+    ) -> None:
+        """
+        Args:
+            output (str): Output file, written by the drainer.
+            slots (int, optional): number of slots, i.e. threads logging at the same time. Defaults to 64.
+            slot_records (int, optional): number of records buffered per slot. Defaults to 4096.
+            name_bytes (int, optional): bytes of the event names per slot. Defaults to 16384.
+            full_timeout (float, optional): seconds to wait for a full slot to be drained. Defaults to 1.0.
+            name (Optional[str], optional):
+                Attach to the existing shared memory of this name instead of creating one,
+                the other sizes are read from it. Defaults to None.
+        """
+        super().__init__(output)
+        self.full_timeout = full_timeout
+        if name is None:
+            assert slots > 0 and slot_records > 0 and name_bytes > 0
+            size = 8 * _HEADER_FIELDS + slots * _slot_size(slot_records, name_bytes)
+            self.memory = SharedMemory(create=True, size=size)
+            self.memory.buf[:len(SHARED_EVENT_MAGIC)] = SHARED_EVENT_MAGIC
+            header = self.memory.buf[:8 * _HEADER_FIELDS].cast("q")
+            header[1], header[2], header[3] = slots, slot_records, name_bytes
+            header.release()
+            self.owner = True
+        else:
+            self.memory = SharedMemory(name=name)
+            assert bytes(self.memory.buf[:len(SHARED_EVENT_MAGIC)]) == SHARED_EVENT_MAGIC, f"got {name}"
+            header = self.memory.buf[:8 * _HEADER_FIELDS].cast("q")
+            slots, slot_records, name_bytes = header[1:_UNCLAIMED_DROPPED].tolist()
+            header.release()
+            self.owner = False
+        self.slots = slots
+        self.slot_records = slot_records
+        self.name_bytes = name_bytes
+        self.slot_size = _slot_size(slot_records, name_bytes)
+        self.slots_offset = 8 * _HEADER_FIELDS
+        # the slots are claimed under a file lock, which spawned processes can take too
+        self.lock_file = output + ".lock"
+        self.local = local()
+        # the slots of the threads of this process, held by the threads only, so a slot is released
+        # (by `_Slot.__del__`) when its thread exits
+        self.claimed: "weakref.WeakSet[_Slot]" = weakref.WeakSet()
+
+    @classmethod
+    def attach(cls, spec: str) -> "SharedEventLogger":
+        """ attach to the shared memory by the spec of `spec()` (e.g. from SHARED_EVENT_ENV), in a spawned process """
+        spec_dict = json.loads(spec)
+        return cls(spec_dict["output"], full_timeout=spec_dict["full_timeout"], name=spec_dict["name"])
+
+    def spec(self) -> str:
+        """ the spec to attach to the shared memory by `attach()` """
+        return json.dumps({"name": self.memory.name, "output": self.output, "full_timeout": self.full_timeout})
+
+    def after_fork(self) -> None:
+        """ forget the slots of the parent process, in a forked child process """
+        self.local = local()
+        self.claimed = weakref.WeakSet()
+        self.owner = False
+
+    def _claim(self) -> Optional[_Slot]:
+        """ claim a free slot for the current thread, None if all are taken, then the record is dropped """
+        import fcntl  # pylint: disable=import-outside-toplevel
+
+        with open(self.lock_file, "a+b") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            for index in range(self.slots):
+                offset = self.slots_offset + index * self.slot_size
+                fields = self.memory.buf[offset:offset + 8 * _SLOT_FIELDS].cast("q")
+                free = fields[_OWNER] == 0
+                if free:
+                    fields[_OWNER] = os.getpid()
+                fields.release()
+                if free:
+                    break
+            else:
+                # counted under the lock, the threads of all processes count here; the thread tries again
+                # on its next record, a slot is freed by the drainer once a thread exits
+                header = self.memory.buf[:8 * _HEADER_FIELDS].cast("q")
+                header[_UNCLAIMED_DROPPED] += 1
+                header.release()
+                return None
+        slot = _Slot(self, index)
+        self.local.slot = slot
+        self.claimed.add(slot)
+        return slot
+
+    def _intern(self, slot: _Slot, event_name: str) -> Optional[int]:
+        """ the ID of a new name in the slot, None if the name area is full, increase `name_bytes` then """
+        # a line break would split the name in the name area
+        encoded = event_name.replace("\n", " ").encode("utf-8") + b"\n"
+        end = slot.names_size + len(encoded)
+        if end > self.name_bytes:
+            return None
+        slot.names[slot.names_size:end] = encoded
+        slot.names_size = end
+        # published after the name is written, and before the records using it
+        slot.fields[_NAMES_SIZE] = end
+        name_id = slot.name_ids[event_name] = len(slot.name_ids)
+        return name_id
+
+    def _append(
+        self, kind: int, event_name: str, event_id: Optional[Union[int, str]], task_id: Optional[int],
+        time: Optional[int] = None,
+    ) -> None:
+        if time is None:
+            time = perf_counter_ns()
+        try:
+            slot = self.local.slot
+        except AttributeError:
+            slot = self._claim()
+            if slot is None:
+                return
+        fields = slot.fields
+        if fields is None:
+            # released by clean_up()
+            return
+        name_id = slot.name_ids.get(event_name)
+        if name_id is None:
+            name_id = self._intern(slot, event_name)
+            if name_id is None:
+                fields[_DROPPED] += 1
+                return
+
+        head = slot.head
+        if head - fields[_TAIL] >= self.slot_records and not self._wait(fields, head):
+            fields[_DROPPED] += 1
+            return
+        i = _SLOT_FIELDS + (head % self.slot_records) * EVENT_RECORD_FIELDS
+        fields[i] = time
+        fields[i + 1] = kind
+        fields[i + 2] = name_id
+        fields[i + 3] = -1 if event_id is None else int(event_id)
+        fields[i + 4] = get_ident()
+        fields[i + 5] = -1 if task_id is None else task_id
+        fields[i + 6] = slot.pid
+        slot.head = head + 1
+        # published after the record is written
+        fields[_HEAD] = head + 1
+
+    def _wait(self, fields: Any, head: int) -> bool:
+        """ wait for the drainer to make room in a full slot, returns whether it did in time """
+        deadline = perf_counter() + self.full_timeout
+        while head - fields[_TAIL] >= self.slot_records:
+            if perf_counter() > deadline:
+                return False
+            sleep(0.001)
+        return True
+
+    def log_start(
+        self, event_name: str, event_id: Optional[Union[int, str]] = None, task_id: Optional[int] = None
+    ) -> None:
+        """ log the start of an event """
+        self._append(EVENT_KIND_START, event_name, event_id, task_id)
+
+    def log_end(
+        self, event_name: str, event_id: Optional[Union[int, str]] = None, task_id: Optional[int] = None
+    ) -> None:
+        """ log the end of an event, the event start must previously be logged. """
+        self._append(EVENT_KIND_END, event_name, event_id, task_id)
+
+    def log_error(
+        self, event_name: str, event_id: Optional[Union[int, str]] = None, task_id: Optional[int] = None
+    ) -> None:
+        """ log the end of an event by an exception, the event start must previously be logged. """
+        self._append(EVENT_KIND_ERROR, event_name, event_id, task_id)
+
+    def log_event(
+        self, event_name: str, start: int, end: int, event_id: Optional[Union[int, str]] = None,
+        task_id: Optional[int] = None, error: bool = False,
+    ) -> None:
+        """ log an event that has ended, see EventLogger.log_event """
+        self._append(EVENT_KIND_START, event_name, event_id, task_id, start)
+        self._append(EVENT_KIND_ERROR if error else EVENT_KIND_END, event_name, event_id, task_id, end)
+
+    def discard(self) -> None:
+        """ stop logging in this process """
+        self.clean_up()
+
+    def clean_up(self) -> None:
+        """ release the slots of this process to the drainer """
+        for slot in list(self.claimed):
+            slot.release()
+        self.claimed = weakref.WeakSet()
+        self.local = local()
+
+    def unlink(self) -> None:
+        """ destroy the shared memory and the lock file, by the root process after the drainer stops """
+        self.clean_up()
+        if self.owner:
+            self.memory.unlink()
+            if os.path.exists(self.lock_file):
+                os.remove(self.lock_file)
+
+
+class SharedEventDrainer:
+    """
+    Persist the records of a SharedEventLogger in bulk, to one binary event log.
+    Run it in a single process, e.g. by `run()` in a subprocess of the root process.
+
+    The records are written in the order of time. A record is stamped shortly before it is published,
+        so the records of the last `drain_interval` seconds are held back to the next drain,
+        in case older records of other slots are not published yet.
+    While slots fill up quickly, the drains are more frequent, down to every `min_drain_interval` seconds.
+    The records dropped by the loggers are counted in `dropped`, and reported by a RuntimeWarning by clean_up().
+    """
+    def __init__(
+        self, spec: str, drain_interval: float = 0.1, stop_event: Optional[Event] = None,
+        min_drain_interval: float = 0.001,
+    ) -> None:
+        """
+        Args:
+            spec (str): `SharedEventLogger.spec()` of the logger.
+            drain_interval (float, optional): Time interval (seconds) between drains. Defaults to 0.1.
+            stop_event (Optional[Event], optional): Stop after the next drain if set. Defaults to None.
+            min_drain_interval (float, optional): Time interval (seconds) between drains while slots fill up quickly.
+                Defaults to 0.001.
+        """
+        self.logger = SharedEventLogger.attach(spec)
+        assert isinstance(self.logger.output, str)
+        assert 0 < min_drain_interval <= drain_interval
+        self.drain_interval = drain_interval
+        self.min_drain_interval = min_drain_interval
+        self.stop_event = stop_event
+        logger = self.logger
+        # the slot headers and records
+        self.fields = [
+            np.ndarray(
+                (_SLOT_FIELDS + logger.slot_records * EVENT_RECORD_FIELDS,), dtype=np.int64, buffer=logger.memory.buf,
+                offset=logger.slots_offset + i * logger.slot_size,
+            ) for i in range(logger.slots)
+        ]
+        # per slot: the global name IDs of the local name IDs, and the bytes of names parsed
+        self.slot_names: List[List[int]] = [[] for _ in range(logger.slots)]
+        self.slot_names_size = [0] * logger.slots
+        self.name_ids: Dict[str, int] = {}
+        self.unwritten_names: List[List[Union[int, str]]] = []
+        # the records dropped by the loggers, as the slots were full or all taken
+        self.dropped = 0
+        self.held_back = np.zeros((0, EVENT_RECORD_FIELDS), dtype=np.int64)
+        # the most records found in a slot by the last drain
+        self.fullest = 0
+        self.file: BinaryIO = open(logger.output, "wb")
+        self.file.write(EVENT_LOG_MAGIC)
+
+    def _parse_names(self, index: int, names_size: int) -> None:
+        """ intern the names newly written to a slot """
+        if names_size <= self.slot_names_size[index]:
+            return
+        logger = self.logger
+        offset = logger.slots_offset + (index + 1) * logger.slot_size - logger.name_bytes
+        data = bytes(logger.memory.buf[offset + self.slot_names_size[index]:offset + names_size])
+        for event_name in data.decode("utf-8").splitlines():
+            if event_name not in self.name_ids:
+                self.name_ids[event_name] = len(self.name_ids)
+                self.unwritten_names.append([self.name_ids[event_name], event_name])
+            self.slot_names[index].append(self.name_ids[event_name])
+        self.slot_names_size[index] = names_size
+
+    def drain(self, final: bool = False) -> int:
+        """ copy the records of all slots to the log, returns the number of records written """
+        logger = self.logger
+        # the records stamped before are published by now
+        cutoff = perf_counter_ns() - int(self.drain_interval * 1e9)
+        blocks = [self.held_back]
+        self.fullest = 0
+        for index, fields in enumerate(self.fields):
+            owner = int(fields[_OWNER])
+            if owner == 0:
+                continue
+            # checked before draining, a released slot gets no more records
+            exited = fields[_RELEASED] == 1 or _process_exited(owner)
+            head, tail = int(fields[_HEAD]), int(fields[_TAIL])
+            # the names of the records up to `head` are written before `head`
+            self._parse_names(index, int(fields[_NAMES_SIZE]))
+            self.fullest = max(self.fullest, head - tail)
+            if head > tail:
+                rows = np.arange(tail, head) % logger.slot_records
+                records = fields[_SLOT_FIELDS:].reshape((-1, EVENT_RECORD_FIELDS))[rows]
+                records[:, 2] = np.asarray(self.slot_names[index], dtype=np.int64)[records[:, 2]]
+                blocks.append(records)
+                fields[_TAIL] = head
+            if exited:
+                self.dropped += int(fields[_DROPPED])
+                fields[1:_SLOT_FIELDS] = 0
+                self.slot_names[index] = []
+                self.slot_names_size[index] = 0
+                # freed last, a new owner may claim it right after
+                fields[_OWNER] = 0
+
+        if len(self.unwritten_names) > 0:
+            names = json.dumps(self.unwritten_names).encode("utf-8")
+            self.file.write(EVENT_CHUNK_HEADER.pack(EVENT_CHUNK_NAMES, len(names)) + names)
+            self.unwritten_names = []
+        records = np.concatenate(blocks)
+        records = records[np.argsort(records[:, 0], kind="stable")]
+        if not final:
+            n_ready = np.searchsorted(records[:, 0], cutoff)
+            records, self.held_back = records[:n_ready], records[n_ready:]
+        else:
+            self.held_back = records[:0]
+        if len(records) == 0:
+            return 0
+        payload = records.astype("<i8").tobytes()
+        self.file.write(EVENT_CHUNK_HEADER.pack(EVENT_CHUNK_RECORDS, len(payload)))
+        self.file.write(payload)
+        self.file.flush()
+        return len(records)
+
+    def run(self) -> None:
+        """ drain every `drain_interval` seconds until `stop_event` is set """
+        interval = self.drain_interval
+        while self.stop_event is None or not self.stop_event.is_set():
+            start = perf_counter()
+            self.drain()
+            # a quarter full slot halves the interval, otherwise it grows back
+            if self.fullest >= self.logger.slot_records // 4:
+                interval = max(interval / 2, self.min_drain_interval)
+            else:
+                interval = min(interval * 2, self.drain_interval)
+            if self.stop_event is None:
+                sleep(max(interval - (perf_counter() - start), 0))
+            else:
+                self.stop_event.wait(max(interval - (perf_counter() - start), 0))
+        self.drain(final=True)
+
+    def clean_up(self) -> None:
+        """ drain the last records and close the file """
+        if self.file.closed:
+            return
+        self.drain(final=True)
+        self.file.close()
+        header = self.logger.memory.buf[:8 * _HEADER_FIELDS].cast("q")
+        self.dropped += header[_UNCLAIMED_DROPPED]
+        header.release()
+        if self.dropped > 0:
+            warnings.warn(f"{self.dropped} events are dropped because the shared event log was full", RuntimeWarning)
+        # the arrays on the shared memory must be released before closing it
+        self.fields = []
+        self.logger.memory.close()
+
@@ -0,0 +1,151 @@
+"""
+    Sampling profiler of the Python stacks of the monitored process.
+
+    A low-priority daemon thread captures the stacks of all the other threads by `sys._current_frames()`
+        at a fixed rate, and folds them into counts in memory. Every stack sample is tagged with the time of
+        the latest resource sample, shared by the resource logger, so the report can attribute the CPU time
+        and the memory growth between two resource samples to the stacks sampled in between,
+        see `report.attribute_stacks`. No code needs to be decorated.
+
+    The folded counts are appended to the output as lines of JSON every `flush_interval` seconds:
+        {"pid": ..., "stacks": {stack_id: [frame, ...]}, "samples": [[tag, stack_id, count], ...],
+         "ticks": ..., "overhead": ...}
+    Frames are "function (file:line)", from the outermost to the innermost. "stacks" holds the stacks
+        first seen since the last line. "overhead" is the time (seconds) spent on sampling since the last line.
+"""
+import json
+import os
+import sys
+import threading
+from threading import Event, Thread, get_ident
+from time import perf_counter
+from types import CodeType, FrameType
+from typing import Any, Dict, List, Optional, TextIO, Tuple
+
+
+# a frame in a folded stack, interned by the code object and the line number
+_Frame = Tuple[CodeType, int]
+
+
+class StackProfiler:
+    """
+    Sample the Python stacks of the current process in a background thread. See the module docs.
+
+    The overhead is bounded: if sampling takes more than `max_overhead` of the wall time,
+        the interval is stretched until it does not.
+    """
+
+    def __init__(
+        self,
+        output: str,
+        interval: float = 0.01,
+        flush_interval: float = 1.0,
+        max_depth: int = 64,
+        max_overhead: float = 0.02,
+        sample_time: Any = None,
+    ) -> None:
+        """
+        Args:
+            output (str): Output file.
+            interval (float, optional): Time interval (seconds) between stack samples. Defaults to 0.01.
+            flush_interval (float, optional): Time interval (seconds) between writes of the counts. Defaults to 1.0.
+            max_depth (int, optional): Innermost frames kept per stack. Defaults to 64.
+            max_overhead (float, optional):
+                The maximum fraction of the wall time spent on sampling. Defaults to 0.02.
+            sample_time (Optional[Synchronized], optional):
+                A shared `multiprocessing.Value("d")` holding the time of the latest resource sample,
+                see `ResourceLogger(sample_time=...)`. If None, the stack samples are tagged with
+                the start time of the flush period. Defaults to None.
+        """
+        assert interval > 0 and flush_interval > 0 and max_depth > 0 and 0 < max_overhead < 1
+        self.output: TextIO = open(output, "w", encoding="utf-8")
+        self.interval = interval
+        self.flush_interval = flush_interval
+        self.max_depth = max_depth
+        self.max_overhead = max_overhead
+        self.sample_time = sample_time
+
+        self.stack_ids: Dict[Tuple[_Frame, ...], int] = {}
+        self.unwritten_stacks: Dict[int, List[str]] = {}
+        # (tag, stack ID) to the count of samples
+        self.counts: Dict[Tuple[float, int], int] = {}
+        self.ticks = 0
+        self.overhead = 0.
+        self.stop_event = Event()
+        self.thread = Thread(target=self._run, name="resource_monitor.StackProfiler", daemon=True)
+
+    def start(self) -> None:
+        """ start sampling """
+        self.thread.start()
+
+    def _fold(self, frame: Optional[FrameType]) -> int:
+        """ the ID of the stack of a frame """
+        frames: List[_Frame] = []
+        while frame is not None and len(frames) < self.max_depth:
+            frames.append((frame.f_code, frame.f_lineno))
+            frame = frame.f_back
+        stack = tuple(frames)
+        stack_id = self.stack_ids.get(stack)
+        if stack_id is None:
+            stack_id = self.stack_ids[stack] = len(self.stack_ids)
+            self.unwritten_stacks[stack_id] = [
+                f"{code.co_name} ({code.co_filename}:{line})" for code, line in reversed(stack)
+            ]
+        return stack_id
+
+    def _sample(self, tag: float) -> None:
+        """ capture and fold the stacks of all threads but this one """
+        me = get_ident()
+        for thread_id, frame in sys._current_frames().items():  # pylint: disable=protected-access
+            if thread_id == me:
+                continue
+            key = (tag, self._fold(frame))
+            self.counts[key] = self.counts.get(key, 0) + 1
+        self.ticks += 1
+
+    def _run(self) -> None:
+        if sys.platform.startswith("linux") and hasattr(os, "setpriority") and hasattr(threading, "get_native_id"):
+            try:
+                # on Linux, the priority of a single thread is set by its thread ID
+                os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 19)
+            except OSError:
+                pass
+        interval = self.interval
+        period_start = perf_counter()
+        while not self.stop_event.wait(interval):
+            start = perf_counter()
+            self._sample(period_start if self.sample_time is None else self.sample_time.value)
+            cost = perf_counter() - start
+            self.overhead += cost
+            # stretch the interval if sampling is too costly, e.g. with many threads or deep stacks
+            interval = max(self.interval, cost / self.max_overhead)
+            if start - period_start >= self.flush_interval:
+                self.flush()
+                period_start = perf_counter()
+        self.flush()
+
+    def flush(self) -> None:
+        """ write out the counts """
+        if self.output.closed or (len(self.counts) == 0 and len(self.unwritten_stacks) == 0):
+            return
+        counts, self.counts = self.counts, {}
+        stacks, self.unwritten_stacks = self.unwritten_stacks, {}
+        self.output.write(json.dumps({
+            "pid": os.getpid(),
+            "stacks": stacks,
+            "samples": [[tag, stack_id, count] for (tag, stack_id), count in counts.items()],
+            "ticks": self.ticks,
+            "overhead": self.overhead,
+        }) + "\n")
+        self.output.flush()
+        self.ticks = 0
+        self.overhead = 0.
+
+    def clean_up(self) -> None:
+        """ stop sampling, write out the counts and close the file handle """
+        self.stop_event.set()
+        if self.thread.is_alive():
+            self.thread.join()
+        self.flush()
+        self.output.close()
+
@@ -0,0 +1,431 @@
+"""
+    Streaming parsers of the resource log and the event log.
+
+    The logs are read in bounded chunks and yielded as NumPy blocks of at most `block_rows` rows,
+        so memory usage does not grow with the log size.
+    With `follow=True`, a stream keeps waiting for the data appended by a running logger,
+        like `tail -f`. It resumes from the byte offset where it stopped (`stream.offset`),
+        and a partially written line/record/chunk at the end of the file is left until it is complete.
+"""
+import json
+import struct
+from io import BytesIO
+from threading import Event
+from time import perf_counter, sleep
+from typing import Any, BinaryIO, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+from numpy.typing import NDArray
+
+from .event_logger import (
+    EVENT_CHUNK_HEADER, EVENT_CHUNK_NAMES, EVENT_CHUNK_RECORDS, EVENT_KIND_END, EVENT_KIND_ERROR, EVENT_KIND_START,
+    EVENT_LOG_MAGIC, EVENT_LOG_VERSIONS, EVENT_RECORD_FIELDS
+)
+from .log_format import (
+    RESOURCE_LOG_MAGIC, ROLLUP_LOG_MAGIC, column_dtype, read_binary_header, record_dtype
+)
+
+
+# bytes read from the file at a time
+READ_SIZE = 1 << 20
+
+
+class _Blocks:
+    """ Concatenate arrays along the first axis and cut them into blocks of fixed row counts. """
+
+    def __init__(self, block_rows: int) -> None:
+        assert block_rows > 0
+        self.block_rows = block_rows
+        self.parts: List[NDArray] = []
+        self.rows = 0
+
+    def add(self, array: NDArray) -> Iterator[NDArray]:
+        """ add rows, yield the full blocks """
+        if len(array) == 0:
+            return
+        self.parts.append(array)
+        self.rows += len(array)
+        if self.rows < self.block_rows:
+            return
+        rows = np.concatenate(self.parts)
+        n_full = len(rows) // self.block_rows * self.block_rows
+        for i in range(0, n_full, self.block_rows):
+            yield rows[i:i + self.block_rows]
+        self.parts = [rows[n_full:]] if n_full < len(rows) else []
+        self.rows = len(rows) - n_full
+
+    def drain(self) -> Optional[NDArray]:
+        """ the remaining rows (less than a block), None if there are none """
+        if self.rows == 0:
+            return None
+        rows = np.concatenate(self.parts)
+        self.parts, self.rows = [], 0
+        return rows
+
+
+class _LogStream:
+    """ The reading and waiting shared by the streams. """
+
+    def __init__(
+        self,
+        filename: str,
+        block_rows: int = 65536,
+        follow: bool = False,
+        poll_interval: float = 0.5,
+        idle_timeout: Optional[float] = None,
+        stop_event: Optional[Event] = None,
+    ) -> None:
+        """
+        Args:
+            filename (str): the log file
+            block_rows (int, optional): rows per yielded block. Defaults to 65536.
+            follow (bool, optional):
+                Keep waiting for appended data at the end of the file. When caught up,
+                the rows read so far are yielded without waiting for a full block. Defaults to False.
+            poll_interval (float, optional): Time (seconds) between checks for appended data. Defaults to 0.5.
+            idle_timeout (Optional[float], optional):
+                With `follow`, stop after no data is appended for this long (seconds). Defaults to None, never.
+            stop_event (Optional[Event], optional): With `follow`, stop when it is set. Defaults to None.
+        """
+        assert block_rows > 0 and poll_interval > 0
+        self.filename = filename
+        self.block_rows = block_rows
+        self.follow = follow
+        self.poll_interval = poll_interval
+        self.idle_timeout = idle_timeout
+        self.stop_event = stop_event
+        self.file: BinaryIO = open(filename, "rb")
+        # the byte offset of the first unconsumed byte
+        self.offset = 0
+        self.last_data_time = perf_counter()
+
+    def _read(self, size: int = READ_SIZE) -> bytes:
+        """ read from `offset` without consuming, b"" at the end of the file """
+        self.file.seek(self.offset)
+        data = self.file.read(size)
+        if len(data) > 0:
+            self.last_data_time = perf_counter()
+        return data
+
+    def _wait(self) -> bool:
+        """ at the end of the file, wait for appended data, returns whether to keep reading """
+        if not self.follow:
+            return False
+        if self.idle_timeout is not None and perf_counter() - self.last_data_time >= self.idle_timeout:
+            return False
+        if self.stop_event is not None:
+            return not self.stop_event.wait(self.poll_interval)
+        sleep(self.poll_interval)
+        return True
+
+    def close(self) -> None:
+        """ close the file handle """
+        self.file.close()
+
+
+class ResourceLogStream(_LogStream):
+    """
+    Stream the resource log (CSV or binary) in blocks.
+
+    Example:
+        stream = ResourceLogStream("resources.log", follow=True)
+        for block in stream:
+            print(block["time"][-1], block["cpu_percent"].mean())
+    """
+
+    def __init__(self, filename: str, *args, **kwargs) -> None:
+        """ See _LogStream. The header is read here, waiting for it with `follow`. """
+        super().__init__(filename, *args, **kwargs)
+        self.global_info: Dict[str, int] = {}
+        self.columns: List[Tuple[str, str]] = []
+        while True:
+            data = self._read(len(RESOURCE_LOG_MAGIC))
+            if len(data) == len(RESOURCE_LOG_MAGIC) or b"\n" in data:
+                break
+            if not self._wait():
+                raise ValueError(f"empty resource log {self.filename}")
+        if data == ROLLUP_LOG_MAGIC:
+            raise ValueError(f"rollup resource log {self.filename} is rewritten in place, use report.parse_rollup_log")
+        self.binary = data == RESOURCE_LOG_MAGIC
+        if self.binary:
+            self._read_binary_header()
+        else:
+            self._read_csv_header()
+        self.dtype = record_dtype(self.columns)
+
+    def _read_binary_header(self) -> None:
+        while True:
+            data = self._read()
+            try:
+                header, offset = read_binary_header(BytesIO(data))
+                break
+            except (ValueError, struct.error):
+                # the header is partially written
+                pass
+            if not self._wait():
+                raise ValueError(f"incomplete header of resource log {self.filename}")
+        self.offset = offset
+        self.global_info = header["global_info"]
+        self.columns = [(name, dtype) for name, dtype in header["columns"]]
+
+    def _read_csv_header(self) -> None:
+        # the calibration message, the global resource information and the table header
+        while True:
+            data = self._read()
+            lines = data.split(b"\n", 3)
+            if len(lines) == 4:
+                break
+            if not self._wait():
+                raise ValueError(f"incomplete header of resource log {self.filename}")
+        self.offset = sum(len(line) + 1 for line in lines[:3])
+        global_info_line = lines[1].decode("utf-8")
+        self.global_info = dict(
+            (g.split(":")[0], int(g.split(":")[1])) for g in global_info_line.split(",") if g != ""
+        )
+        self.columns = [(h, column_dtype(h)) for h in lines[2].decode("utf-8").split(",")]
+
+    def _to_columns(self, rows: NDArray) -> Dict[str, NDArray]:
+        """ a block of rows to a dict of column name to 1-D array """
+        if self.binary:
+            return dict((name, rows[name]) for name, _ in self.columns)
+        return dict(
+            (name, rows[:, i].astype(np.float64 if dtype == "<f8" else np.int64))
+            for i, (name, dtype) in enumerate(self.columns)
+        )
+
+    def _parse(self, data: bytes) -> Tuple[NDArray, int]:
+        """ parse the complete rows in `data`, returns the rows and the number of bytes consumed """
+        if self.binary:
+            n_records = len(data) // self.dtype.itemsize
+            consumed = n_records * self.dtype.itemsize
+            return np.frombuffer(data, dtype=self.dtype, count=n_records).copy(), consumed
+        consumed = data.rfind(b"\n") + 1
+        if consumed == 0:
+            return np.zeros((0, len(self.columns))), 0
+        values = np.fromstring(data[:consumed].replace(b"\n", b",").decode("utf-8"), sep=",", dtype=np.float64)
+        return values[:values.size // len(self.columns) * len(self.columns)].reshape((-1, len(self.columns))), consumed
+
+    def __iter__(self) -> Iterator[Dict[str, NDArray]]:
+        """ yield blocks of rows, as dicts of column name (same as `report.parse_resource_log`) to 1-D arrays """
+        blocks = _Blocks(self.block_rows)
+        while True:
+            size = max(READ_SIZE, self.dtype.itemsize)
+            data = self._read(size)
+            rows, consumed = self._parse(data)
+            self.offset += consumed
+            for block in blocks.add(rows):
+                yield self._to_columns(block)
+            if consumed > 0 and len(data) == size:
+                # more data may follow the buffer
+                continue
+            # caught up with the logger, the rest is a partially written row if any
+            rest = blocks.drain()
+            if rest is not None:
+                yield self._to_columns(rest)
+            if not self._wait():
+                return
+
+
+# the kinds of the text event log
+_TEXT_EVENT_KINDS = {"start": EVENT_KIND_START, "end": EVENT_KIND_END, "error": EVENT_KIND_ERROR}
+
+
+class EventLogStream(_LogStream):
+    """
+    Stream the event log (text or binary) in blocks.
+
+    Iterating the stream yields raw records, `occurrences()` pairs them into event occurrences.
+    Only the starts of the running events are kept across blocks.
+
+    Example:
+        stream = EventLogStream("events.log", follow=True)
+        for occurrences in stream.occurrences():
+            for name, times in occurrences.items():
+                print(name, (times[:, 1] - times[:, 0]).mean())
+    """
+
+    def __init__(self, filename: str, *args, **kwargs) -> None:
+        """ See _LogStream. """
+        super().__init__(filename, *args, **kwargs)
+        # event names indexed by name ID
+        self.names: List[str] = []
+        self.name_ids: Dict[str, int] = {}
+        # text logs: IDs of the event IDs that are not integers, the empty ID is -1
+        self.event_ids: Dict[str, int] = {"": -1}
+        self.binary: Optional[bool] = None
+        # fields per record in the binary log, fewer in older versions
+        self.record_fields = EVENT_RECORD_FIELDS
+        # the records of the started but not yet ended events
+        self.running = np.zeros((0, EVENT_RECORD_FIELDS), dtype=np.int64)
+
+    def get_state(self) -> Dict[str, Any]:
+        """ the parsing state as JSON-serializable objects, to resume from `offset` by a new stream """
+        return {
+            "offset": self.offset,
+            "binary": self.binary,
+            "record_fields": self.record_fields,
+            "names": self.names,
+            "event_ids": self.event_ids,
+            "running": self.running.tolist(),
+        }
+
+    def set_state(self, state: Dict[str, Any]) -> None:
+        """ resume from the state returned by `get_state()` of a stream on the same file """
+        self.offset = state["offset"]
+        self.binary = state["binary"]
+        self.record_fields = state["record_fields"]
+        self.names = list(state["names"])
+        self.name_ids = dict((name, i) for i, name in enumerate(self.names))
+        self.event_ids = dict(state["event_ids"])
+        self.running = np.array(state["running"], dtype=np.int64).reshape((-1, EVENT_RECORD_FIELDS))
+
+    def _intern(self, event_name: str) -> int:
+        name_id = self.name_ids.get(event_name)
+        if name_id is None:
+            name_id = self.name_ids[event_name] = len(self.names)
+            self.names.append(event_name)
+        return name_id
+
+    def _event_id(self, event_id: str) -> int:
+        try:
+            return int(event_id)
+        except ValueError:
+            if event_id not in self.event_ids:
+                self.event_ids[event_id] = -1 - len(self.event_ids)
+            return self.event_ids[event_id]
+
+    def _parse_text(self, data: bytes) -> Tuple[NDArray[np.int64], int]:
+        """ parse the complete lines in `data`, returns the records and the number of bytes consumed """
+        consumed = data.rfind(b"\n") + 1
+        lines = data[:consumed].decode("utf-8").splitlines()
+        records = np.zeros((len(lines), EVENT_RECORD_FIELDS), dtype=np.int64)
+        # no task ID, and the process is not recorded
+        records[:, 5:] = -1
+        for i, line in enumerate(lines):
+            fields = line.split(",")
+            records[i, 0] = round(float(fields[0]) * 1e9)
+            records[i, 1] = _TEXT_EVENT_KINDS.get(fields[1], EVENT_KIND_END)
+            records[i, 2] = self._intern(fields[2])
+            records[i, 3] = self._event_id(fields[3])
+            # older logs have no thread ID and task ID
+            if len(fields) > 4:
+                records[i, 4] = int(fields[4])
+                if fields[5] != "":
+                    records[i, 5] = int(fields[5])
+        return records, consumed
+
+    def _read_chunk(self) -> Optional[NDArray[np.int64]]:
+        """ read a complete chunk of a binary log, None if there is none yet; names are interned """
+        data = self._read(EVENT_CHUNK_HEADER.size)
+        if len(data) < EVENT_CHUNK_HEADER.size:
+            return None
+        kind, length = EVENT_CHUNK_HEADER.unpack(data)
+        payload = self._read(EVENT_CHUNK_HEADER.size + length)[EVENT_CHUNK_HEADER.size:]
+        if len(payload) < length:
+            return None
+        self.offset += EVENT_CHUNK_HEADER.size + length
+        if kind == EVENT_CHUNK_NAMES:
+            for name_id, event_name in json.loads(payload.decode("utf-8")):
+                while len(self.names) <= name_id:
+                    self.names.append("")
+                self.names[name_id] = event_name
+                self.name_ids[event_name] = name_id
+            return np.zeros((0, EVENT_RECORD_FIELDS), dtype=np.int64)
+        if kind == EVENT_CHUNK_RECORDS:
+            records = np.frombuffer(payload, dtype="<i8").astype(np.int64).reshape((-1, self.record_fields))
+            if self.record_fields < EVENT_RECORD_FIELDS:
+                # an older version without the trailing fields
+                records = np.concatenate([
+                    records, np.full((len(records), EVENT_RECORD_FIELDS - self.record_fields), -1, dtype=np.int64)
+                ], axis=1)
+            return records
+        return np.zeros((0, EVENT_RECORD_FIELDS), dtype=np.int64)
+
+    def _detect_format(self) -> bool:
+        """ check the magic, returns whether the format is known """
+        if self.binary is None:
+            data = self._read(len(EVENT_LOG_MAGIC))
+            if len(data) < len(EVENT_LOG_MAGIC) and b"\n" not in data:
+                return False
+            self.binary = data in EVENT_LOG_VERSIONS
+            if self.binary:
+                self.record_fields = EVENT_LOG_VERSIONS[data]
+                self.offset = len(EVENT_LOG_MAGIC)
+        return True
+
+    def __iter__(self) -> Iterator[NDArray[np.int64]]:
+        """
+        yield blocks of records, 2-dim int64 arrays (shape=(n_records, 7)) of
+            (time in ns, kind, name_id, event_id, thread_id, task_id, pid), same as `report.parse_binary_event_log`.
+        Name IDs index `names`. The task ID is -1 outside asyncio tasks, the thread ID of older text logs is 0,
+            the PID of text logs and older binary logs is -1.
+        """
+        blocks = _Blocks(self.block_rows)
+        while True:
+            caught_up = not self._detect_format()
+            while not caught_up:
+                if self.binary:
+                    records = self._read_chunk()
+                    caught_up = records is None
+                else:
+                    data = self._read()
+                    records, consumed = self._parse_text(data)
+                    self.offset += consumed
+                    caught_up = consumed == 0 or len(data) < READ_SIZE
+                if records is not None:
+                    yield from blocks.add(records)
+            rest = blocks.drain()
+            if rest is not None:
+                yield rest
+            if not self._wait():
+                return
+
+    def occurrences(self, unfinished: bool = True) -> Iterator[Dict[str, NDArray[np.float64]]]:
+        """
+        yield the event occurrences ended in each block of records,
+            as dicts of event name to a 2-dim ndarray (shape=(n_occurrences, 2)) of the start/end times in seconds.
+        Occurrences are identified by (event name, PID, event ID), same as `report.parse_event_log`.
+        If `unfinished`, the events still running when the stream stops are yielded last, with end time 0.
+        """
+        for records in self:
+            ended = self._pair(records)
+            if len(ended) > 0:
+                yield ended
+        if unfinished and len(self.running) > 0:
+            running, self.running = self.running, self.running[:0]
+            yield self._group(running[:, 2], np.stack([running[:, 0] / 1e9, np.zeros(len(running))], axis=1))
+
+    def _group(self, name_ids: NDArray[np.int64], intervals: NDArray[np.float64]) -> Dict[str, NDArray[np.float64]]:
+        """ group the intervals by event name """
+        order = np.argsort(name_ids, kind="stable")
+        name_ids, intervals = name_ids[order], intervals[order]
+        boundaries = np.flatnonzero(np.diff(name_ids)) + 1
+        starts = np.concatenate([[0], boundaries]).astype(np.int64)
+        ends = np.concatenate([boundaries, [len(name_ids)]]).astype(np.int64)
+        return dict((self.names[name_ids[s]], intervals[s:e]) for s, e in zip(starts, ends))
+
+    def _pair(self, records: NDArray[np.int64]) -> Dict[str, NDArray[np.float64]]:
+        """ pair the records with the running events, vectorized; the unended starts are kept running """
+        records = np.concatenate([self.running, records])
+        if len(records) == 0:
+            return {}
+        # event IDs are numbered per process
+        order = np.lexsort((records[:, 3], records[:, 6], records[:, 2]))
+        records = records[order]
+        new_occurrence = np.ones(len(records), dtype=bool)
+        keys = records[:, [2, 6, 3]]
+        new_occurrence[1:] = np.any(keys[1:] != keys[:-1], axis=1)
+        occurrence = np.cumsum(new_occurrence) - 1
+        is_end = records[:, 1] != EVENT_KIND_START
+
+        intervals = np.zeros((occurrence[-1] + 1, 2), dtype=np.float64)
+        # the sort is stable, so a later record of the same (name, id, kind) overwrites an earlier one
+        intervals[occurrence, is_end.astype(np.int64)] = records[:, 0] / 1e9
+        ended = np.zeros(len(intervals), dtype=bool)
+        ended[occurrence[is_end]] = True
+
+        # the last start of every running event
+        last_of_occurrence = np.ones(len(records), dtype=bool)
+        last_of_occurrence[:-1] = new_occurrence[1:]
+        self.running = records[last_of_occurrence & ~ended[occurrence] & ~is_end]
+        return self._group(records[new_occurrence, 2][ended], intervals[ended])
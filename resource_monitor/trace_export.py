@@ -0,0 +1,242 @@
+"""
+    Export the event log and the resource log to a Chrome Trace Event JSON file, to open in Perfetto
+        (https://ui.perfetto.dev) or chrome://tracing.
+
+    * Every event record becomes a begin ("B") or end ("E") trace event, so the events become duration slices
+        on the track of their thread. The events inside an asyncio task go to a track of the task,
+        since the tasks of one thread interleave. An event ended by an exception has `"error": 1` in its args.
+    * Every resource column becomes a counter ("C") track. A sample is written only when the value changes,
+        so the columns of collectors with long intervals do not repeat. The non-finite values (NaN or infinity)
+        are skipped, JSON has no literal for them.
+    * A process is named once, "PID <pid>", and its counters show under the same process as its events.
+
+    Both logs are read by the streams (see `stream`) block by block, and every block is written out before
+        the next one is read, so the export takes time linear in the log sizes and memory bounded by the block size.
+    The trace viewers sort the trace events, the events of the two logs are written one log after the other.
+    The timestamps are `perf_counter` times in microseconds, the events and the resource samples share the timeline.
+
+    Usage:
+        python -m resource_monitor.trace_export --event_log event_monitor_PID1.log \
+            --resource_log resource_monitor_PID1.log --output trace.json.gz
+"""
+import argparse
+import gzip
+import json
+import os
+import re
+from typing import Dict, Iterable, List, Optional, Set, TextIO, Tuple
+
+import numpy as np
+
+from .event_logger import EVENT_KIND_ERROR, EVENT_KIND_START
+from .log_format import FRESHNESS_COLUMN_PREFIX
+from .stream import EventLogStream, ResourceLogStream
+
+
+# the PID in the default log names of `setup_root_event_logger` and `setup_root_resource_logger`
+_LOG_PID_PATTERN = re.compile(r"_PID(\d+)")
+
+
+def _pid_of_log(filename: str, default: int) -> int:
+    """ the PID in the name of a log, `default` if none """
+    match = _LOG_PID_PATTERN.search(os.path.basename(filename))
+    return int(match.group(1)) if match is not None else default
+
+
+def _metadata(name: str, pid: int, tid: Optional[int], value: str) -> str:
+    """ a metadata trace event naming a process or a thread """
+    tid_field = f',"tid":{tid}' if tid is not None else ""
+    return f'{{"ph":"M","name":"{name}","pid":{pid}{tid_field},"args":{{"name":{json.dumps(value)}}}}}'
+
+
+class TraceWriter:
+    """
+    Write trace events to a Chrome Trace Event JSON file as they come, see the module docs.
+
+    Example:
+        with TraceWriter("trace.json") as writer:
+            writer.write_event_log("event_monitor_PID1.log")
+            writer.write_resource_log("resource_monitor_PID1.log")
+    """
+
+    def __init__(self, output: str, block_rows: int = 65536) -> None:
+        """
+        Args:
+            output (str): The output file, gzip-compressed if it ends with ".gz".
+            block_rows (int, optional): Records read and written at a time. Defaults to 65536.
+        """
+        self.block_rows = block_rows
+        self.file: TextIO = gzip.open(output, "wt", encoding="utf-8") if output.endswith(".gz") \
+            else open(output, "w", encoding="utf-8")
+        self.file.write('{"displayTimeUnit":"ms","traceEvents":[\n')
+        self.first = True
+        # the processes named so far, in all the logs written
+        self.processes: Set[int] = set()
+
+    def _write(self, lines: Iterable[str]) -> None:
+        """ write trace events, one JSON object per line """
+        text = ",\n".join(lines)
+        if len(text) == 0:
+            return
+        if not self.first:
+            self.file.write(",\n")
+        self.file.write(text)
+        self.first = False
+
+    def _name_process(self, pid: int, lines: List[str]) -> None:
+        """ append the metadata trace event naming process `pid`, unless already written """
+        if pid not in self.processes:
+            self.processes.add(pid)
+            lines.append(_metadata("process_name", pid, None, f"PID {pid}"))
+
+    def write_event_log(self, filename: str, pid: Optional[int] = None) -> int:
+        """write the records of an event log as begin/end trace events
+
+        Args:
+            filename (str): the event log, text or binary
+            pid (Optional[int], optional):
+                The PID of the records without one (text logs and older binary logs).
+                Defaults to None, the PID in the log name like "event_monitor_PID<pid>.log", or 0.
+
+        Returns:
+            int: the number of records written
+        """
+        default_pid = pid if pid is not None else _pid_of_log(filename, 0)
+        stream = EventLogStream(filename, block_rows=self.block_rows)
+        # JSON-encoded event names
+        names: Dict[str, str] = {}
+        # the (process, task) pairs named so far
+        tasks: Set[Tuple[int, int]] = set()
+        n_records = 0
+        try:
+            for records in stream:
+                lines: List[str] = []
+                for time, kind, name_id, _, thread_id, task_id, record_pid in records.tolist():
+                    record_pid = record_pid if record_pid >= 0 else default_pid
+                    self._name_process(record_pid, lines)
+                    tid = thread_id
+                    if task_id >= 0:
+                        tid = task_id
+                        if (record_pid, task_id) not in tasks:
+                            tasks.add((record_pid, task_id))
+                            lines.append(_metadata("thread_name", record_pid, tid, f"asyncio task {task_id:#x}"))
+                    if kind == EVENT_KIND_START:
+                        name = stream.names[name_id]
+                        if name not in names:
+                            names[name] = json.dumps(name)
+                        lines.append(
+                            f'{{"ph":"B","name":{names[name]},"ts":{time / 1e3:.3f},"pid":{record_pid},"tid":{tid}}}'
+                        )
+                    else:
+                        args = ',"args":{"error":1}' if kind == EVENT_KIND_ERROR else ""
+                        lines.append(f'{{"ph":"E","ts":{time / 1e3:.3f},"pid":{record_pid},"tid":{tid}{args}}}')
+                self._write(lines)
+                n_records += len(records)
+        finally:
+            stream.close()
+        return n_records
+
+    def write_resource_log(self, filename: str, pid: Optional[int] = None) -> int:
+        """write the columns of a resource log as counter trace events
+
+        Args:
+            filename (str): the resource log, CSV or binary
+            pid (Optional[int], optional):
+                The process to show the counters under.
+                Defaults to None, the PID in the log name like "resource_monitor_PID<pid>.log", or 0.
+
+        Returns:
+            int: the number of samples written
+        """
+        pid = pid if pid is not None else _pid_of_log(filename, 0)
+        stream = ResourceLogStream(filename, block_rows=self.block_rows)
+        columns = [
+            name for name, _ in stream.columns if name != "time" and not name.startswith(FRESHNESS_COLUMN_PREFIX)
+        ]
+        encoded = dict((name, json.dumps(name)) for name in columns)
+        # the last written value of every column
+        last: Dict[str, Optional[float]] = dict((name, None) for name in columns)
+        n_samples = 0
+        try:
+            for block in stream:
+                times = (block["time"] * 1e6).tolist()
+                lines: List[str] = []
+                self._name_process(pid, lines)
+                for name in columns:
+                    values = block[name]
+                    changed = np.ones(len(values), dtype=bool)
+                    changed[1:] = values[1:] != values[:-1]
+                    if last[name] is not None:
+                        changed[0] = values[0] != last[name]
+                    last[name] = values[-1].item()
+                    changed &= np.isfinite(values)
+                    for i, value in zip(np.flatnonzero(changed).tolist(), values[changed].tolist()):
+                        lines.append(
+                            f'{{"ph":"C","name":{encoded[name]},"ts":{times[i]:.3f},"pid":{pid},'
+                            f'"args":{{{encoded[name]}:{value}}}}}'
+                        )
+                self._write(lines)
+                n_samples += len(times)
+        finally:
+            stream.close()
+        return n_samples
+
+    def close(self) -> None:
+        """ end the JSON and close the file """
+        self.file.write("\n]}\n")
+        self.file.close()
+
+    def __enter__(self) -> "TraceWriter":
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.close()
+
+
+def export_trace(
+    output: str,
+    event_logs: Iterable[str] = (),
+    resource_logs: Iterable[str] = (),
+    block_rows: int = 65536,
+) -> None:
+    """export event logs and resource logs into one trace file, see TraceWriter
+
+    Args:
+        output (str): The output file, gzip-compressed if it ends with ".gz".
+        event_logs (Iterable[str], optional): The event logs. Defaults to ().
+        resource_logs (Iterable[str], optional): The resource logs. Defaults to ().
+        block_rows (int, optional): Records read and written at a time. Defaults to 65536.
+    """
+    with TraceWriter(output, block_rows) as writer:
+        for event_log in event_logs:
+            writer.write_event_log(event_log)
+        for resource_log in resource_logs:
+            writer.write_resource_log(resource_log)
+
+
+def main() -> None:
+    """ commandline interface """
+    parser = argparse.ArgumentParser(prog="python -m resource_monitor.trace_export")
+    parser.add_argument(
+        "--event_log", type=str, nargs="*", default=[],
+        help="Event logs, text or binary."
+    )
+    parser.add_argument(
+        "--resource_log", type=str, nargs="*", default=[],
+        help="Resource logs, CSV or binary."
+    )
+    parser.add_argument(
+        "--output", type=str, required=False, default="trace.json",
+        help="Output trace file, gzip-compressed if it ends with \".gz\". Defaults to \"trace.json\"."
+    )
+    parser.add_argument(
+        "--block_rows", type=int, required=False, default=65536,
+        help="Records read and written at a time. Defaults to 65536."
+    )
+    args = parser.parse_args()
+    assert len(args.event_log) + len(args.resource_log) > 0, "no log to export"
+    export_trace(args.output, args.event_log, args.resource_log, args.block_rows)
+
+
+if __name__ == "__main__":
+    main()
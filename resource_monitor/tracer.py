@@ -0,0 +1,226 @@
+"""
+    Automatic function tracing, without decorating the functions.
+
+    Calls of the functions matching the filters are logged to an event logger, named by
+        the qualified name of the function "<module>.<qualname>". Every call is timed, and only the calls
+        lasting at least `min_duration` are logged, by `EventLogger.log_event` after the call returns.
+        Under a heavy call volume, only 1 in `sample_every` calls of every function is timed.
+
+    On Python 3.12+, the tracer hooks `sys.monitoring`: the code objects not matching the filters are
+        disabled at the hook on their first call, so they then run at native speed.
+        It takes the profiler tool ID, or if another profiler (e.g. cProfile) holds it, a free tool ID
+        without a reserved role.
+    On older versions, it falls back to `sys.setprofile` (and `threading.setprofile` for the threads started
+        afterwards), where unmatched calls still pay a dictionary lookup, and a call ended by an exception
+        cannot be told from a return.
+    Generators and coroutines are not traced, decorate them by `monitor_function`.
+"""
+import sys
+import threading
+from fnmatch import fnmatchcase
+from itertools import count
+from inspect import CO_ASYNC_GENERATOR, CO_COROUTINE, CO_GENERATOR, CO_ITERABLE_COROUTINE
+from time import perf_counter_ns
+from types import CodeType, FrameType
+from typing import Any, Callable, Dict, Optional, Sequence
+
+from .event_logger import EventLogger
+
+
+_SUSPENDABLE = CO_GENERATOR | CO_COROUTINE | CO_ITERABLE_COROUTINE | CO_ASYNC_GENERATOR
+# a code object not seen yet
+_UNSEEN = object()
+# whether sys.monitoring (Python 3.12+) is available
+HAS_SYS_MONITORING = hasattr(sys, "monitoring")
+
+
+class _Function:
+    """ The tracing state of a matched code object. """
+    __slots__ = ("name", "call_ids")
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        # next() of itertools.count is atomic, the calls in different threads get different IDs
+        self.call_ids = count(1)
+
+
+class FunctionTracer:
+    """
+    Trace the calls of the functions matching the filters, see the module docs.
+
+    Example:
+        tracer = FunctionTracer(get_root_event_logger(), include=["mypackage.*"], min_duration=1e-3)
+        tracer.start()
+        ...
+        tracer.stop()
+    """
+
+    def __init__(
+        self,
+        event_logger: EventLogger,
+        include: Sequence[str] = ("*",),
+        exclude: Sequence[str] = (),
+        min_duration: float = 0.,
+        sample_every: int = 1,
+        backend: str = "auto",
+    ) -> None:
+        """
+        Args:
+            event_logger (EventLogger): The event logger.
+            include (Sequence[str], optional):
+                Patterns (see `fnmatch`) of "<module>.<qualname>" to trace, e.g. "mypackage.*" or
+                "mypackage.model.Model.forward". Defaults to ("*",), all Python functions.
+            exclude (Sequence[str], optional): Patterns not to trace, over `include`. Defaults to ().
+            min_duration (float, optional): The minimum duration (seconds) of the logged calls. Defaults to 0.
+            sample_every (int, optional): Time 1 in `sample_every` calls of every function. Defaults to 1.
+            backend (str, optional):
+                "monitoring" (sys.monitoring, Python 3.12+), "setprofile" or "auto", the former if available.
+                Defaults to "auto".
+        """
+        assert min_duration >= 0 and sample_every >= 1
+        if backend == "auto":
+            backend = "monitoring" if HAS_SYS_MONITORING else "setprofile"
+        assert backend in ("monitoring", "setprofile"), f"got {backend}"
+        assert backend != "monitoring" or HAS_SYS_MONITORING, "sys.monitoring requires Python 3.12+"
+        self.event_logger = event_logger
+        self.include = list(include)
+        # the tracer must not trace itself and the event loggers
+        self.exclude = list(exclude) + [f"{__package__}.*"]
+        self.min_duration_ns = int(min_duration * 1e9)
+        self.sample_every = sample_every
+        self.backend = backend
+        # code object to its state, None if not traced
+        self.functions: Dict[CodeType, Optional[_Function]] = {}
+        # per thread: the stack of (code object, call ID, start time or None if not sampled) of the traced calls
+        self.local = threading.local()
+        self.tool_id: Optional[int] = None
+
+    def _match(self, code: CodeType, module: str) -> Optional[_Function]:
+        """ the state of a code object seen for the first time """
+        function = None
+        if code.co_flags & _SUSPENDABLE == 0:
+            name = f"{module}.{getattr(code, 'co_qualname', code.co_name)}"
+            if any(fnmatchcase(name, p) for p in self.include) and not any(fnmatchcase(name, p) for p in self.exclude):
+                # commas separate the fields of text event logs
+                function = _Function(name.replace(",", ";"))
+        self.functions[code] = function
+        return function
+
+    def _hooks(self) -> Dict[str, Callable]:
+        """
+        the hooks of both backends, as closures over locals:
+            they are on the hot path of every traced call, where attribute lookups are noticeable
+        """
+        functions = self.functions
+        match = self._match
+        local = self.local
+        sample_every = self.sample_every
+        min_duration_ns = self.min_duration_ns
+        log_event = self.event_logger.log_event
+        get_frame = sys._getframe  # pylint: disable=protected-access
+        disable = sys.monitoring.DISABLE if HAS_SYS_MONITORING else None
+
+        def enter(function: _Function, code: CodeType) -> None:
+            call_id = next(function.call_ids)
+            try:
+                stack = local.stack
+            except AttributeError:
+                stack = local.stack = []
+            stack.append((code, call_id, perf_counter_ns() if call_id % sample_every == 0 else None))
+
+        def exit_(function: _Function, code: CodeType, error: bool) -> None:
+            end = perf_counter_ns()
+            stack = getattr(local, "stack", None)
+            # a call started before tracing has no entry
+            if not stack or stack[-1][0] is not code:
+                return
+            _, call_id, start = stack.pop()
+            if start is not None and end - start >= min_duration_ns:
+                log_event(function.name, start, end, call_id, error=error)
+
+        def on_start(code: CodeType, _: int) -> Any:
+            function = functions.get(code, _UNSEEN)
+            if function is _UNSEEN:
+                # the frame calling this hook is the frame of the code
+                function = match(code, get_frame(1).f_globals.get("__name__", ""))
+            if function is None:
+                return disable
+            enter(function, code)
+            return None
+
+        def on_return(code: CodeType, _: int, __: Any) -> Any:
+            function = functions.get(code)
+            if function is None:
+                return disable
+            exit_(function, code, False)
+            return None
+
+        def on_unwind(code: CodeType, _: int, __: BaseException) -> None:
+            # not a local event, it cannot be disabled per code object
+            function = functions.get(code)
+            if function is not None:
+                exit_(function, code, True)
+
+        def profile(frame: FrameType, event: str, _: Any) -> None:
+            if event == "call":
+                code = frame.f_code
+                function = functions.get(code, _UNSEEN)
+                if function is _UNSEEN:
+                    function = match(code, frame.f_globals.get("__name__", ""))
+                if function is not None:
+                    enter(function, code)
+            elif event == "return":
+                function = functions.get(frame.f_code)
+                if function is not None:
+                    exit_(function, frame.f_code, False)
+
+        return {"on_start": on_start, "on_return": on_return, "on_unwind": on_unwind, "profile": profile}
+
+    def start(self) -> None:
+        """ start tracing, in all threads """
+        if self.backend == "monitoring":
+            monitoring = sys.monitoring
+            # the profiler ID, unless taken e.g. by cProfile, else an ID without a reserved role
+            tool_ids = (monitoring.PROFILER_ID, 3, 4)
+            free = [i for i in tool_ids if monitoring.get_tool(i) is None]
+            if len(free) == 0:
+                taken = ", ".join(f"{i} by {monitoring.get_tool(i)!r}" for i in tool_ids)
+                raise RuntimeError(
+                    f"no free sys.monitoring tool ID for the tracer (taken: {taken}), use backend=\"setprofile\""
+                )
+            self.tool_id = free[0]
+            monitoring.use_tool_id(self.tool_id, "resource_monitor")
+            events = monitoring.events
+            hooks = self._hooks()
+            monitoring.register_callback(self.tool_id, events.PY_START, hooks["on_start"])
+            monitoring.register_callback(self.tool_id, events.PY_RETURN, hooks["on_return"])
+            monitoring.register_callback(self.tool_id, events.PY_UNWIND, hooks["on_unwind"])
+            monitoring.set_events(self.tool_id, events.PY_START | events.PY_RETURN | events.PY_UNWIND)
+        else:
+            profile = self._hooks()["profile"]
+            if hasattr(threading, "setprofile_all_threads"):
+                threading.setprofile_all_threads(profile)
+            else:
+                # only the current thread and the threads started afterwards
+                threading.setprofile(profile)
+                sys.setprofile(profile)
+
+    def stop(self) -> None:
+        """ stop tracing, the unfinished calls are not logged """
+        if self.backend == "monitoring":
+            if self.tool_id is None:
+                return
+            monitoring = sys.monitoring
+            monitoring.set_events(self.tool_id, 0)
+            for event in (monitoring.events.PY_START, monitoring.events.PY_RETURN, monitoring.events.PY_UNWIND):
+                monitoring.register_callback(self.tool_id, event, None)
+            # re-enable the code locations disabled by this tool, for the next tool
+            monitoring.restart_events()
+            monitoring.free_tool_id(self.tool_id)
+            self.tool_id = None
+        else:
+            if hasattr(threading, "setprofile_all_threads"):
+                threading.setprofile_all_threads(None)
+            else:
+                threading.setprofile(None)
+                sys.setprofile(None)
@@ -2,16 +2,93 @@
     Root resource/event loggers.
     Decorator and context manager for event logging.
 """
-from multiprocessing import Process, Pipe, Event
+import os
+import sys
+import threading
+import warnings
+from functools import wraps
+from inspect import isasyncgenfunction, iscoroutinefunction, isgeneratorfunction
+from itertools import count
+from multiprocessing import Array, Process, Pipe, Event, Value
+from multiprocessing.util import Finalize, register_after_fork
 from atexit import register
 from os import getpid
-from typing import Optional, Union, Sequence, Dict
+from typing import Any, Iterator, List, Optional, Union, Sequence, Dict, Tuple
 from .resource_logger import ResourceLogger
-from .event_logger import EventLogger
+from .event_logger import EventLogger, BinaryEventLogger, AggregateEventLogger, _discard_file
+from .shared_event_logger import SHARED_EVENT_ENV, SharedEventDrainer, SharedEventLogger
+from .stack_profiler import StackProfiler
+from .tracer import FunctionTracer
 
 
+# the multiprocessing primitives are created on use, they are slow to create and most processes never need them
 RESOURCE_LOGGING_SUBPROCESS = None
-RESOURCE_LOGGING_STOP_EVENT = Event()
+RESOURCE_LOGGING_STOP_EVENT = None
+# the resource logger sampling in a thread of current process, with `threaded=True`
+RESOURCE_LOGGER: Optional[ResourceLogger] = None
+RESOURCE_LOGGING_THREAD: Optional[threading.Thread] = None
+# the number of active regions marked by `burst=True`, shared with the resource logging subprocess
+RESOURCE_LOGGING_BURST_COUNTER: Any = None
+# the time of the latest resource sample, shared with the stack profiler
+RESOURCE_LOGGING_SAMPLE_TIME: Any = None
+# PID of the helper subprocesses (e.g. the shared event drainer), not monitored with `track_children`,
+#   shared with the resource logging subprocess
+RESOURCE_LOGGING_EXCLUDED_PIDS: Any = None
+MAX_EXCLUDED_PIDS = 16
+# the time (seconds) the resource logging subprocess is given to finish at exit, before it is terminated
+RESOURCE_LOGGING_JOIN_TIMEOUT = 5.0
+# PID of the helper subprocesses started by this module
+_HELPER_PIDS: List[int] = []
+_VALUES_LOCK = threading.Lock()
+
+
+class _LocalValue:
+    """ An in-process stand-in of `multiprocessing.Value`, until a resource logging subprocess needs to share it. """
+
+    def __init__(self, value: Union[int, float]) -> None:
+        self.value = value
+        self.lock = threading.Lock()
+
+    def get_lock(self) -> threading.Lock:
+        """ the lock of the value """
+        return self.lock
+
+
+def _new_value(value: Any, typecode: str, default: Union[int, float], shared: bool) -> Any:
+    """ `value`, created if None, or moved to shared memory if `shared` """
+    if value is None:
+        return Value(typecode, default) if shared else _LocalValue(default)
+    if shared and isinstance(value, _LocalValue):
+        return Value(typecode, value.value)
+    return value
+
+
+def _create_values(shared: bool) -> None:
+    """ create the burst counter and the sample time, in shared memory if `shared` """
+    global RESOURCE_LOGGING_BURST_COUNTER, RESOURCE_LOGGING_SAMPLE_TIME
+    with _VALUES_LOCK:
+        RESOURCE_LOGGING_BURST_COUNTER = _new_value(RESOURCE_LOGGING_BURST_COUNTER, "i", 0, shared)
+        RESOURCE_LOGGING_SAMPLE_TIME = _new_value(RESOURCE_LOGGING_SAMPLE_TIME, "d", 0., shared)
+
+
+def _create_excluded_pids(shared: bool) -> Any:
+    """ the PID of the helper subprocesses, a list updated in place, or an array in shared memory if `shared` """
+    global RESOURCE_LOGGING_EXCLUDED_PIDS
+    if shared:
+        RESOURCE_LOGGING_EXCLUDED_PIDS = Array("q", MAX_EXCLUDED_PIDS)
+        RESOURCE_LOGGING_EXCLUDED_PIDS[:len(_HELPER_PIDS)] = _HELPER_PIDS[-MAX_EXCLUDED_PIDS:]
+    else:
+        RESOURCE_LOGGING_EXCLUDED_PIDS = _HELPER_PIDS
+    return RESOURCE_LOGGING_EXCLUDED_PIDS
+
+
+def _add_helper_pid(pid: int) -> None:
+    """ keep a helper subprocess out of the processes monitored by the root resource logger """
+    _HELPER_PIDS.append(pid)
+    if RESOURCE_LOGGING_EXCLUDED_PIDS is not None and RESOURCE_LOGGING_EXCLUDED_PIDS is not _HELPER_PIDS:
+        with RESOURCE_LOGGING_EXCLUDED_PIDS.get_lock():
+            # the oldest is overwritten when full, and 0 slots are empty
+            RESOURCE_LOGGING_EXCLUDED_PIDS[(len(_HELPER_PIDS) - 1) % MAX_EXCLUDED_PIDS] = pid
 
 
 def resource_logging_worker(
@@ -20,10 +97,26 @@ def resource_logging_worker(
     output_file: Optional[str] = None,
     interval: float = 1.0,
     gpu_ids: Optional[Union[int, Sequence[int]]] = None,
-    stop_event: Optional["Event"] = None
+    stop_event: Optional["Event"] = None,
+    backend: str = "auto",
+    output_format: str = "csv",
+    burst_interval: Optional[float] = None,
+    burst_counter=None,
+    track_children: bool = False,
+    metrics: Optional[Union[str, Sequence[str]]] = None,
+    sample_time=None,
+    serve_port: Optional[int] = None,
+    serve_unix: Optional[str] = None,
+    calibrate: bool = True,
+    calibration_cache: Optional[str] = None,
+    excluded_pids=None,
 ):
     """ The worker function in the resource monitor subprocess. """
-    logger = ResourceLogger(pid, output_file, interval, gpu_ids, stop_event)
+    logger = ResourceLogger(
+        pid, output_file, interval, gpu_ids, stop_event, backend, output_format, burst_interval, burst_counter,
+        track_children=track_children, metrics=metrics, sample_time=sample_time, serve_port=serve_port,
+        serve_unix=serve_unix, calibrate=calibrate, calibration_cache=calibration_cache, excluded_pids=excluded_pids
+    )
     write_pipe.send("kick off")
     logger.run()
     logger.clean_up()
@@ -33,77 +126,347 @@ def setup_root_resource_logger(
     output_file: Optional[str] = None,
     interval: float = 1.0,
     gpu_ids: Optional[Union[int, Sequence[int]]] = None,
+    backend: str = "auto",
+    output_format: str = "csv",
+    burst_interval: Optional[float] = None,
+    track_children: bool = False,
+    metrics: Optional[Union[str, Sequence[str]]] = None,
+    serve_port: Optional[int] = None,
+    serve_unix: Optional[str] = None,
+    threaded: bool = False,
+    calibrate: bool = True,
+    calibration_cache: Optional[str] = None,
 ):
     """
         Initialize the root resource logger to monitor current process.
+        The logger runs in a subprocess, or with `threaded` in a daemon thread of current process, which starts
+            faster and saves a process, but shares the GIL and the CPU time of current process.
+        `calibrate=False` skips the measurement of the sampling latency at start, and `calibration_cache`
+            reuses it across runs, see ResourceLogger.
+        If `track_children`, the subprocesses of current process (e.g. worker pools) are monitored too,
+            but not the subprocesses of the monitor itself (the resource logger, the shared event drainer).
+        If `burst_interval` is given, the logger samples at that interval while any region
+            marked by `monitor_region(..., burst=True)`/`monitor_function(..., burst=True)` is active.
+        `metrics` selects the collectors and their intervals, e.g. "cpu,memory,smaps:1".
+        If `serve_port` or `serve_unix` is given, the latest sample is served in OpenMetrics format there.
+        With `output_format="agent"`, `output_file` is the address of the collector, see `remote`.
         See the docs of ResourceLogger.
     """
-    global RESOURCE_LOGGING_SUBPROCESS, RESOURCE_LOGGING_STOP_EVENT
+    global RESOURCE_LOGGING_SUBPROCESS, RESOURCE_LOGGING_STOP_EVENT, RESOURCE_LOGGER, RESOURCE_LOGGING_THREAD
 
     pid = getpid()
+    assert output_format != "agent" or output_file is not None, "the agent needs the address of the collector"
     if output_file is None:
         output_file = f"resource_monitor_PID{pid}.log"
 
+    _create_values(shared=not threaded)
+    if threaded:
+        RESOURCE_LOGGING_STOP_EVENT = threading.Event()
+        RESOURCE_LOGGER = ResourceLogger(
+            pid, output_file, interval, gpu_ids, RESOURCE_LOGGING_STOP_EVENT, backend, output_format, burst_interval,
+            None if burst_interval is None else RESOURCE_LOGGING_BURST_COUNTER, track_children=track_children,
+            metrics=metrics, sample_time=RESOURCE_LOGGING_SAMPLE_TIME, serve_port=serve_port, serve_unix=serve_unix,
+            calibrate=calibrate, calibration_cache=calibration_cache,
+            excluded_pids=_create_excluded_pids(shared=False) if track_children else None,
+        )
+        RESOURCE_LOGGING_THREAD = threading.Thread(
+            target=RESOURCE_LOGGER.run, name="resource_monitor_sampler", daemon=True
+        )
+        RESOURCE_LOGGING_THREAD.start()
+        return
+
+    RESOURCE_LOGGING_STOP_EVENT = Event()
     read_pipe, write_pipe = Pipe(False)
 
     monitor_process = Process(
         target=resource_logging_worker,
-        args=[pid, write_pipe, output_file, interval, gpu_ids, RESOURCE_LOGGING_STOP_EVENT]
+        args=[
+            pid, write_pipe, output_file, interval, gpu_ids, RESOURCE_LOGGING_STOP_EVENT, backend, output_format,
+            burst_interval, None if burst_interval is None else RESOURCE_LOGGING_BURST_COUNTER, track_children,
+            metrics, RESOURCE_LOGGING_SAMPLE_TIME, serve_port, serve_unix, calibrate, calibration_cache,
+            _create_excluded_pids(shared=True) if track_children else None,
+        ]
     )
     monitor_process.start()
     _ = read_pipe.recv()
     RESOURCE_LOGGING_SUBPROCESS = monitor_process
 
 
+def shared_event_draining_worker(spec: str, write_pipe, drain_interval: float = 0.1, stop_event=None):
+    """ The worker function in the subprocess draining the shared event log. """
+    drainer = SharedEventDrainer(spec, drain_interval, stop_event)
+    write_pipe.send("kick off")
+    drainer.run()
+    drainer.clean_up()
+
+
 EVENT_LOGGER = None
+SHARED_EVENT_DRAINING_SUBPROCESS = None
+SHARED_EVENT_DRAINING_STOP_EVENT = None
+# the time (seconds) the shared event drainer is given to write out the last records at exit, before it is terminated
+SHARED_EVENT_DRAINING_JOIN_TIMEOUT = 5.0
+# the arguments of setup_root_event_logger, to set up the root event logger again in a forked child process
+EVENT_LOGGER_SETUP: Optional[Tuple[Optional[str], str, float]] = None
+STACK_PROFILER = None
+TRACER = None
+
+
+def _create_event_logger(output_file: str, mode: str, snapshot_interval: float) -> EventLogger:
+    if mode == "agent":
+        # imported on use, so that `python -m resource_monitor.remote` runs the module once
+        from .remote import AgentEventLogger
+        return AgentEventLogger(output_file)
+    if mode == "binary":
+        return BinaryEventLogger(output_file)
+    if mode == "aggregate":
+        return AggregateEventLogger(output_file, snapshot_interval)
+    assert mode == "text", f"got {mode}"
+    return EventLogger(output_file)
 
 
-def setup_root_event_logger(output_file: Optional[str] = None):
+def setup_root_event_logger(
+    output_file: Optional[str] = None, mode: str = "text", snapshot_interval: float = 10.0,
+    drain_interval: float = 0.1,
+):
     """
         Initialize the root event logger to monitor current process.
-        See the docs of EventLogger.
+        `mode` is "text" (EventLogger), "binary" (BinaryEventLogger), "aggregate" (AggregateEventLogger),
+            "shared" (SharedEventLogger) or "agent" (AgentEventLogger, `output_file` is the collector address).
+        `snapshot_interval` only applies to "aggregate".
+        A forked child process gets its own root event logger of the same mode, writing to
+            "event_monitor_PID<child pid>.log" by default or "<output_file stem>_PID<child pid><ext>",
+            or connected to the same collector with "agent".
+        With "shared", all the processes of the tree (forked or spawned) log to one ring buffer in shared memory
+            instead, drained to `output_file` every `drain_interval` seconds by a subprocess.
+        See the docs of EventLogger, BinaryEventLogger, AggregateEventLogger and SharedEventLogger.
     """
-    pid = getpid()
+    global EVENT_LOGGER, EVENT_LOGGER_SETUP, SHARED_EVENT_DRAINING_SUBPROCESS, SHARED_EVENT_DRAINING_STOP_EVENT
+    EVENT_LOGGER_SETUP = (output_file, mode, snapshot_interval)
+    assert mode != "agent" or output_file is not None, "the agent needs the address of the collector"
     if output_file is None:
-        output_file = f"event_monitor_PID{pid}.log"
-    global EVENT_LOGGER
-    EVENT_LOGGER = EventLogger(output_file)
+        output_file = f"event_monitor_PID{getpid()}.log"
+    if mode != "shared":
+        EVENT_LOGGER = _create_event_logger(output_file, mode, snapshot_interval)
+        return
+
+    EVENT_LOGGER = SharedEventLogger(output_file)
+    # spawned child processes attach by get_root_event_logger()
+    os.environ[SHARED_EVENT_ENV] = EVENT_LOGGER.spec()
+    read_pipe, write_pipe = Pipe(False)
+    SHARED_EVENT_DRAINING_STOP_EVENT = Event()
+    drain_process = Process(
+        target=shared_event_draining_worker,
+        args=[EVENT_LOGGER.spec(), write_pipe, drain_interval, SHARED_EVENT_DRAINING_STOP_EVENT],
+        daemon=True,
+    )
+    drain_process.start()
+    _add_helper_pid(drain_process.pid)
+    _ = read_pipe.recv()
+    SHARED_EVENT_DRAINING_SUBPROCESS = drain_process
+
+
+def setup_root_stack_profiler(
+    output_file: Optional[str] = None,
+    interval: float = 0.01,
+    flush_interval: float = 1.0,
+    max_overhead: float = 0.02,
+):
+    """
+        Start sampling the Python stacks of current process in a background thread.
+        The stack samples are tagged with the latest sample of the root resource logger, if it is set up,
+            so `report.attribute_stacks` can attribute the CPU time and the RSS growth to functions and lines.
+        See the docs of StackProfiler.
+    """
+    global STACK_PROFILER
+    if output_file is None:
+        output_file = f"stack_profile_PID{getpid()}.log"
+    if STACK_PROFILER is not None:
+        STACK_PROFILER.clean_up()
+    STACK_PROFILER = StackProfiler(
+        output_file, interval, flush_interval, max_overhead=max_overhead,
+        sample_time=None if RESOURCE_LOGGING_SUBPROCESS is None and RESOURCE_LOGGING_THREAD is None
+        else RESOURCE_LOGGING_SAMPLE_TIME,
+    )
+    STACK_PROFILER.start()
+
+
+def setup_root_tracer(
+    include: Sequence[str] = ("*",),
+    exclude: Sequence[str] = (),
+    min_duration: float = 0.,
+    sample_every: int = 1,
+    backend: str = "auto",
+):
+    """
+        Trace the calls of the functions matching `include` and not `exclude` (patterns of "<module>.<qualname>")
+            to the root event logger, without decorating them. See the docs of FunctionTracer.
+    """
+    global TRACER
+    if TRACER is not None:
+        TRACER.stop()
+    TRACER = FunctionTracer(get_root_event_logger(), include, exclude, min_duration, sample_every, backend)
+    TRACER.start()
 
 
 def get_root_event_logger():
     """" If the event logger is not initialized, use default arguments to initialize it. """
     global EVENT_LOGGER
     if EVENT_LOGGER is None:
-        setup_root_event_logger()
+        if SHARED_EVENT_ENV in os.environ:
+            # a spawned child process of a root process with a shared event log
+            EVENT_LOGGER = SharedEventLogger.attach(os.environ[SHARED_EVENT_ENV])
+        else:
+            setup_root_event_logger()
     return EVENT_LOGGER
 
 
+def _enter_burst():
+    """ signal the resource logger to sample at the burst rate """
+    if RESOURCE_LOGGING_BURST_COUNTER is None:
+        _create_values(shared=False)
+    with RESOURCE_LOGGING_BURST_COUNTER.get_lock():
+        RESOURCE_LOGGING_BURST_COUNTER.value += 1
+
+
+def _exit_burst():
+    """ signal the resource logger that a marked region exits """
+    with RESOURCE_LOGGING_BURST_COUNTER.get_lock():
+        RESOURCE_LOGGING_BURST_COUNTER.value -= 1
+
+
+def _current_task_id() -> Optional[int]:
+    """ ID of the running asyncio task """
+    asyncio = sys.modules.get("asyncio")
+    if asyncio is None:
+        # no event loop runs before asyncio is imported, which is slow to import
+        return None
+    try:
+        task = asyncio.current_task()
+    except RuntimeError:
+        # no running event loop
+        return None
+    return None if task is None else id(task)
+
+
 def monitor_function(
-    event_logger: Optional[EventLogger] = None, function_name: Optional[str] = None
+    event_logger: Optional[EventLogger] = None, function_name: Optional[str] = None, burst: bool = False
 ):
     """
         Monitor the calling/returning of the wrapped function.
         The default event name is the function name.
+        If `burst`, the root resource logger samples at its burst rate during the calls.
+
+        Coroutine functions are monitored from the start to the end of the awaited coroutine, tagged
+            with the asyncio task. Generator functions (also async ones) are monitored from the first
+            iteration to the exhaustion or the closing of the generator.
+        A call that raises is logged by `log_error` instead of `log_end`.
+        Calls are numbered as event IDs atomically, so the wrapped function can run in several threads.
     """
     def monitorit_wrapper(func):
-        nonlocal event_logger, function_name, function_name
-        if function_name is None:
-            function_name = func.__name__
+        name = func.__name__ if function_name is None else function_name
+        assert event_logger is None or isinstance(event_logger, EventLogger)
+        # next() of itertools.count is atomic
+        call_ids = count(1)
+        # the calls read the root event logger from EVENT_LOGGER, which is replaced in a forked child
+        #   by the fork hook, and set it up by get_root_event_logger() only the first time
 
-        call_counter = 0
+        if iscoroutinefunction(func):
+            @wraps(func)
+            async def coroutine_wrapper(*args, **kwargs):
+                logger = event_logger if event_logger is not None else EVENT_LOGGER or get_root_event_logger()
+                call_id, task_id = next(call_ids), _current_task_id()
+                if burst:
+                    _enter_burst()
+                logger.log_start(name, call_id, task_id)
+                try:
+                    result = await func(*args, **kwargs)
+                except BaseException:
+                    logger.log_error(name, call_id, task_id)
+                    raise
+                else:
+                    logger.log_end(name, call_id, task_id)
+                    return result
+                finally:
+                    if burst:
+                        _exit_burst()
+            return coroutine_wrapper
 
+        if isasyncgenfunction(func):
+            @wraps(func)
+            async def async_generator_wrapper(*args, **kwargs):
+                logger = event_logger if event_logger is not None else EVENT_LOGGER or get_root_event_logger()
+                call_id, task_id = next(call_ids), _current_task_id()
+                generator = func(*args, **kwargs)
+                if burst:
+                    _enter_burst()
+                logger.log_start(name, call_id, task_id)
+                try:
+                    value = await generator.__anext__()
+                    while True:
+                        try:
+                            sent = yield value
+                        except GeneratorExit:
+                            await generator.aclose()
+                            raise
+                        except BaseException as e:  # pylint: disable=broad-except
+                            value = await generator.athrow(e)
+                        else:
+                            value = await generator.asend(sent)
+                except StopAsyncIteration:
+                    logger.log_end(name, call_id, task_id)
+                except GeneratorExit:
+                    logger.log_end(name, call_id, task_id)
+                    raise
+                except BaseException:
+                    logger.log_error(name, call_id, task_id)
+                    raise
+                finally:
+                    if burst:
+                        _exit_burst()
+            return async_generator_wrapper
+
+        if isgeneratorfunction(func):
+            @wraps(func)
+            def generator_wrapper(*args, **kwargs):
+                logger = event_logger if event_logger is not None else EVENT_LOGGER or get_root_event_logger()
+                call_id = next(call_ids)
+                if burst:
+                    _enter_burst()
+                logger.log_start(name, call_id)
+                try:
+                    result = yield from func(*args, **kwargs)
+                except GeneratorExit:
+                    logger.log_end(name, call_id)
+                    raise
+                except BaseException:
+                    logger.log_error(name, call_id)
+                    raise
+                else:
+                    logger.log_end(name, call_id)
+                    return result
+                finally:
+                    if burst:
+                        _exit_burst()
+            return generator_wrapper
+
+        @wraps(func)
         def func_wrapper(*args, **kwargs):
-            nonlocal event_logger, function_name, call_counter
-            if event_logger is None:
-                event_logger = get_root_event_logger()
+            logger = event_logger if event_logger is not None else EVENT_LOGGER or get_root_event_logger()
+            call_id = next(call_ids)
+            if burst:
+                _enter_burst()
+            logger.log_start(name, call_id)
+            try:
+                result = func(*args, **kwargs)
+            except BaseException:
+                logger.log_error(name, call_id)
+                raise
             else:
-                assert isinstance(event_logger, EventLogger)
-            call_counter += 1
-            my_counter = call_counter
-            event_logger.log_start(function_name, my_counter)
-            results = func(*args, **kwargs)
-            event_logger.log_end(function_name, my_counter)
-            return results
+                logger.log_end(name, call_id)
+                return result
+            finally:
+                if burst:
+                    _exit_burst()
 
         return func_wrapper
 
@@ -112,43 +475,142 @@ def monitor_function(
 
 class MonitorRegion:
     """
-        Monitor the code inside a with-statement block.
+        Monitor the code inside a with-statement or async with-statement block.
+        If `burst`, the root resource logger samples at its burst rate inside the block.
+        An async with-statement block is tagged with the asyncio task.
+        A block exiting by an exception is logged by `log_error` instead of `log_end`.
     """
-    counter: Dict[str, int] = {}
+    # next() of itertools.count is atomic, so regions are numbered safely across threads
+    counter: Dict[str, Iterator[int]] = {}
 
     def __init__(
-        self, region_name: str, event_logger: Optional[EventLogger] = None
+        self, region_name: str, event_logger: Optional[EventLogger] = None, burst: bool = False
     ) -> None:
         self.event_logger = (
-            get_root_event_logger() if event_logger is None else event_logger
+            EVENT_LOGGER or get_root_event_logger() if event_logger is None else event_logger
         )
         self.region_name = region_name
-        if self.region_name in MonitorRegion.counter:
-            MonitorRegion.counter[self.region_name] += 1
-        else:
-            MonitorRegion.counter[self.region_name] = 1
-
-        self.count = MonitorRegion.counter[self.region_name]
+        self.burst = burst
+        ids = MonitorRegion.counter.get(region_name)
+        if ids is None:
+            ids = MonitorRegion.counter.setdefault(region_name, count(1))
+        self.count = next(ids)
+        self.task_id: Optional[int] = None
 
     def __enter__(self):
-        self.event_logger.log_start(self.region_name, self.count)
+        if self.burst:
+            _enter_burst()
+        self.event_logger.log_start(self.region_name, self.count, self.task_id)
 
-    def __exit__(self, *_):
-        self.event_logger.log_end(self.region_name, self.count)
+    def __exit__(self, exc_type, *_):
+        if exc_type is None or exc_type is GeneratorExit:
+            self.event_logger.log_end(self.region_name, self.count, self.task_id)
+        else:
+            self.event_logger.log_error(self.region_name, self.count, self.task_id)
+        if self.burst:
+            _exit_burst()
+
+    async def __aenter__(self):
+        self.task_id = _current_task_id()
+        self.__enter__()
+
+    async def __aexit__(self, *exc_info):
+        self.__exit__(*exc_info)
 
 
-def monitor_region(region_name, event_logger=None):
+def monitor_region(region_name, event_logger=None, burst=False):
     """ return a new MonitorRegion context manager """
-    return MonitorRegion(region_name, event_logger)
+    return MonitorRegion(region_name, event_logger, burst)
 
 
 @register
 def clean_up():
     """"clean up root loggers if initialized """
-    global EVENT_LOGGER, RESOURCE_LOGGING_SUBPROCESS
+    global EVENT_LOGGER, RESOURCE_LOGGING_SUBPROCESS, SHARED_EVENT_DRAINING_SUBPROCESS, TRACER, RESOURCE_LOGGER, \
+        RESOURCE_LOGGING_THREAD
+    if TRACER is not None:
+        TRACER.stop()
+        TRACER = None
+    if STACK_PROFILER is not None:
+        STACK_PROFILER.clean_up()
     if EVENT_LOGGER is not None:
         EVENT_LOGGER.clean_up()
-    if RESOURCE_LOGGING_STOP_EVENT is not None:
-        RESOURCE_LOGGING_STOP_EVENT.set()
+    if SHARED_EVENT_DRAINING_SUBPROCESS is not None:
+        # the drainer writes out the records released by clean_up()
+        SHARED_EVENT_DRAINING_STOP_EVENT.set()
+        SHARED_EVENT_DRAINING_SUBPROCESS.join(SHARED_EVENT_DRAINING_JOIN_TIMEOUT)
+        if SHARED_EVENT_DRAINING_SUBPROCESS.is_alive():
+            SHARED_EVENT_DRAINING_SUBPROCESS.terminate()
+            warnings.warn(
+                f"the shared event drainer did not finish in {SHARED_EVENT_DRAINING_JOIN_TIMEOUT} seconds "
+                f"and is terminated, the last events of {EVENT_LOGGER.output} may be lost", RuntimeWarning
+            )
+        SHARED_EVENT_DRAINING_SUBPROCESS = None
+        EVENT_LOGGER.unlink()
+        os.environ.pop(SHARED_EVENT_ENV, None)
     if RESOURCE_LOGGING_SUBPROCESS is not None:
-        RESOURCE_LOGGING_SUBPROCESS.terminate()
+        # the stop event wakes the logger up, it takes the last sample and writes out (or sends) the buffered ones
+        RESOURCE_LOGGING_STOP_EVENT.set()
+        RESOURCE_LOGGING_SUBPROCESS.join(RESOURCE_LOGGING_JOIN_TIMEOUT)
+        if RESOURCE_LOGGING_SUBPROCESS.is_alive():
+            RESOURCE_LOGGING_SUBPROCESS.terminate()
+        RESOURCE_LOGGING_SUBPROCESS = None
+    if RESOURCE_LOGGING_THREAD is not None:
+        # the stop event wakes the thread up, it takes the last sample and flushes
+        RESOURCE_LOGGING_STOP_EVENT.set()
+        RESOURCE_LOGGING_THREAD.join()
+        # closes the writer too
+        RESOURCE_LOGGER.clean_up()
+        RESOURCE_LOGGING_THREAD = None
+        RESOURCE_LOGGER = None
+
+
+def _clean_up_event_logger():
+    if EVENT_LOGGER is not None:
+        EVENT_LOGGER.clean_up()
+
+
+def _after_fork_in_child():
+    """
+        The root loggers belong to the parent process, a forked child must not write to or stop them.
+        The root event logger is set up again with an output of the child's own, unless it is shared.
+    """
+    global EVENT_LOGGER, STACK_PROFILER, RESOURCE_LOGGING_SUBPROCESS, SHARED_EVENT_DRAINING_SUBPROCESS, \
+        RESOURCE_LOGGER, RESOURCE_LOGGING_THREAD
+    # the profiler thread, the resource logging thread and the subprocesses are the parent's
+    STACK_PROFILER = None
+    RESOURCE_LOGGING_SUBPROCESS = None
+    if RESOURCE_LOGGER is not None:
+        _discard_file(getattr(RESOURCE_LOGGER.writer, "output", None))
+        RESOURCE_LOGGER = None
+        RESOURCE_LOGGING_THREAD = None
+    SHARED_EVENT_DRAINING_SUBPROCESS = None
+    if EVENT_LOGGER is None:
+        return
+    if isinstance(EVENT_LOGGER, SharedEventLogger):
+        # shared by the process tree
+        EVENT_LOGGER.after_fork()
+        return
+    EVENT_LOGGER.discard()
+    EVENT_LOGGER = None
+    if EVENT_LOGGER_SETUP is not None:
+        output_file, mode, snapshot_interval = EVENT_LOGGER_SETUP
+        if output_file is None:
+            output_file = f"event_monitor_PID{getpid()}.log"
+        elif mode != "agent":
+            stem, ext = os.path.splitext(output_file)
+            output_file = f"{stem}_PID{getpid()}{ext}"
+        EVENT_LOGGER = _create_event_logger(output_file, mode, snapshot_interval)
+    if TRACER is not None:
+        # the hooks, inherited by the child, hold the discarded logger
+        TRACER.stop()
+        if EVENT_LOGGER is not None:
+            TRACER.event_logger = EVENT_LOGGER
+            TRACER.start()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
+    # multiprocessing children exit without the atexit handlers but with the finalizers,
+    #   which are registered after multiprocessing resets them in the child
+    register_after_fork(_clean_up_event_logger, lambda _: Finalize(None, _clean_up_event_logger, exitpriority=0))
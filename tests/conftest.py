@@ -0,0 +1,15 @@
+import sys
+
+import pytest
+
+from . import fake_pynvml as fake_pynvml_module
+
+
+@pytest.fixture
+def fake_pynvml(monkeypatch):
+    """ the fake `pynvml` with two idle GPUs, imported by `resource_monitor.gpu_logger` instead of pynvml """
+    fake_pynvml_module.reset(2)
+    monkeypatch.setitem(sys.modules, "pynvml", fake_pynvml_module)
+    # imported again with the fake
+    monkeypatch.delitem(sys.modules, "resource_monitor.gpu_logger", raising=False)
+    return fake_pynvml_module
@@ -0,0 +1,110 @@
+"""
+    A fake of the `pynvml` API used by GpuLogger, to test the GPU path on machines without a GPU.
+
+    Set up the fake GPUs with `reset()` and edit `DEVICES`, then import GpuLogger with this module
+        as `pynvml` (see the `fake_pynvml` fixture). `CALLS` counts the queries per function.
+"""
+from collections import Counter
+from typing import Dict, List, NamedTuple, Tuple
+
+
+class NVMLError(Exception):
+    """ same as pynvml.NVMLError """
+
+
+class _Memory(NamedTuple):
+    total: int
+    free: int
+    used: int
+
+
+class _Utilization(NamedTuple):
+    gpu: int
+    memory: int
+
+
+class _Process(NamedTuple):
+    pid: int
+    usedGpuMemory: int
+
+
+class _ProcessUtilizationSample(NamedTuple):
+    pid: int
+    timeStamp: int
+    smUtil: int
+    memUtil: int
+    encUtil: int
+    decUtil: int
+
+
+class FakeDevice:
+    """ The state of a fake GPU. """
+
+    def __init__(self, total: int = 16 << 30) -> None:
+        self.total = total
+        self.used = 0
+        self.utilization = 0
+        # PID to the GPU memory used by the process, None if unknown (e.g. on Windows)
+        self.processes: Dict[int, int] = {}
+        # (PID, timestamp in microseconds, SM utilization percent) of the process utilization samples
+        self.process_samples: List[Tuple[int, int, int]] = []
+
+
+DEVICES: List[FakeDevice] = []
+CALLS: Counter = Counter()
+INITIALIZED = False
+
+
+def reset(n_devices: int) -> None:
+    """ `n_devices` idle fake GPUs, and no query counted """
+    global INITIALIZED
+    DEVICES[:] = [FakeDevice() for _ in range(n_devices)]
+    CALLS.clear()
+    INITIALIZED = False
+
+
+def _device(handle: int) -> FakeDevice:
+    if not INITIALIZED:
+        raise NVMLError("uninitialized")
+    return DEVICES[handle]
+
+
+def nvmlInit() -> None:
+    global INITIALIZED
+    INITIALIZED = True
+
+
+def nvmlDeviceGetHandleByIndex(index: int) -> int:
+    CALLS["nvmlDeviceGetHandleByIndex"] += 1
+    if not 0 <= index < len(DEVICES):
+        raise NVMLError("invalid argument")
+    _device(index)
+    return index
+
+
+def nvmlDeviceGetMemoryInfo(handle: int) -> _Memory:
+    CALLS["nvmlDeviceGetMemoryInfo"] += 1
+    device = _device(handle)
+    return _Memory(device.total, device.total - device.used, device.used)
+
+
+def nvmlDeviceGetUtilizationRates(handle: int) -> _Utilization:
+    CALLS["nvmlDeviceGetUtilizationRates"] += 1
+    return _Utilization(_device(handle).utilization, 0)
+
+
+def nvmlDeviceGetComputeRunningProcesses(handle: int) -> List[_Process]:
+    CALLS["nvmlDeviceGetComputeRunningProcesses"] += 1
+    return [_Process(pid, used) for pid, used in _device(handle).processes.items()]
+
+
+def nvmlDeviceGetProcessUtilization(handle: int, lastSeenTimeStamp: int) -> List[_ProcessUtilizationSample]:
+    CALLS["nvmlDeviceGetProcessUtilization"] += 1
+    samples = [
+        _ProcessUtilizationSample(pid, timestamp, sm, 0, 0, 0)
+        for pid, timestamp, sm in _device(handle).process_samples if timestamp > lastSeenTimeStamp
+    ]
+    if len(samples) == 0:
+        # NVML_ERROR_NOT_FOUND
+        raise NVMLError("not found")
+    return samples
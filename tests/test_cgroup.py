@@ -0,0 +1,72 @@
+"""
+    The cgroup collector on a fake cgroup v2 directory.
+"""
+import os
+import shutil
+
+import pytest
+
+from resource_monitor.collectors import CgroupCollector, resolve_cgroup
+
+
+# two snapshots of the interface files, 2 seconds apart; io.pressure is missing
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "cgroup")
+
+
+def _update(cgroup, snapshot):
+    """ rewrite the files in place, the collector keeps them open """
+    source = os.path.join(FIXTURES, snapshot)
+    for name in os.listdir(source):
+        with open(os.path.join(source, name), "rb") as src, open(os.path.join(cgroup, name), "wb") as dst:
+            dst.write(src.read())
+
+
+def test_cgroup_deltas(tmp_path):
+    cgroup = str(tmp_path / "job.service")
+    shutil.copytree(os.path.join(FIXTURES, "t0"), cgroup)
+    assert resolve_cgroup(cgroup) == cgroup
+    collector = CgroupCollector(None, None, cgroup)
+    try:
+        columns = collector.columns()
+        first = dict(zip(columns, collector.collect({}, 100.)))
+        _update(cgroup, "t1")
+        second = dict(zip(columns, collector.collect({}, 102.)))
+    finally:
+        collector.clean_up()
+
+    # no percents on the first sample
+    assert first == {
+        "cgroup_cpu_percent": 0., "cgroup_cpu_throttled_percent": 0.,
+        "cgroup_memory_mb": 100, "cgroup_anon_mb": 60, "cgroup_file_mb": 30,
+        "cgroup_read_count": 40, "cgroup_read_mb": 4, "cgroup_write_count": 20, "cgroup_write_mb": 2,
+        "cgroup_cpu_some_percent": 0., "cgroup_cpu_full_percent": 0.,
+        "cgroup_memory_some_percent": 0., "cgroup_memory_full_percent": 0.,
+        "cgroup_io_some_percent": 0., "cgroup_io_full_percent": 0.,
+    }
+    expected = {
+        # 1 s of CPU and 0.2 s throttled in 2 s
+        "cgroup_cpu_percent": 50., "cgroup_cpu_throttled_percent": 10.,
+        "cgroup_memory_mb": 200, "cgroup_anon_mb": 120, "cgroup_file_mb": 70,
+        # cumulative counters, summed over the devices
+        "cgroup_read_count": 120, "cgroup_read_mb": 12, "cgroup_write_count": 108, "cgroup_write_mb": 11,
+        "cgroup_cpu_some_percent": 20., "cgroup_cpu_full_percent": 5.,
+        "cgroup_memory_some_percent": 3., "cgroup_memory_full_percent": 1.,
+        "cgroup_io_some_percent": 0., "cgroup_io_full_percent": 0.,
+    }
+    assert second.keys() == expected.keys()
+    for column, value in expected.items():
+        assert second[column] == pytest.approx(value), column
+
+
+def test_cgroup_reset(tmp_path):
+    cgroup = str(tmp_path / "job.service")
+    shutil.copytree(os.path.join(FIXTURES, "t0"), cgroup)
+    collector = CgroupCollector(None, None, cgroup)
+    try:
+        collector.collect({}, 100.)
+        _update(cgroup, "t1")
+        collector.reset()
+        # the sample after a reset starts a new span
+        assert collector.collect({}, 102.)[:2] == [0., 0.]
+    finally:
+        collector.clean_up()
@@ -0,0 +1,59 @@
+"""
+    Per-thread buffers of the event loggers.
+"""
+import gc
+import threading
+
+from resource_monitor.event_logger import BinaryEventLogger, EventLogger
+from resource_monitor.report import parse_binary_event_log, parse_event_log
+
+
+N_THREADS = 200
+
+
+def test_thread_buffers_freed_at_exit(tmp_path):
+    path = str(tmp_path / "events.log")
+    logger = BinaryEventLogger(path)
+
+    def work(i):
+        logger.log_start("request", i)
+        logger.log_end("request", i)
+
+    for i in range(N_THREADS):
+        thread = threading.Thread(target=work, args=(i,))
+        thread.start()
+        thread.join()
+    gc.collect()
+    # each exited thread wrote its records out and dropped its buffer
+    assert len(logger.buffers) == 0
+    logger.clean_up()
+
+    names, records = parse_binary_event_log(path)
+    assert names == ["request"]
+    assert len(records) == 2 * N_THREADS
+
+
+def test_text_lines_of_threads(tmp_path):
+    path = str(tmp_path / "events.log")
+    logger = EventLogger(path, batch_lines=16)
+
+    def work(i):
+        for j in range(100):
+            logger.log_start(f"thread_{i}", j)
+            logger.log_end(f"thread_{i}", j)
+
+    threads = [threading.Thread(target=work, args=(i,)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    gc.collect()
+    # the exited threads wrote out their last lines
+    assert len(logger.line_buffers) == 0
+    logger.clean_up()
+
+    intervals = parse_event_log(path)
+    assert sorted(intervals) == [f"thread_{i}" for i in range(8)]
+    for occurrences in intervals.values():
+        assert occurrences.shape == (100, 2)
+        assert (occurrences[:, 1] >= occurrences[:, 0]).all()
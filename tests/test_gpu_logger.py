@@ -0,0 +1,87 @@
+"""
+    GpuLogger and the gpu collector against the fake pynvml.
+"""
+import os
+import threading
+import time
+
+import pytest
+
+from resource_monitor.report import parse_resource_log
+from resource_monitor.resource_logger import ResourceLogger
+
+
+MEGABYTE = 1024**2
+
+
+def test_sample_queries_every_gpu_once(fake_pynvml):
+    from resource_monitor.gpu_logger import GpuLogger
+
+    fake_pynvml.DEVICES[0].processes = {11: 100 * MEGABYTE, 12: 50 * MEGABYTE, 13: 7 * MEGABYTE}
+    fake_pynvml.DEVICES[0].used = 300 * MEGABYTE
+    fake_pynvml.DEVICES[0].utilization = 40
+    fake_pynvml.DEVICES[1].processes = {12: 20 * MEGABYTE}
+    fake_pynvml.DEVICES[1].used = 20 * MEGABYTE
+    fake_pynvml.DEVICES[1].utilization = 5
+    gpu_logger = GpuLogger([11, 12], [0, 1])
+    fake_pynvml.CALLS.clear()
+
+    samples = gpu_logger.sample()
+    assert samples.tolist() == [[150 * MEGABYTE, 300 * MEGABYTE, 40], [20 * MEGABYTE, 20 * MEGABYTE, 5]]
+    for name in ("nvmlDeviceGetComputeRunningProcesses", "nvmlDeviceGetMemoryInfo", "nvmlDeviceGetUtilizationRates"):
+        assert fake_pynvml.CALLS[name] == 2
+    assert fake_pynvml.CALLS["nvmlDeviceGetProcessUtilization"] == 0
+    # preallocated
+    assert gpu_logger.sample() is samples
+
+
+def test_process_sm_utilization(fake_pynvml):
+    from resource_monitor.gpu_logger import GpuLogger
+
+    gpu_logger = GpuLogger([11, 12], [0, 1], process_utilization=True)
+    # several samples per process since the last query, and a process not monitored
+    fake_pynvml.DEVICES[0].process_samples = [
+        (11, 1, 60), (11, 2, 80), (12, 1, 10), (12, 2, 30), (13, 2, 90),
+    ]
+    samples = gpu_logger.sample()
+    # the mean per process, summed over the processes
+    assert samples[0, 3] == 70 + 20
+    # no sample on the GPU at all
+    assert samples[1, 3] == 0
+    # only the samples newer than the last query count
+    assert gpu_logger.sample()[0, 3] == 0
+    fake_pynvml.DEVICES[0].process_samples.extend([(11, 3, 100), (11, 4, 100), (12, 3, 100)])
+    assert gpu_logger.sample()[0, 3] == 100
+
+
+@pytest.mark.parametrize("output_format", ["csv", "binary", "rollup"])
+def test_gpu_columns(fake_pynvml, tmp_path, output_format):
+    pid = os.getpid()
+    fake_pynvml.DEVICES[0].processes = {pid: 512 * MEGABYTE, pid + 1: 256 * MEGABYTE}
+    fake_pynvml.DEVICES[0].used = 2048 * MEGABYTE
+    fake_pynvml.DEVICES[0].utilization = 37
+    fake_pynvml.DEVICES[0].process_samples = [(pid, 1, 20), (pid, 2, 40)]
+    output = str(tmp_path / f"resources.{output_format}")
+    stop_event = threading.Event()
+    logger = ResourceLogger(
+        pid, output, interval=0.02, gpu_ids=[0, 1], stop_event=stop_event, output_format=output_format,
+        gpu_process_utilization=True, calibrate=False,
+    )
+    thread = threading.Thread(target=logger.run)
+    thread.start()
+    time.sleep(0.3)
+    stop_event.set()
+    thread.join()
+    logger.clean_up()
+
+    global_info, resource_usage = parse_resource_log(output)
+    assert global_info["gpu_0_total_mb"] == 16384
+    assert global_info["gpu_0_free_mb"] == 16384 - 2048
+    assert len(resource_usage["time"]) >= 5
+    assert (resource_usage["gpu_0_mem_mb"] == 512).all()
+    assert (resource_usage["gpu_0_mem_mb_global"] == 2048).all()
+    assert (resource_usage["gpu_0_utilization_percent_global"] == 37).all()
+    # the process samples are only new to the first query
+    assert resource_usage["gpu_0_sm_utilization_percent"].max() == 30
+    for column in ("mem_mb", "mem_mb_global", "utilization_percent_global", "sm_utilization_percent"):
+        assert (resource_usage[f"gpu_1_{column}"] == 0).all()
@@ -0,0 +1,61 @@
+"""
+    The binary resource writer on a file with short writes, and the rollup writer's slots.
+"""
+from resource_monitor.log_format import BinaryResourceWriter, RollupResourceWriter
+from resource_monitor.report import parse_binary_resource_log, parse_rollup_log
+
+
+class _ShortWriteFile:
+    """ an unbuffered file writing at most a few bytes per write(), as a pipe or a signal may cause """
+
+    def __init__(self, file, max_bytes=5):
+        self.file = file
+        self.max_bytes = max_bytes
+
+    def write(self, data):
+        return self.file.write(data[:self.max_bytes])
+
+    def close(self):
+        self.file.close()
+
+
+def test_short_writes(tmp_path):
+    output = str(tmp_path / "resources.log")
+    writer = BinaryResourceWriter(output)
+    writer.output = _ShortWriteFile(writer.output)
+    writer.write_preamble("", {"n_cpu": 8}, ["time", "cpu_percent", "rss_mb"])
+    for i in range(100):
+        writer.write_row([float(i), i / 2, i])
+        if i % 10 == 9:
+            writer.flush()
+    writer.close()
+
+    global_info, records = parse_binary_resource_log(output)
+    assert global_info == {"n_cpu": 8}
+    assert len(records) == 100
+    assert records["time"].tolist() == [float(i) for i in range(100)]
+    assert records["rss_mb"].tolist() == list(range(100))
+
+
+def test_rollup_sample_at_time_zero(tmp_path):
+    output = str(tmp_path / "resources.log")
+    writer = RollupResourceWriter(output, raw_seconds=4., tiers=[(2., 100.)], min_interval=1.)
+    writer.write_preamble("", {"n_cpu": 8}, ["time", "rss_mb"])
+    # a time of 0 is a real sample, not an unwritten slot
+    for i in range(3):
+        writer.write_row([float(i), 10 + i])
+    writer.flush()
+    _, resolution, usage = parse_rollup_log(output, resolution=0.)
+    assert resolution == 0.
+    assert usage["time"].tolist() == [0., 1., 2.]
+    _, _, buckets = parse_rollup_log(output, resolution=2.)
+    assert buckets["time"].tolist() == [0., 2.]
+    assert buckets["count"].tolist() == [2, 1]
+    assert buckets["rss_mb_min"].tolist() == [10., 12.]
+
+    # past the capacity (5 slots), the ring wraps around and the sample at 0 is overwritten
+    for i in range(3, 7):
+        writer.write_row([float(i), 10 + i])
+    writer.close()
+    _, _, usage = parse_rollup_log(output, resolution=0.)
+    assert usage["time"].tolist() == [2., 3., 4., 5., 6.]
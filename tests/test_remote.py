@@ -0,0 +1,50 @@
+"""
+    Agents on localhost streaming to one collector.
+"""
+import os
+import subprocess
+import sys
+
+from resource_monitor.remote import RemoteCollector
+from resource_monitor.report import parse_remote_store
+
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+AGENT_INTERVAL = 0.01
+AGENT_SECONDS = 1.5
+# an agent runs the root resource logger in a subprocess, and exits after a while
+AGENT_SCRIPT = """
+import sys, time
+from resource_monitor.utils import setup_root_resource_logger
+setup_root_resource_logger(sys.argv[1], interval=float(sys.argv[2]), output_format="agent", calibrate=False)
+time.sleep(float(sys.argv[3]))
+"""
+
+
+def test_agents_to_collector(tmp_path):
+    store = str(tmp_path / "store")
+    collector = RemoteCollector("127.0.0.1:0", store, ping_interval=0.2)
+    collector.start()
+    try:
+        address = "127.0.0.1:%d" % collector.address[1]
+        env = dict(os.environ, PYTHONPATH=REPO_ROOT + os.pathsep + os.environ.get("PYTHONPATH", ""))
+        agents = [
+            subprocess.Popen(
+                [sys.executable, "-c", AGENT_SCRIPT, address, str(AGENT_INTERVAL), str(AGENT_SECONDS)], env=env
+            ) for _ in range(2)
+        ]
+        for agent in agents:
+            assert agent.wait(timeout=30) == 0
+    finally:
+        collector.clean_up()
+
+    parsed = parse_remote_store(store)
+    # the agent is the subprocess of the resource logger
+    assert len(set(agent["pid"] for agent in parsed)) == 2
+    for agent in parsed:
+        assert agent["kind"] == "resource"
+        assert agent["clock_offset_ns"] is not None
+        times = agent["resource_usage"]["time"]
+        # the last batch is sent at exit, so the samples cover the whole run
+        assert len(times) >= 0.8 * AGENT_SECONDS / AGENT_INTERVAL
+        assert (times[1:] > times[:-1]).all()
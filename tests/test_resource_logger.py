@@ -0,0 +1,73 @@
+"""
+    The layout and the scheduling columns of the resource log.
+"""
+import os
+import subprocess
+import sys
+import threading
+import time
+
+from resource_monitor.collectors import column_order
+from resource_monitor.resource_logger import ResourceLogger
+
+
+# the columns of the default collectors, in the order of the original CSV layout
+DEFAULT_HEADER = [
+    "time", "cpu_percent", "cpu_percent_global", "rss_mb", "vms_mb", "vms_global_mb", "swap_used_mb",
+    "read_count", "read_count_global", "read_mb", "read_mb_global",
+    "write_count", "write_count_global", "write_mb", "write_mb_global",
+]
+
+
+def test_default_column_order(tmp_path):
+    output = str(tmp_path / "resources.log")
+    process = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(0.3)"])
+    logger = ResourceLogger([process.pid], output, interval=0.05, calibrate=False)
+    logger.run()
+    logger.clean_up()
+    process.wait()
+
+    with open(output, encoding="utf-8") as f:
+        lines = f.read().splitlines()
+    header = lines[2].split(",")
+    # the new columns are appended
+    assert header[:len(DEFAULT_HEADER)] == DEFAULT_HEADER
+    assert header[len(DEFAULT_HEADER):] == ["sampling_latency", "deadline_slip", "missed_ticks"]
+    assert all(len(line.split(",")) == len(header) for line in lines[3:])
+
+
+def test_column_order_global_after_process():
+    columns = ["read_count", "read_mb", "gpu_0_mem_mb", "read_count_global", "read_mb_global", "cgroup_read_mb"]
+    assert [columns[i] for i in column_order(columns)] == [
+        "read_count", "read_count_global", "read_mb", "read_mb_global", "gpu_0_mem_mb", "cgroup_read_mb",
+    ]
+
+
+def test_slip_of_an_overrun(tmp_path):
+    output = str(tmp_path / "resources.log")
+    stop_event = threading.Event()
+    logger = ResourceLogger(os.getpid(), output, interval=0.05, stop_event=stop_event, calibrate=False)
+    sample = logger.get_resource_info
+    calls = 0
+
+    def slow_sample():
+        nonlocal calls
+        calls += 1
+        if calls == 3:
+            # overruns by more than 2 intervals
+            time.sleep(0.13)
+        if calls == 6:
+            stop_event.set()
+        return sample()
+
+    logger.get_resource_info = slow_sample
+    logger.run()
+    logger.clean_up()
+
+    with open(output, encoding="utf-8") as f:
+        lines = f.read().splitlines()
+    header = lines[2].split(",")
+    rows = [dict(zip(header, map(float, line.split(",")))) for line in lines[3:]]
+    assert rows[-1]["missed_ticks"] >= 2
+    # the samples start after their deadlines, the skipped ticks do not shift the slip
+    assert all(row["deadline_slip"] >= 0 for row in rows)
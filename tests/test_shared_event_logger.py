@@ -0,0 +1,40 @@
+"""
+    The shared event logger when all its slots are taken.
+"""
+import threading
+
+import pytest
+
+from resource_monitor.report import parse_binary_event_log
+from resource_monitor.shared_event_logger import SharedEventDrainer, SharedEventLogger
+
+
+N_THREADS = 4
+
+
+def test_dropped_records_are_warned(tmp_path):
+    output = str(tmp_path / "events.log")
+    logger = SharedEventLogger(output, slots=2)
+    drainer = SharedEventDrainer(logger.spec())
+    # the threads hold their slots at the same time, the threads without one drop their records
+    barrier = threading.Barrier(N_THREADS)
+
+    def work(i):
+        logger.log_start("event", i)
+        barrier.wait()
+        logger.log_end("event", i)
+
+    threads = [threading.Thread(target=work, args=(i,)) for i in range(N_THREADS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    try:
+        with pytest.warns(RuntimeWarning, match="4 events are dropped"):
+            drainer.clean_up()
+    finally:
+        logger.unlink()
+
+    assert drainer.dropped == 4
+    _, records = parse_binary_event_log(output)
+    assert len(records) == 4
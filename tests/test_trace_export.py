@@ -0,0 +1,43 @@
+"""
+    The Chrome trace export of an event log and a resource log.
+"""
+import json
+import os
+
+from resource_monitor.event_logger import BinaryEventLogger
+from resource_monitor.trace_export import export_trace
+
+
+def _reject_constant(name):
+    raise ValueError(f"not JSON: {name}")
+
+
+def test_trace_is_strict_json(tmp_path):
+    pid = os.getpid()
+    event_log = str(tmp_path / f"event_monitor_PID{pid}.log")
+    logger = BinaryEventLogger(event_log)
+    logger.log_start("step", 0)
+    logger.log_end("step", 0)
+    logger.clean_up()
+    resource_log = tmp_path / f"resource_monitor_PID{pid}.log"
+    resource_log.write_text(
+        "calibrated\n"
+        "n_cpu:8,\n"
+        "time,cpu_percent,cgroup_cpu_percent\n"
+        "1.0,10.0,nan\n"
+        "2.0,20.0,30.0\n"
+        "3.0,inf,nan\n"
+    )
+    output = str(tmp_path / "trace.json")
+    export_trace(output, [event_log], [str(resource_log)])
+
+    with open(output, encoding="utf-8") as f:
+        trace = json.load(f, parse_constant=_reject_constant)
+    events = trace["traceEvents"]
+    # one name per process, the counters show under the process of the events
+    names = [e for e in events if e["ph"] == "M" and e["name"] == "process_name"]
+    assert [(e["pid"], e["args"]["name"]) for e in names] == [(pid, f"PID {pid}")]
+    counters = [(e["name"], e["ts"], e["args"][e["name"]]) for e in events if e["ph"] == "C"]
+    assert sorted(counters) == [
+        ("cgroup_cpu_percent", 2e6, 30.), ("cpu_percent", 1e6, 10.), ("cpu_percent", 2e6, 20.),
+    ]
@@ -0,0 +1,53 @@
+"""
+    The sys.monitoring tool ID of the function tracer.
+"""
+import sys
+
+import pytest
+
+from resource_monitor.event_logger import EventLogger
+from resource_monitor.report import parse_event_log
+from resource_monitor.tracer import HAS_SYS_MONITORING, FunctionTracer
+
+
+pytestmark = pytest.mark.skipif(not HAS_SYS_MONITORING, reason="sys.monitoring requires Python 3.12+")
+
+
+def traced_function():
+    return 1
+
+
+def test_profiler_id_taken(tmp_path):
+    monitoring = sys.monitoring
+    output = str(tmp_path / "events.log")
+    logger = EventLogger(output)
+    # another profiler, e.g. cProfile
+    monitoring.use_tool_id(monitoring.PROFILER_ID, "another profiler")
+    try:
+        tracer = FunctionTracer(logger, include=[f"{__name__}.traced_function"], backend="monitoring")
+        tracer.start()
+        try:
+            assert tracer.tool_id != monitoring.PROFILER_ID
+            traced_function()
+        finally:
+            tracer.stop()
+        assert monitoring.get_tool(monitoring.PROFILER_ID) == "another profiler"
+    finally:
+        monitoring.free_tool_id(monitoring.PROFILER_ID)
+    logger.clean_up()
+    assert len(parse_event_log(output)[f"{__name__}.traced_function"]) == 1
+
+
+def test_no_free_tool_id(tmp_path):
+    monitoring = sys.monitoring
+    taken = [i for i in (monitoring.PROFILER_ID, 3, 4) if monitoring.get_tool(i) is None]
+    for tool_id in taken:
+        monitoring.use_tool_id(tool_id, "another tool")
+    try:
+        tracer = FunctionTracer(EventLogger(str(tmp_path / "events.log")), backend="monitoring")
+        with pytest.raises(RuntimeError, match="no free sys.monitoring tool ID"):
+            tracer.start()
+        assert tracer.tool_id is None
+    finally:
+        for tool_id in taken:
+            monitoring.free_tool_id(tool_id)